@@ -0,0 +1,83 @@
+from os import getenv
+from collections import OrderedDict
+import logging
+import threading
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Progress of a file is written at most this often, status changes are written straight away
+AUDIT_FLUSH_SECONDS = float(getenv("AUDIT_FLUSH_SECONDS", "5"))
+# Last status of records still being worked on, a warm container sees many files over its life
+AUDIT_MAX_TRACKED_KEYS = int(getenv("AUDIT_MAX_TRACKED_KEYS", "10000"))
+
+
+# Coalesces audit updates in memory, only the latest update of a record is written. Writes happen on a
+# background thread so the indexing threads never wait on DynamoDB, flush() writes whatever is left
+# and has to be called before the invocation returns, a frozen Lambda does not run the thread.
+# A failed write stays pending and is retried by the next flush unless a newer update replaced it
+class AuditWriter():
+
+    def __init__(self, write_fn, interval_seconds=AUDIT_FLUSH_SECONDS, is_final=lambda status: False, max_tracked_keys=AUDIT_MAX_TRACKED_KEYS):
+        # Called with the args of the latest update of a record, fails by raising
+        # or by returning a response whose statusCode is not '200'
+        self.write_fn = write_fn
+        self.interval_seconds = interval_seconds
+        # Records are forgotten once a status is_final is written, nothing follows it
+        self.is_final = is_final
+        self.max_tracked_keys = max_tracked_keys
+        # key -> (status, args)
+        self._pending = OrderedDict()
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {'audit_updates': 0, 'audit_writes': 0, 'audit_write_errors': 0}
+
+    def update(self, key, status, args):
+        with self._lock:
+            self._pending[key] = (status, args)
+            self._stats['audit_updates'] += 1
+            transition = self._statuses.get(key) != status
+            self._statuses[key] = status
+            self._statuses.move_to_end(key)
+            while len(self._statuses) > self.max_tracked_keys:
+                self._statuses.popitem(last=False)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if transition:
+            self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = OrderedDict()
+            for key, (status, args) in pending.items():
+                try:
+                    response = self.write_fn(*args)
+                    if isinstance(response, dict) and response.get('statusCode', '200') != '200':
+                        raise Exception(response.get('errorMessage', response))
+                except Exception as e:
+                    LOG.error(f'method=audit_writer_flush, key={key}, status={status}, error={e}')
+                    with self._lock:
+                        self._stats['audit_write_errors'] += 1
+                        if key not in self._pending:
+                            self._pending[key] = (status, args)
+                    continue
+                with self._lock:
+                    self._stats['audit_writes'] += 1
+                    if self.is_final(status) and key not in self._pending:
+                        self._statuses.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            self.flush()
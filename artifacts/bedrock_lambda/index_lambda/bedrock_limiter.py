@@ -0,0 +1,167 @@
+from os import getenv
+import logging
+import random
+import threading
+import time
+import boto3
+from botocore.config import Config
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+BEDROCK_MIN_CONCURRENCY = int(getenv("BEDROCK_MIN_CONCURRENCY", "1"))
+BEDROCK_INITIAL_CONCURRENCY = int(getenv("BEDROCK_INITIAL_CONCURRENCY", "2"))
+BEDROCK_MAX_CONCURRENCY = int(getenv("BEDROCK_MAX_CONCURRENCY", "16"))
+BEDROCK_MAX_RETRIES = int(getenv("BEDROCK_MAX_RETRIES", "6"))
+BEDROCK_BACKOFF_BASE_SECONDS = float(getenv("BEDROCK_BACKOFF_BASE_SECONDS", "0.5"))
+BEDROCK_BACKOFF_MAX_SECONDS = float(getenv("BEDROCK_BACKOFF_MAX_SECONDS", "20"))
+
+# Errors that mean "slow down", the call is retried and the limit is cut
+THROTTLING_ERRORS = ['ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                     'ModelTimeoutException', 'ModelNotReadyException',
+                     'ReadTimeoutError', 'ConnectTimeoutError']
+
+
+def is_throttling_error(e):
+    error_code = ''
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        error_code = response.get('Error', {}).get('Code', '')
+    return error_code in THROTTLING_ERRORS or type(e).__name__ in THROTTLING_ERRORS
+
+
+# AIMD limiter, the limit grows by one after a full window of successful calls
+# and is halved whenever Bedrock throttles or times out
+class AdaptiveConcurrencyLimiter():
+
+    def __init__(self, initial_limit=BEDROCK_INITIAL_CONCURRENCY, min_limit=BEDROCK_MIN_CONCURRENCY,
+                 max_limit=BEDROCK_MAX_CONCURRENCY):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self.in_flight = 0
+        self.throttles = 0
+        self.successes = 0
+        self._window_successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self._window_successes = 0
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.successes += 1
+                self._window_successes += 1
+                if self._window_successes >= int(self.limit):
+                    self._window_successes = 0
+                    self.limit = min(self.max_limit, self.limit + 1)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {'bedrock_limit': int(self.limit), 'bedrock_successes': self.successes, 'bedrock_throttles': self.throttles}
+
+
+# Shared by every Bedrock client in the Lambda so all threads back off together
+limiter = AdaptiveConcurrencyLimiter()
+
+
+# Body of a streaming invoke, holds its limiter slot until the events are read. A stream that is
+# abandoned releases the slot when closed or garbage collected
+class LimitedEventStream():
+
+    def __init__(self, stream, concurrency_limiter):
+        self.stream = stream
+        self.limiter = concurrency_limiter
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        throttled = False
+        try:
+            for event in self.stream:
+                # Throttles after the first byte arrive as events, not as errors
+                if isinstance(event, dict) and 'throttlingException' in event:
+                    throttled = True
+                yield event
+        except Exception as e:
+            throttled = throttled or is_throttling_error(e)
+            raise
+        finally:
+            self._release(throttled)
+
+    def close(self):
+        try:
+            if hasattr(self.stream, 'close'):
+                self.stream.close()
+        finally:
+            self._release()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __del__(self):
+        self._release()
+
+    def _release(self, throttled=False):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.limiter.release(throttled)
+
+
+# Wraps a bedrock-runtime client, every invoke goes through the limiter and
+# throttled calls are retried with full jitter exponential backoff
+class ThrottledBedrockClient():
+
+    def __init__(self, client, concurrency_limiter=None, max_retries=BEDROCK_MAX_RETRIES):
+        self.client = client
+        self.limiter = concurrency_limiter or limiter
+        self.max_retries = max_retries
+
+    def invoke_model(self, **kwargs):
+        return self._call(self.client.invoke_model, kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self._call(self.client.invoke_model_with_response_stream, kwargs, stream=True)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _call(self, method, kwargs, stream=False):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = method(**kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.limiter.release(throttled)
+                if not throttled or attempt >= self.max_retries:
+                    raise
+                LOG.warning(f'method=bedrock_invoke, model_id={kwargs.get("modelId")}, attempt={attempt}, error={type(e).__name__}')
+            else:
+                if stream:
+                    # The model keeps generating while the stream is read, the slot is released once it is drained
+                    response['body'] = LimitedEventStream(response['body'], self.limiter)
+                else:
+                    self.limiter.release()
+                return response
+            attempt += 1
+            time.sleep(random.uniform(0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * 2 ** attempt)))
+
+
+def create_bedrock_client():
+    # botocore retries are switched off so the limiter sees every throttle
+    client = boto3.client('bedrock-runtime', config=Config(retries={'max_attempts': 1, 'mode': 'standard'}))
+    return ThrottledBedrockClient(client)
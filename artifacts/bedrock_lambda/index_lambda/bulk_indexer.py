@@ -0,0 +1,171 @@
+from os import getenv
+import json
+import logging
+import random
+import threading
+import time
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+BULK_MAX_DOCS = int(getenv("BULK_MAX_DOCS", "500"))
+# AOSS rejects _bulk payloads above 10MB, stay well below it
+BULK_MAX_BYTES = int(getenv("BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+# Checked when an action is added, there is no timer: a buffer that stops growing waits for flush() or close()
+BULK_MAX_BUFFER_AGE_SECONDS = float(getenv("BULK_MAX_BUFFER_AGE_SECONDS", "5"))
+BULK_MAX_RETRIES = int(getenv("BULK_MAX_RETRIES", "3"))
+BULK_REQUEST_TIMEOUT = int(getenv("BULK_REQUEST_TIMEOUT", "300"))
+# Item level statuses worth retrying, everything else is a permanent failure
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+
+
+# Buffers bulk actions and sends them to Opensearch as a single _bulk request
+# once the buffered doc count, serialized bytes or age crosses a threshold on an add.
+# Only the failed items of a partially successful _bulk response are retried.
+class BulkIndexer():
+
+    def __init__(self, ops_client, index_name, max_docs=BULK_MAX_DOCS, max_bytes=BULK_MAX_BYTES,
+                 max_buffer_age_seconds=BULK_MAX_BUFFER_AGE_SECONDS, max_retries=BULK_MAX_RETRIES, max_in_flight=1):
+        self.ops_client = ops_client
+        self.index_name = index_name
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_buffer_age_seconds = max_buffer_age_seconds
+        self.max_retries = max_retries
+        self.errors = []
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started = time.time()
+        self._lock = threading.Lock()
+        # Keeps a single _bulk request in flight per indexer by default to protect AOSS OCUs,
+        # deletes are cheap enough to run a few concurrently
+        self._flush_lock = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._succeeded = 0
+        self._failed = 0
+        self._retried = 0
+        self._flush_latencies = []
+        self._sending = 0
+        self._idle = threading.Condition(self._lock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # on_result(item result) is called once the item is written, e.g. to record the server assigned _id
+    def index(self, doc, index_name=None, on_result=None):
+        action = {"index": {"_index": index_name or self.index_name}}
+        self._add(action, doc, on_result)
+
+    def delete(self, doc_id, index_name=None):
+        action = {"delete": {"_index": index_name or self.index_name, "_id": doc_id}}
+        self._add(action, None)
+
+    def _add(self, action, source, on_result=None):
+        lines = json.dumps(action) + '\n'
+        if source is not None:
+            lines += json.dumps(source) + '\n'
+        batch = None
+        with self._lock:
+            if len(self._buffer) == 0:
+                self._buffer_started = time.time()
+            self._buffer.append((lines, on_result))
+            self._buffer_bytes += len(lines.encode('utf-8'))
+            if (len(self._buffer) >= self.max_docs or self._buffer_bytes >= self.max_bytes
+                    or time.time() - self._buffer_started >= self.max_buffer_age_seconds):
+                batch = self._drain()
+        if batch:
+            self._send(batch)
+
+    # Called with self._lock held
+    def _drain(self):
+        batch = self._buffer
+        self._buffer = []
+        self._buffer_bytes = 0
+        if batch:
+            self._sending += 1
+        return batch
+
+    # Returns once everything added before the call, including batches being
+    # sent by other threads, has been written or given up on
+    def flush(self):
+        with self._lock:
+            batch = self._drain()
+        if batch:
+            self._send(batch)
+        with self._idle:
+            while self._sending > 0:
+                self._idle.wait()
+
+    def close(self):
+        self.flush()
+
+    def _send(self, batch):
+        try:
+            self._send_with_retries(batch)
+        finally:
+            with self._idle:
+                self._sending -= 1
+                self._idle.notify_all()
+
+    def _send_with_retries(self, batch):
+        start = time.time()
+        attempt = 0
+        pending = batch
+        while len(pending) > 0:
+            retry = []
+            try:
+                with self._flush_lock:
+                    response = self.ops_client.bulk(body=''.join([lines for lines, on_result in pending]), index=self.index_name,
+                                                    request_timeout=BULK_REQUEST_TIMEOUT)
+                for (lines, on_result), item in zip(pending, response['items']):
+                    op_result = next(iter(item.values()))
+                    if 'error' not in op_result:
+                        self._count('_succeeded', 1)
+                        if on_result is not None:
+                            self._notify(on_result, op_result)
+                    elif op_result.get('status') in RETRYABLE_STATUSES and attempt < self.max_retries:
+                        retry.append((lines, on_result))
+                    else:
+                        self._count('_failed', 1)
+                        self.errors.append(f"Bulk item failed status={op_result.get('status')}, error={op_result['error']}")
+            except Exception as e:
+                LOG.error(f'method=bulk_indexer_send, index={self.index_name}, items={len(pending)}, attempt={attempt}, error={e}')
+                if attempt < self.max_retries:
+                    retry = pending
+                else:
+                    self._count('_failed', len(pending))
+                    self.errors.append(f'Bulk request failed for {len(pending)} items, error={e}')
+            if len(retry) > 0:
+                attempt += 1
+                self._count('_retried', len(retry))
+                time.sleep(min(2 ** attempt, 20) * random.uniform(0.5, 1.0))
+            pending = retry
+        latency = time.time() - start
+        with self._lock:
+            self._flush_latencies.append(latency)
+        LOG.info(f'method=bulk_indexer_send, index={self.index_name}, items={len(batch)}, retries={attempt}, latency={latency:.3f}')
+
+    def _notify(self, on_result, op_result):
+        try:
+            on_result(op_result)
+        except Exception as e:
+            LOG.error(f'method=bulk_indexer_notify, index={self.index_name}, error={e}')
+
+    def _count(self, name, value):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._flush_latencies)
+            return {
+                'bulk_flushes': len(latencies),
+                'bulk_succeeded': self._succeeded,
+                'bulk_failed': self._failed,
+                'bulk_retried': self._retried,
+                'bulk_seconds': round(sum(latencies), 3),
+                'bulk_max_flush_seconds': round(max(latencies), 3) if latencies else 0,
+                'bulk_avg_flush_seconds': round(sum(latencies) / len(latencies), 3) if latencies else 0
+            }
@@ -0,0 +1,178 @@
+from os import getenv
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+import boto3
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Must not start with "index/", keys under it are uploads to index
+MANIFEST_PREFIX = getenv("CHUNK_MANIFEST_PREFIX", "chunk_manifest/")
+# Manifests of a versioned physical index (see index_alias.py) hold the _ids of that index, same rule as above
+MANIFEST_NAMESPACE_PREFIX = getenv("CHUNK_MANIFEST_NAMESPACE_PREFIX", "chunk_manifest_ns/")
+MANIFEST_VERSION = 1
+# Uploads are stored as index/data/{file_name}_{%Y-%m-%d-%H-%M-%S}.{extension}
+UPLOAD_TIMESTAMP_SUFFIX = re.compile(r'_\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}(?=\.[^./]+$|$)')
+
+
+def chunk_content_hash(chunk_data):
+    return hashlib.sha256(chunk_data.encode('utf-8')).hexdigest()[:32]
+
+
+# Same source, page and position always give the same id, whatever the server side _id is
+def generate_chunk_id(s3_source, page_number, ordinal):
+    return hashlib.sha256(f'{s3_source}#{page_number}#{ordinal}'.encode('utf-8')).hexdigest()[:32]
+
+
+# Every upload of the same file name is a version of the same logical document
+def logical_doc_key(s3_key):
+    return UPLOAD_TIMESTAMP_SUFFIX.sub('', s3_key)
+
+
+# namespace None is the index the alias pointed at before it was ever rebuilt
+def manifest_prefix(namespace=None):
+    return MANIFEST_PREFIX if namespace is None else f'{MANIFEST_NAMESPACE_PREFIX}{namespace}/'
+
+
+# Every shard of a document split across workers writes its own manifest, merged by the last shard
+def manifest_key(s3_key, shard=None, namespace=None):
+    shard_suffix = f'.shard-{shard}' if shard is not None else ''
+    return manifest_prefix(namespace) + s3_key.replace('index/', '', 1) + shard_suffix + '.json.gz'
+
+
+# Per document record of every indexed chunk. AOSS assigns the _id of each chunk,
+# so it is taken from the _bulk response and stored next to the deterministic chunk_id.
+# Stored gzipped in S3, column oriented to stay small for documents with thousands of chunks.
+class ChunkManifest():
+
+    COLUMNS = ['chunk_id', 'doc_id', 'page', 'ordinal', 'start', 'end', 'content_hash']
+
+    def __init__(self, s3_source, s3_key, shard=None, namespace=None):
+        self.s3_source = s3_source
+        self.s3_key = s3_key
+        self.shard = shard
+        self.namespace = namespace
+        self.chunks = {}
+        # _ids replaced by a re-indexed chunk, the caller deletes them
+        self.superseded = []
+        # Set once a newer version took over the chunks of this one
+        self.superseded_by = None
+        self._lock = threading.Lock()
+
+    def add(self, page_number, ordinal, start, end, content_hash):
+        chunk_id = generate_chunk_id(self.s3_source, page_number, ordinal)
+        with self._lock:
+            previous = self.chunks.get(chunk_id, {})
+            self.chunks[chunk_id] = {'chunk_id': chunk_id, 'doc_id': previous.get('doc_id'), 'page': page_number,
+                                     'ordinal': ordinal, 'start': start, 'end': end, 'content_hash': content_hash}
+        return chunk_id
+
+    def set_doc_id(self, chunk_id, doc_id):
+        with self._lock:
+            entry = self.chunks[chunk_id]
+            if entry['doc_id'] is not None and entry['doc_id'] != doc_id:
+                self.superseded.append(entry['doc_id'])
+            entry['doc_id'] = doc_id
+
+    def doc_ids(self):
+        with self._lock:
+            return [entry['doc_id'] for entry in self.chunks.values() if entry['doc_id'] is not None]
+
+    def clear(self):
+        with self._lock:
+            self.chunks = {}
+
+    # Chunks of the shard manifests make up the manifest of the whole document
+    def merge(self, other):
+        with self._lock:
+            self.chunks.update(other.chunks)
+            self.superseded.extend(other.take_superseded())
+
+    def take_superseded(self):
+        with self._lock:
+            superseded = self.superseded
+            self.superseded = []
+            return superseded
+
+    def to_bytes(self):
+        with self._lock:
+            entries = sorted(self.chunks.values(), key=lambda entry: (entry['page'] if entry['page'] is not None else -1, entry['ordinal']))
+            body = {'version': MANIFEST_VERSION, 's3_source': self.s3_source, 's3_key': self.s3_key,
+                    'superseded_by': self.superseded_by, 'columns': self.COLUMNS, 'rows': [[entry[column] for column in self.COLUMNS] for entry in entries]}
+        return gzip.compress(json.dumps(body, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data, shard=None, namespace=None):
+        body = json.loads(gzip.decompress(data))
+        manifest = cls(body['s3_source'], body['s3_key'], shard, namespace)
+        manifest.superseded_by = body.get('superseded_by')
+        for row in body['rows']:
+            entry = dict(zip(body['columns'], row))
+            manifest.chunks[entry['chunk_id']] = entry
+        return manifest
+
+    def save(self, bucket, s3_client=None):
+        s3_client = s3_client or boto3.client('s3')
+        s3_client.put_object(Bucket=bucket, Key=manifest_key(self.s3_key, self.shard, self.namespace), Body=self.to_bytes(),
+                             ContentType='application/json', ContentEncoding='gzip')
+        LOG.info(f'method=chunk_manifest_save, s3_key={self.s3_key}, shard={self.shard}, namespace={self.namespace}, chunks={len(self.chunks)}')
+
+    # None when the document was indexed before manifests existed
+    @classmethod
+    def load(cls, bucket, s3_key, s3_client=None, shard=None, namespace=None):
+        s3_client = s3_client or boto3.client('s3')
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=manifest_key(s3_key, shard, namespace))
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return cls.from_bytes(response['Body'].read(), shard, namespace)
+
+    @staticmethod
+    def delete(bucket, s3_key, s3_client=None, shard=None, namespace=None):
+        s3_client = s3_client or boto3.client('s3')
+        s3_client.delete_object(Bucket=bucket, Key=manifest_key(s3_key, shard, namespace))
+
+
+# Chunks of the previous version of a document, by content hash. A new chunk with the same
+# content takes over the indexed document instead of being embedded and indexed again.
+# A shard only reuses the previous chunks of its own page_range [start, end)
+class ChunkReuse():
+
+    def __init__(self, previous_manifest, exclude_doc_ids=(), page_range=None):
+        self.previous_manifest = previous_manifest
+        self._by_hash = {}
+        self._unclaimed = set()
+        # _ids already taken over by an earlier invocation of the same upload
+        exclude_doc_ids = set(exclude_doc_ids)
+        self.reused = 0
+        entries = sorted(previous_manifest.chunks.values(), key=lambda entry: (entry['page'] if entry['page'] is not None else -1, entry['ordinal']))
+        for entry in entries:
+            if entry['doc_id'] is None:
+                continue
+            if page_range is not None and (entry['page'] is None or not page_range[0] <= entry['page'] < page_range[1]):
+                continue
+            if entry['doc_id'] in exclude_doc_ids:
+                self.reused += 1
+                continue
+            self._by_hash.setdefault(entry['content_hash'], []).append(entry['doc_id'])
+            self._unclaimed.add(entry['doc_id'])
+        self._lock = threading.Lock()
+
+    def claim(self, content_hash):
+        with self._lock:
+            doc_ids = self._by_hash.get(content_hash)
+            if not doc_ids:
+                return None
+            doc_id = doc_ids.pop(0)
+            self._unclaimed.discard(doc_id)
+            self.reused += 1
+            return doc_id
+
+    # _ids of chunks that vanished from the new version
+    def unclaimed(self):
+        with self._lock:
+            return list(self._unclaimed)
@@ -0,0 +1,116 @@
+from os import getenv
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from bulk_indexer import BulkIndexer
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+DELETE_PAGE_SIZE = int(getenv("DELETE_PAGE_SIZE", "1000"))
+DELETE_WORKERS = int(getenv("DELETE_WORKERS", "4"))
+# Ids excluded from the next search while their deletes are not visible yet, kept below max_terms_count
+DELETE_MAX_EXCLUDED_IDS = int(getenv("DELETE_MAX_EXCLUDED_IDS", "20000"))
+DELETE_TIMEOUT_SECONDS = float(getenv("DELETE_TIMEOUT_SECONDS", "300"))
+DELETE_POLL_BASE_SECONDS = float(getenv("DELETE_POLL_BASE_SECONDS", "1"))
+DELETE_POLL_MAX_SECONDS = float(getenv("DELETE_POLL_MAX_SECONDS", "16"))
+
+
+# AOSS supports neither delete_by_query nor scroll/PIT, so the chunks of a source are found
+# with searches that exclude the ids already deleted. Deletes go out as large concurrent
+# _bulk requests while the next page is searched, and the engine polls with backoff until
+# the deletes are visible instead of sleeping a fixed time after every page.
+class DeleteEngine():
+
+    def __init__(self, ops_client, index_name, page_size=DELETE_PAGE_SIZE, workers=DELETE_WORKERS,
+                 timeout_seconds=DELETE_TIMEOUT_SECONDS):
+        self.ops_client = ops_client
+        self.index_name = index_name
+        self.page_size = page_size
+        self.workers = max(1, workers)
+        self.timeout_seconds = timeout_seconds
+
+    # known_ids (from a chunk manifest) are deleted straight away, the search sweep then
+    # only has to confirm nothing else is left for the source
+    def delete_by_source(self, s3_source, known_ids=None):
+        start = time.time()
+        deadline = start + self.timeout_seconds
+        # Exact match, a match query on the analyzed field ORs the URL tokens and hits other files of the bucket
+        query = {"term": {"s3_source_uri.keyword": s3_source}}
+        pending = set()
+        stats = {'searches': 0, 'polls': 0, 'known_ids': len(known_ids or [])}
+        bulk_indexer = BulkIndexer(self.ops_client, self.index_name, max_docs=self.page_size, max_in_flight=self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = []
+            if known_ids:
+                known_ids = list(known_ids)
+                for page_start in range(0, len(known_ids), self.page_size):
+                    page_ids = known_ids[page_start:page_start + self.page_size]
+                    futures.append(executor.submit(self._delete_ids, bulk_indexer, page_ids))
+                pending.update(known_ids[-DELETE_MAX_EXCLUDED_IDS:])
+            wait = DELETE_POLL_BASE_SECONDS
+            complete = False
+            while time.time() < deadline:
+                if len(pending) >= DELETE_MAX_EXCLUDED_IDS:
+                    self._wait(futures, bulk_indexer)
+                    if not self._visible(query, pending, deadline, stats):
+                        break
+                    pending.clear()
+                page_ids = self._search_ids(query, pending, stats)
+                if len(page_ids) > 0:
+                    pending.update(page_ids)
+                    futures.append(executor.submit(self._delete_ids, bulk_indexer, page_ids))
+                    wait = DELETE_POLL_BASE_SECONDS
+                    continue
+                # Nothing left that is not already being deleted, wait for the deletes to show
+                self._wait(futures, bulk_indexer)
+                stats['polls'] += 1
+                if self.ops_client.count(index=self.index_name, body={"query": query})['count'] == 0:
+                    complete = True
+                    break
+                time.sleep(min(wait, max(0, deadline - time.time())))
+                wait = min(wait * 2, DELETE_POLL_MAX_SECONDS)
+            self._wait(futures, bulk_indexer)
+        bulk_stats = bulk_indexer.stats()
+        stats.update({
+            'complete': complete,
+            'deleted': bulk_stats['bulk_succeeded'],
+            'failed': bulk_stats['bulk_failed'],
+            'bulk_requests': bulk_stats['bulk_flushes'],
+            'elapsed_seconds': round(time.time() - start, 3)
+        })
+        LOG.info(f'method=delete_by_source, s3_source={s3_source}, stats={stats}')
+        return stats, bulk_indexer.errors
+
+    def _search_ids(self, query, excluded_ids, stats):
+        search_query = {
+            "query": {"bool": {"must": [query]}},
+            "size": self.page_size,
+            "_source": False
+        }
+        if len(excluded_ids) > 0:
+            search_query["query"]["bool"]["must_not"] = [{"ids": {"values": list(excluded_ids)}}]
+        stats['searches'] += 1
+        response = self.ops_client.search(body=search_query, index=self.index_name)
+        return [hit['_id'] for hit in response['hits']['hits']]
+
+    # True once none of the deleted ids comes back from a search any more
+    def _visible(self, query, deleted_ids, deadline, stats):
+        wait = DELETE_POLL_BASE_SECONDS
+        while time.time() < deadline:
+            stats['polls'] += 1
+            if len(set(self._search_ids(query, [], stats)).intersection(deleted_ids)) == 0:
+                return True
+            time.sleep(min(wait, max(0, deadline - time.time())))
+            wait = min(wait * 2, DELETE_POLL_MAX_SECONDS)
+        return False
+
+    def _delete_ids(self, bulk_indexer, doc_ids):
+        for doc_id in doc_ids:
+            bulk_indexer.delete(doc_id)
+
+    def _wait(self, futures, bulk_indexer):
+        for future in futures:
+            future.result()
+        futures.clear()
+        bulk_indexer.flush()
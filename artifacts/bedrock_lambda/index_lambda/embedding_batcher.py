@@ -0,0 +1,93 @@
+from os import getenv
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import threading
+import time
+from bedrock_limiter import BEDROCK_MAX_CONCURRENCY
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Cohere embed models accept up to 96 texts per request
+COHERE_MAX_BATCH_SIZE = 96
+EMBED_BATCH_SIZE = int(getenv("EMBED_BATCH_SIZE", "96"))
+# Titan embeds a single inputText per request, so a batch is fanned out over a pool.
+# The adaptive limiter in bedrock_limiter decides how many of these calls really run at once
+EMBED_MAX_WORKERS = int(getenv("EMBED_MAX_WORKERS", str(BEDROCK_MAX_CONCURRENCY)))
+
+
+# Groups chunks into model native batches before calling Bedrock
+# Cohere -> one invoke_model per batch of `texts`
+# Titan  -> one invoke_model per text, bounded by max_workers
+class EmbeddingBatcher():
+
+    def __init__(self, bedrock_client, model_id, batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_MAX_WORKERS):
+        self.bedrock_client = bedrock_client
+        self.model_id = model_id
+        self.is_cohere = 'cohere' in model_id
+        if self.is_cohere:
+            batch_size = min(batch_size, COHERE_MAX_BATCH_SIZE)
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.invocations = 0
+        self.embedded = 0
+        self.embed_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def batches(self, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def embed(self, texts, input_type='search_document'):
+        start = time.time()
+        if self.is_cohere:
+            embeddings = self._embed_cohere(texts, input_type)
+        elif len(texts) == 1:
+            embeddings = [self._embed_titan(texts[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(texts))) as executor:
+                embeddings = list(executor.map(self._embed_titan, texts))
+        with self._lock:
+            self.embed_seconds += time.time() - start
+            self.embedded += len(texts)
+        return embeddings
+
+    def _embed_cohere(self, texts, input_type):
+        result = self._invoke({"texts": texts, "input_type": input_type})
+        embeddings = result.get('embeddings')
+        if embeddings is None or len(embeddings) != len(texts):
+            raise ValueError(f'Embed model {self.model_id} returned {0 if embeddings is None else len(embeddings)} embeddings for {len(texts)} texts')
+        return embeddings
+
+    def _embed_titan(self, text):
+        result = self._invoke({"inputText": text})
+        return result.get('embedding')
+
+    def _invoke(self, body):
+        with self._lock:
+            self.invocations += 1
+        response = self.bedrock_client.invoke_model(
+            body=json.dumps(body),
+            modelId=self.model_id,
+            accept='application/json',
+            contentType='application/json'
+        )
+        result = json.loads(response['body'].read())
+        finish_reason = result.get("message")
+        if finish_reason is not None:
+            LOG.error(f'Embed Model {self.model_id}, error {finish_reason}')
+        return result
+
+    def stats(self):
+        return {
+            'embed_invocations': self.invocations,
+            'embedded_chunks': self.embedded,
+            'embed_seconds': round(self.embed_seconds, 3)
+        }
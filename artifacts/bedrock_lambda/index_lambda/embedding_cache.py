@@ -0,0 +1,121 @@
+from os import getenv
+from collections import OrderedDict
+import hashlib
+import logging
+import random
+import struct
+import threading
+import time
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+EMBED_CACHE_LRU_SIZE = int(getenv("EMBED_CACHE_LRU_SIZE", "20000"))
+EMBED_CACHE_TTL_DAYS = int(getenv("EMBED_CACHE_TTL_DAYS", "90"))
+EMBED_CACHE_ENABLED = getenv("EMBED_CACHE_ENABLED", "yes")
+# batch_get_item accepts at most 100 keys per request
+DYNAMO_BATCH_GET_SIZE = 100
+# Unprocessed keys are retried with jittered backoff, keys still unprocessed after that count as misses
+DYNAMO_BATCH_GET_RETRIES = int(getenv("DYNAMO_BATCH_GET_RETRIES", "5"))
+DYNAMO_BACKOFF_BASE_SECONDS = 0.05
+DYNAMO_BACKOFF_MAX_SECONDS = 2
+
+
+# Content addressed embedding cache keyed by (embed model, sha256 of the embedded text).
+# An in-process LRU that survives warm invocations sits in front of the DynamoDB index table.
+# Each entry gets its own partition key so the cache never becomes a hot partition.
+class EmbeddingCache():
+
+    def __init__(self, table, model_id, max_entries=EMBED_CACHE_LRU_SIZE, ttl_days=EMBED_CACHE_TTL_DAYS):
+        self.table = table
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.enabled = EMBED_CACHE_ENABLED == 'yes'
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cache_key(self, text):
+        return f'EMBED_CACHE#{self.model_id}#{hashlib.sha256(text.encode("utf-8")).hexdigest()}'
+
+    # Returns {position in texts: embedding} for every text found in the cache
+    def get_many(self, texts):
+        found = {}
+        if not self.enabled or len(texts) == 0:
+            return found, {'memory_hits': 0, 'store_hits': 0, 'misses': len(texts)}
+        keys = [self.cache_key(text) for text in texts]
+        missing = {}
+        with self._lock:
+            for position, key in enumerate(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[position] = self._lru[key]
+                else:
+                    missing.setdefault(key, []).append(position)
+        memory_hits = len(found)
+        try:
+            for key, embedding in self._batch_get(list(missing.keys())).items():
+                self._remember(key, embedding)
+                for position in missing[key]:
+                    found[position] = embedding
+        except Exception as e:
+            LOG.error(f'method=embedding_cache_get, model_id={self.model_id}, keys={len(missing)}, error={e}')
+        return found, {'memory_hits': memory_hits, 'store_hits': len(found) - memory_hits, 'misses': len(texts) - len(found)}
+
+    def put_many(self, texts, embeddings):
+        if not self.enabled:
+            return
+        expire_epoch = int(time.time()) + self.ttl_seconds
+        try:
+            with self.table.batch_writer(overwrite_by_pkeys=['prim_key', 'sort_key']) as batch:
+                for text, embedding in zip(texts, embeddings):
+                    key = self.cache_key(text)
+                    self._remember(key, embedding)
+                    batch.put_item(Item={
+                        'prim_key': key,
+                        'sort_key': 'EMBEDDING',
+                        'embedding': pack_embedding(embedding),
+                        'expire_epoch': expire_epoch
+                    })
+        except Exception as e:
+            LOG.error(f'method=embedding_cache_put, model_id={self.model_id}, items={len(texts)}, error={e}')
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._lru[key] = embedding
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _batch_get(self, keys):
+        results = {}
+        client = self.table.meta.client
+        for start in range(0, len(keys), DYNAMO_BATCH_GET_SIZE):
+            request = {self.table.name: {
+                'Keys': [{'prim_key': {'S': key}, 'sort_key': {'S': 'EMBEDDING'}} for key in keys[start:start + DYNAMO_BATCH_GET_SIZE]],
+                'ProjectionExpression': 'prim_key, embedding'
+            }}
+            attempt = 0
+            while request:
+                response = client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table.name, []):
+                    results[item['prim_key']['S']] = unpack_embedding(item['embedding']['B'])
+                request = response.get('UnprocessedKeys')
+                if request:
+                    if attempt >= DYNAMO_BATCH_GET_RETRIES:
+                        LOG.warning(f'method=embedding_cache_get, unprocessed_keys={len(request.get(self.table.name, {}).get("Keys", []))}, attempts={attempt + 1}')
+                        break
+                    # Unprocessed keys mean the table is throttling, back off before asking again
+                    attempt += 1
+                    time.sleep(min(DYNAMO_BACKOFF_BASE_SECONDS * 2 ** attempt, DYNAMO_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0))
+        return results
+
+
+# Embeddings are stored as little endian float32, ~4KB for a 1024 dimension vector
+def pack_embedding(embedding):
+    return struct.pack(f'<{len(embedding)}f', *embedding)
+
+
+def unpack_embedding(data):
+    data = bytes(data)
+    return list(struct.unpack(f'<{len(data) // 4}f', data))
@@ -0,0 +1,70 @@
+from os import getenv
+from io import BytesIO
+import logging
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+try:
+    # Pillow comes with the pypdf[image] layer
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Claude downsizes anything with a longer edge than ~1568px, sending more only costs latency and tokens
+OCR_IMAGE_MAX_EDGE = int(getenv("OCR_IMAGE_MAX_EDGE", "1568"))
+# Logos bullets and rules below this edge carry no readable text
+OCR_IMAGE_MIN_EDGE = int(getenv("OCR_IMAGE_MIN_EDGE", "24"))
+OCR_IMAGE_MIN_BYTES = int(getenv("OCR_IMAGE_MIN_BYTES", "512"))
+OCR_IMAGE_JPEG_QUALITY = int(getenv("OCR_IMAGE_JPEG_QUALITY", "85"))
+
+# Formats the Claude 3 messages API accepts as is
+SUPPORTED_MEDIA_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+MAGIC_BYTES = [(b'\xff\xd8\xff', 'image/jpeg'), (b'\x89PNG\r\n\x1a\n', 'image/png'),
+               (b'GIF87a', 'image/gif'), (b'GIF89a', 'image/gif')]
+
+
+def sniff_media_type(image_bytes):
+    for magic, media_type in MAGIC_BYTES:
+        if image_bytes.startswith(magic):
+            return media_type
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+# Returns (image bytes, media type) ready for an OCR prompt, or None for an image not worth sending.
+# Oversized or unsupported images (TIFF, JPEG2000, BMP... extracted from PDFs) are resized and
+# re-encoded, images that are already compact are sent untouched.
+def prepare_image(image_bytes):
+    if len(image_bytes) < OCR_IMAGE_MIN_BYTES:
+        return None
+    if Image is None:
+        return image_bytes, sniff_media_type(image_bytes)
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        width, height = image.size
+        if min(width, height) < OCR_IMAGE_MIN_EDGE:
+            return None
+        image_format = image.format
+        if image_format in SUPPORTED_MEDIA_TYPES and max(width, height) <= OCR_IMAGE_MAX_EDGE and image_format != 'PNG':
+            return image_bytes, SUPPORTED_MEDIA_TYPES[image_format]
+        if max(width, height) > OCR_IMAGE_MAX_EDGE:
+            image.thumbnail((OCR_IMAGE_MAX_EDGE, OCR_IMAGE_MAX_EDGE), Image.LANCZOS)
+        # Scans are grayscale or colour photos of text, JPEG keeps them readable at a fraction of the size
+        if image.mode not in ['L', 'RGB']:
+            image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+            if image.mode == 'RGBA':
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[3])
+                image = background
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=OCR_IMAGE_JPEG_QUALITY, optimize=True)
+        encoded = output.getvalue()
+        if image_format in SUPPORTED_MEDIA_TYPES and len(encoded) >= len(image_bytes) and max(width, height) <= OCR_IMAGE_MAX_EDGE:
+            # Flat PNGs (diagrams, screenshots) are often smaller than their JPEG
+            return image_bytes, SUPPORTED_MEDIA_TYPES[image_format]
+        return encoded, 'image/jpeg'
+    except Exception as e:
+        LOG.warning(f'method=prepare_image, bytes={len(image_bytes)}, error={e}')
+        return image_bytes, sniff_media_type(image_bytes)
@@ -14,7 +14,24 @@ from datetime import datetime, timezone
 import time
 import threading
 from pypdf import PdfReader
-from prompt_builder import generate_claude_3_ocr_prompt, generate_claude_3_title_prompt
+from prompt_builder import generate_claude_3_ocr_prompt, generate_claude_3_ocr_batch_prompt, generate_claude_3_title_prompt
+from embedding_batcher import EmbeddingBatcher
+from bulk_indexer import BulkIndexer
+from bedrock_limiter import create_bedrock_client, limiter as bedrock_limiter
+from page_pipeline import run_page_pipeline, contiguous_pages_complete
+from embedding_cache import EmbeddingCache
+from ocr_cache import OcrCache, parse_ocr_batch_response
+from s3_stream import open_s3_file, iter_s3_text, peak_memory_mb
+from text_chunker import iter_chunks_with_offsets, iter_text_windows
+from chunk_manifest import ChunkManifest, ChunkReuse, chunk_content_hash, generate_chunk_id, logical_doc_key
+from delete_engine import DeleteEngine
+from audit_writer import AuditWriter
+from table_truncator import TableTruncator
+from pdf_extractor import extract_page, iter_pdf_pages, PDF_EXTRACT_PROCESSES
+from ingestion_queue import IngestionQueue, s3_record, SQS_MAX_DELAY_SECONDS
+from shard_coordinator import ShardCoordinator, shard_id
+from index_alias import IndexAlias
+from index_rebuilder import IndexRebuilder, REBUILD_MAX_COUNT_DRIFT
 import time
 from boto3.dynamodb.conditions import Key, Attr
 import time
@@ -25,11 +42,39 @@ LOG.setLevel(logging.INFO)
 # Self managed or cluster based OPENSEARCH
 endpoint = getenv("OPENSEARCH_VECTOR_ENDPOINT", "https://admin:P@@search-opsearch-public-24k5tlpsu5whuqmengkfpeypqu.us-east-1.es.amazonaws.com:443")
 SAMPLE_DATA_DIR=getenv("SAMPLE_DATA_DIR", "sample_data")
-INDEX_NAME = getenv("VECTOR_INDEX_NAME", "sample-embeddings-store-dev")
+# Reads and writes go to the physical index the alias points at, see index_alias.py
+INDEX_ALIAS_NAME = getenv("VECTOR_INDEX_NAME", "sample-embeddings-store-dev")
+INDEX_NAME = INDEX_ALIAS_NAME
+# Namespace of the chunk manifests of INDEX_NAME, None for the unversioned index
+MANIFEST_NAMESPACE = None
 s3_bucket_name = getenv("S3_BUCKET_NAME", "S3_BUCKET_NAME_MISSING")
 embed_model_id = getenv("EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
 ocr_model_id = getenv("OCR_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
 dynamodb_table_name = getenv("INDEX_DYNAMO_TABLE_NAME", "rag-llm-index-table-dev")
+# Stop taking new pages when less than this is left, in-flight pages still need to drain
+CONTINUATION_BUFFER_MILLIS = int(getenv("CONTINUATION_BUFFER_MILLIS", "120000"))
+CHECKPOINT_EVERY_PAGES = int(getenv("CHECKPOINT_EVERY_PAGES", "5"))
+# Chunk batches being embedded or waiting for the bulk indexer
+EMBED_INFLIGHT_BATCHES = int(getenv("EMBED_INFLIGHT_BATCHES", "4"))
+# A new upload of a file name only embeds the chunks that changed since the previous version
+INCREMENTAL_REINDEX = getenv("INCREMENTAL_REINDEX", "yes")
+# Sparse GSI over the index audit records of a user, see dynamodb_stack.py
+LIST_FILES_INDEX_NAME = getenv("LIST_FILES_INDEX_NAME", "email_id-upload_timestamp-index")
+LIST_FILES_PAGE_SIZE = int(getenv("LIST_FILES_PAGE_SIZE", "50"))
+LIST_FILES_MAX_PAGE_SIZE = 200
+# Error messages listed to the user are cut to this length, the full message stays on the record
+ERROR_SUMMARY_CHARS = int(getenv("ERROR_SUMMARY_CHARS", "300"))
+# Truncation time within the API request, API Gateway gives up after 29 seconds
+TRUNCATE_SYNC_SECONDS = float(getenv("TRUNCATE_SYNC_SECONDS", "20"))
+# Vector index settings, a rebuild can create the next index with others
+EMBED_DIMENSION = int(getenv("EMBED_DIMENSION", "1024"))
+HNSW_EF_CONSTRUCTION = int(getenv("HNSW_EF_CONSTRUCTION", "128"))
+HNSW_M = int(getenv("HNSW_M", "24"))
+HNSW_EF_SEARCH = int(getenv("HNSW_EF_SEARCH", "100"))
+# Without the ingestion queue a settling rebuild waits this long per invocation before handing on
+REBUILD_SETTLE_POLL_SECONDS = int(getenv("REBUILD_SETTLE_POLL_SECONDS", "60"))
+# Tenant of rebuild continuations in the ingestion queue, they are not uploads of a user
+REBUILD_TENANT = 'index-rebuild'
 
 credentials = boto3.Session().get_credentials()
 
@@ -38,9 +83,19 @@ region = getenv("REGION", "us-east-1")
 awsauth = AWS4Auth(credentials.access_key, credentials.secret_key,
                    region, service, session_token=credentials.token)
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 dynamodb_client = boto3.resource('dynamodb')
 table = dynamodb_client.Table(dynamodb_table_name)
+# Module level so the in-memory tier survives warm invocations
+embedding_cache = EmbeddingCache(table, embed_model_id)
+ocr_cache = OcrCache(table)
+# S3 notifications arrive through the ingestion queue when INGEST_QUEUE_URL is set
+ingestion_queue = IngestionQueue(tenant_fn=lambda item: ingestion_tenant(item))
+shard_coordinator = ShardCoordinator(table, ingestion_queue)
+# Progress updates of the indexing path, written in the background
+audit_writer = AuditWriter(lambda *args: index_audit_update(*args),
+                           is_final=lambda status: status != FILE_UPLOAD_STATUS._INPROGRESS)
+index_alias = IndexAlias(table, INDEX_ALIAS_NAME, embed_model_id)
 
 ops_client = OpenSearch(
         hosts=[{'host': endpoint, 'port': 443}],
@@ -51,32 +106,35 @@ ops_client = OpenSearch(
         timeout=300
 )
 
-def create_index() :
-    LOG.info(f'method=create_index')
-    if not ops_client.indices.exists(index=INDEX_NAME):
+def create_index(index_name=None, dimension=EMBED_DIMENSION, ef_construction=HNSW_EF_CONSTRUCTION, m=HNSW_M, ef_search=HNSW_EF_SEARCH) :
+    index_name = index_name or INDEX_NAME
+    LOG.info(f'method=create_index, index_name={index_name}')
+    if not ops_client.indices.exists(index=index_name):
     # Create indicies
     # Consine Simi for large datasets. With hybrid search it does a post filter on the results
         settings = {
             "settings": {
                 "index": {
                     "knn": True,
-                    "knn.algo_param.ef_search": 100
+                    "knn.algo_param.ef_search": ef_search
                 }
             },
             "mappings": {
                 "properties": {
                     "id": {"type": "integer"},
                     "text": {"type": "text"},
+                    # Same shape as the dynamic mapping, the keyword sub field is long enough for any upload key
+                    "s3_source_uri": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 2048}}},
                     "embedding": {
                         "type": "knn_vector",
-                        "dimension": 1024,
+                        "dimension": dimension,
                         "method": {
                             "name":"hnsw",
                             "engine":"nmslib",
                             "space_type": "cosinesimil",
                             "parameters": {
-                                "ef_construction": 128,
-                                "m": 24
+                                "ef_construction": ef_construction,
+                                "m": m
                           }
                         }
                     },
@@ -112,156 +170,189 @@ def create_index() :
         #     }
         # }
         LOG.debug(f'method=create_index, index_settings={settings}')
-        res = ops_client.indices.create(index=INDEX_NAME, body=settings, ignore=[400])
+        res = ops_client.indices.create(index=index_name, body=settings, ignore=[400])
         LOG.debug(f'method=create_index, index_creation_response={res}')
 
-def index_documents(event):
+def index_documents(event, bulk_indexer=None):
     LOG.info(f'method=index_documents, event={event}')
     payload = json.loads(event['body'])
-    text_val = payload['text']
-    email_id = payload['email_id']
-    s3_source = payload['s3_source']
-    doc_title = payload['doc_title']
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-    # Set a really small chunk size, just to show.
-    chunk_size = 500,
-    chunk_overlap  = 10)
-    texts = text_splitter.create_documents([text_val])
+    return index_text([payload['text']], payload['s3_source'], payload['email_id'], payload['doc_title'], bulk_indexer)
+
+
+# Chunks are split lazily from text_windows, the first batch is embedded while the rest
+# of the text is still being split. Memory is bounded by the batches in flight
+def index_text(text_windows, s3_source, email_id, doc_title, bulk_indexer=None, manifest=None, page_number=None, reuse=None):
+    start = time.time()
+    # (ordinal, (offset, chunk)), positions are recorded in the chunk manifest
+    chunks = enumerate(iter_chunks_with_offsets(window for text in text_windows for window in iter_text_windows(text)))
     error_messages = []
-    if texts is not None and len(texts) > 0:
-        print(f'Number of chunks {len(texts)}')
-        create_index()
-        # You will get model timeout exceptons if u increase this beyond 2
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            futures = [executor.submit(_generate_embeddings_and_index, chunk_text, s3_source, email_id, doc_title) for chunk_text in texts]
-            for future in as_completed(futures):
-                result = future.result()
-                if result['statusCode'] != "200" and 'errorMessage' in result:
-                    error_messages.append(result['errorMessage'])
-                    
-        # for chunk_text in texts:
-        #     result = _generate_embeddings_and_index(chunk_text, s3_source, email_id, doc_title)
-        #     if result['statusCode'] != "200":
-        #         return result
+    stats = {}
+    chunk_count = 0
+    split_seconds = 0.0
+    embedded = 0
+    reused = 0
+    cache_counts = {'memory_hits': 0, 'store_hits': 0, 'misses': 0}
+    # A caller indexing many pages shares its indexer so _bulk requests span pages
+    owns_indexer = bulk_indexer is None
+    batcher = EmbeddingBatcher(bedrock_client, embed_model_id)
+    chunk_batches = batcher.batches(chunks)
+
+    def collect(future):
+        nonlocal embedded, reused
+        result = future.result()
+        embedded += result['embedded']
+        reused += result['reused']
+        error_messages.extend(result['errors'])
+        for name, count in result['cache'].items():
+            cache_counts[name] += count
+
+    # Batches are processed by 2 workers so one batch is embedded while the other is bulk indexed
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        in_flight = []
+        while True:
+            split_start = time.time()
+            chunk_batch = next(chunk_batches, None)
+            split_seconds += time.time() - split_start
+            if chunk_batch is None:
+                break
+            if chunk_count == 0:
+                create_index()
+                if owns_indexer:
+                    bulk_indexer = BulkIndexer(ops_client, INDEX_NAME)
+            chunk_count += len(chunk_batch)
+            in_flight.append(executor.submit(_generate_embeddings_and_index, batcher, bulk_indexer, chunk_batch, s3_source, email_id, doc_title, manifest, page_number, reuse))
+            if len(in_flight) >= EMBED_INFLIGHT_BATCHES:
+                collect(in_flight.pop(0))
+        for future in in_flight:
+            collect(future)
+
+    if chunk_count > 0:
+        print(f'Number of chunks {chunk_count}')
+        if owns_indexer:
+            bulk_indexer.close()
+            error_messages.extend(bulk_indexer.errors)
+        total_seconds = time.time() - start
+        stats = {
+            'chunks': chunk_count,
+            # Chunks indexed with a cached or new vector, embedded_chunks of the batcher counts model calls only
+            'indexed_chunks': embedded,
+            'reused_chunks': reused,
+            'split_seconds': round(split_seconds, 3),
+            'total_seconds': round(total_seconds, 3),
+            'chunks_per_second': round(embedded / total_seconds, 2) if total_seconds > 0 else 0,
+            'embed_cache_memory_hits': cache_counts['memory_hits'],
+            'embed_cache_store_hits': cache_counts['store_hits'],
+            'embed_cache_misses': cache_counts['misses'],
+            'embed_cache_hit_rate': round((cache_counts['memory_hits'] + cache_counts['store_hits']) / max(1, chunk_count - reused), 3)
+        }
+        stats.update(batcher.stats())
+        stats.update(bulk_indexer.stats())
+        stats.update(bedrock_limiter.stats())
+        LOG.info(f'method=index_documents, s3_source={s3_source}, stats={stats}')
+
     if len(error_messages) > 0:
-        return {"statusCode": "400", "errorMessage": ','.join(error_messages)}    
-    return {"statusCode": "200", "message": "Documents indexed successfully"}
+        return {"statusCode": "400", "errorMessage": ','.join(error_messages), "stats": stats}
+    return {"statusCode": "200", "message": "Documents indexed successfully", "stats": stats}
 
 
-def _generate_embeddings_and_index(chunk_text, s3_source, email_id, doc_title):
-        chunk_data = f"""Doc Title: {doc_title} 
-                        {chunk_text.page_content}"""
-        body = json.dumps({"inputText": chunk_data})
-        try:
-            embeddings_key='embedding'
-            if 'cohere' in   embed_model_id:
-                response = bedrock_client.invoke_model(
-                body=json.dumps({"texts": [chunk_data], "input_type": 'search_document'}),
-                modelId=embed_model_id,
-                accept='application/json',
-                contentType='application/json'
-                )
-                embeddings_key="embeddings"
+# Embeds a batch of chunks and hands the documents to the bulk indexer
+# Chunks seen before (same text, same embed model) reuse their cached vectors, chunks
+# unchanged since the previous version of the document keep their indexed documents
+def _generate_embeddings_and_index(batcher, bulk_indexer, chunk_items, s3_source, email_id, doc_title, manifest=None, page_number=None, reuse=None):
+        result = {'embedded': 0, 'reused': 0, 'errors': [], 'cache': {}}
+        new_items = []
+        for ordinal, (offset, chunk_text) in chunk_items:
+            chunk_data = f"""Doc Title: {doc_title} 
+                        {chunk_text}"""
+            content_hash = chunk_content_hash(chunk_data)
+            previous_doc_id = reuse.claim(content_hash) if reuse is not None else None
+            if previous_doc_id is not None:
+                chunk_id = manifest.add(page_number, ordinal, offset, offset + len(chunk_text), content_hash)
+                manifest.set_doc_id(chunk_id, previous_doc_id)
+                result['reused'] += 1
             else:
-                response = bedrock_client.invoke_model(
-                    body = body,
-                    modelId = embed_model_id,
-                    accept = 'application/json',
-                    contentType = 'application/json'
-                )
-            result = json.loads(response['body'].read())
-
-            finish_reason = result.get("message")
-            if finish_reason is not None:
-                LOG.error(f'Embed Model {embed_model_id}, error {finish_reason}')
-            
-            if 'cohere' in   embed_model_id:
-                embeddings = result.get(embeddings_key)[0]
+                new_items.append((ordinal, offset, chunk_text, chunk_data, content_hash))
+        if len(new_items) == 0:
+            return result
+        chunk_data_list = [chunk_data for ordinal, offset, chunk_text, chunk_data, content_hash in new_items]
+        try:
+            cached_embeddings, result['cache'] = embedding_cache.get_many(chunk_data_list)
+            missing_positions = [position for position in range(len(chunk_data_list)) if position not in cached_embeddings]
+            if len(missing_positions) > 0:
+                missing_texts = [chunk_data_list[position] for position in missing_positions]
+                new_embeddings = batcher.embed(missing_texts)
+                embedding_cache.put_many(missing_texts, new_embeddings)
+                for position, embeddings in zip(missing_positions, new_embeddings):
+                    cached_embeddings[position] = embeddings
+            embeddings_list = [cached_embeddings[position] for position in range(len(chunk_data_list))]
+        except Exception as e:
+            LOG.error(f'method=_generate_embeddings_and_index, selected embed model: {embed_model_id}, error:{str(e)}')
+            result['errors'].append(f'Embed model {embed_model_id}. Error {str(e)}, chunks {len(chunk_data_list)}')
+            return result
+
+        timestamp = datetime.today().replace(tzinfo=timezone.utc).isoformat()
+        for (ordinal, offset, chunk_text, chunk_data, content_hash), embeddings in zip(new_items, embeddings_list):
+            on_result = None
+            if manifest is not None:
+                chunk_id = manifest.add(page_number, ordinal, offset, offset + len(chunk_text), content_hash)
+                on_result = lambda op_result, chunk_id=chunk_id: manifest.set_doc_id(chunk_id, op_result['_id'])
             else:
-                embeddings = result.get(embeddings_key)
-        
-            doc = {
+                chunk_id = generate_chunk_id(s3_source, page_number, ordinal)
+            bulk_indexer.index({
             'embedding' : embeddings,
             'text': chunk_data,
-            'timestamp': datetime.today().replace(tzinfo=timezone.utc).isoformat(),
+            'timestamp': timestamp,
             'meta': {
                 's3_source': s3_source,
                 'email_id': email_id
             },
-            's3_source_uri': s3_source
-            }
-
-            ops_client.index(index=INDEX_NAME, body=doc)
-            return success_response('Documents Indexed Successfully')
-        except Exception as e:
-            LOG.error(f'method=_generate_embeddings_and_index, selected embed model: {embed_model_id}, error:{str(e)}')
-            return failure_response(f'Embed model {embed_model_id}. Error {str(e)}, text {chunk_text}')
+            's3_source_uri': s3_source,
+            'chunk_id': chunk_id
+            }, on_result=on_result)
+        result['embedded'] = len(chunk_data_list)
+        return result
         
         
         
 
 def delete_index(event):
+    errors = []
+    # Truncating the table drops the alias pointer, the other physical indices of the alias go as well
     try:
-        res = ops_client.indices.delete(index=INDEX_NAME)
-        LOG.info(f"method=delete_index, delete_response={res}")
-        truncateTable()
-        LOG.info(f"method=delete_index, Dynamo_DB_Table truncate initiated={res}")
+        index_names = index_alias.index_names()
     except Exception as e:
-        LOG.error(f"method=delete_index, error={e.info['error']['reason']}")
-        truncateTable()
-        LOG.info(f"method=delete_index, Dynamo_DB_Table truncate initiated={res}")
-        return failure_response(f'Error deleting index. {e.info["error"]["reason"]}')
+        LOG.error(f"method=delete_index, alias={INDEX_ALIAS_NAME}, error={e}")
+        index_names = [INDEX_ALIAS_NAME]
+    for index_name in index_names:
+        try:
+            res = ops_client.indices.delete(index=index_name)
+            LOG.info(f"method=delete_index, index_name={index_name}, delete_response={res}")
+        except exceptions.NotFoundError:
+            # Already gone, e.g. a rebuild that never created its index
+            LOG.info(f"method=delete_index, index_name={index_name}, not_found=True")
+        except Exception as e:
+            LOG.error(f"method=delete_index, index_name={index_name}, error={e}")
+            errors.append(f'{index_name}: {e}')
+    truncateTable()
+    LOG.info(f"method=delete_index, Dynamo_DB_Table truncate initiated, errors={len(errors)}")
+    if len(errors) > 0:
+        return failure_response(f'Error deleting index. {"; ".join(errors)}')
     return success_response('Index deleted successfully')
 
 
-def delete_documents_by_s3_uri(s3_source: str):
-    REQUEST_TIMEOUT_VAL =300
-    delete_body = []
+# known_ids come from the chunk manifest, the engine deletes them directly and only sweeps for leftovers
+def delete_documents_by_s3_uri(s3_source: str, known_ids=None):
     # AOSS doesnt support custom doc ID neither does it support delete_by_query
-    # Workaround -> Search for the docs and then delete_by_id
-    search_query= { 
-        "query": { 
-            "match": { 
-                "s3_source_uri": s3_source
-                }
-        },
-        "size": 50,
-        "_source": { "exclude": [ "*" ] }
-    }
-
-    while True:
-        try:
-            search_response = ops_client.search( body=search_query, index=INDEX_NAME)
-            LOG.info(f"Response of {search_query} for {INDEX_NAME} is - {search_response}")
-            if search_response['hits']['total']['value'] == 0:
-                LOG.warn(f"No documents found for s3_source {s3_source}")
-                break
-            else:
-                for doc in search_response['hits']['hits']:
-                    _id = doc["_id"]
-                    _index = doc["_index"]
-                    action = {"delete": {"_index": _index, "_id": _id}}
-                    delete_body.append(action)
-        except Exception as e:
-            LOG.error(f"An exception occurred while processing the 'delete_by_query' request - {str(e)}")
-            break
-        if len(delete_body) > 0:
-            try:
-                response = ops_client.bulk(
-                    body=delete_body,
-                    index=INDEX_NAME,
-                    request_timeout=REQUEST_TIMEOUT_VAL
-                    )
-                LOG.info(f"method=delete_documents_by_s3_uri, delete_response={response}")
-            except Exception as e:
-                LOG.error(f'method=delete_documents_by_s3_uri, delete_query={delete_body}, error={e}')
-                
-            delete_body = []
-            time.sleep(30)
-            LOG.info('Sleep for 30 seconds')
-                                        
-    return success_response(f'vectorized content for file {s3_source} deleted successfully')
+    # Workaround -> Search for the docs and then delete_by_id, see DeleteEngine
+    try:
+        stats, errors = DeleteEngine(ops_client, INDEX_NAME).delete_by_source(s3_source, known_ids)
+    except Exception as e:
+        LOG.error(f'method=delete_documents_by_s3_uri, s3_source={s3_source}, error={e}')
+        return failure_response(f'Error deleting vectorized content for file {s3_source}. {str(e)}')
+    if len(errors) > 0 or not stats['complete']:
+        LOG.error(f'method=delete_documents_by_s3_uri, s3_source={s3_source}, stats={stats}, errors={errors[:10]}')
+        return failure_response(f'Deleted {stats["deleted"]} chunks of file {s3_source} in {stats["elapsed_seconds"]}s, {stats["failed"]} failed, complete={stats["complete"]}')
+    return success_response(f'vectorized content for file {s3_source} deleted successfully, {stats["deleted"]} chunks in {stats["elapsed_seconds"]}s')
 
 
 def connect_tracker(event):
@@ -395,10 +486,11 @@ def delete_file(event):
   ]
 }"""
 
-def process_file_upload(event):
+# continuation(event, context) hands the records left over when time runs out to another invocation
+def process_file_upload(event, context=None, continuation=None):
     if 'Records' in event:
-        for record in event['Records']:
-            if record['eventName'] == 'ObjectCreated:Post' and "index/" in record["s3"]["object"]["key"]:
+        for record_index, record in enumerate(event['Records']):
+            if record['eventName'] == 'ObjectCreated:Post' and record["s3"]["object"]["key"].startswith('index/'):
                 s3_source=''
                 s3_key=''
                 file_extension = 'txt'
@@ -408,113 +500,61 @@ def process_file_upload(event):
                     s3_source = f'https://{s3_bucket}/{s3_key}'
                 if '.' in s3_key:
                     file_extension = s3_key[s3_key.rindex('.')+1:]
-                content, metadata = get_file_from_s3(s3_key)
-                email_id = 'no-id-set'
-                utc_now = ''
-                doc_title = '1'
-                if 'email_id' in metadata:
-                    email_id = metadata['email_id']
-                elif 'userIdentity' in record:
-                    principal_id = record['userIdentity']['principalId']
-                    email_id = principal_id.replace('AWS:', '').replace(':', '-')
-                if 'upload_utc' in metadata:
-                    utc_now = metadata['upload_utc']
-                else:
-                    utc_now = now_utc_iso8601()
-                if 'doc_title' in metadata:
-                    doc_title = metadata['doc_title']
-                index_audit_insert(email_id, s3_source, s3_key, utc_now)
+                # An upload that started before an index switch finishes on the index it started on
+                use_active_index(record.get('index_name'))
+                record['index_name'] = INDEX_NAME
+                # The object itself is streamed by the branch that handles its type
+                email_id, utc_now, doc_title = get_upload_attributes(record, s3_key)
+                # Set when the PDF is one of the page range shards of a large document
+                page_range = record.get('page_range')
+                shard = shard_id(*page_range) if page_range is not None else None
+                # A continuation or a Lambda retry of the same upload resumes from its page checkpoints
+                s3_sequencer = record['s3']['object'].get('sequencer', '')
+                completed_pages = get_index_checkpoint(email_id, s3_key, s3_sequencer)
+                if len(completed_pages) > 0:
+                    LOG.info(f'method=process_file_upload, s3_key={s3_key}, message=resuming, completed_pages={len(completed_pages)}')
+                    if shard is None:
+                        index_audit_progress(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'Resuming after {len(completed_pages)} indexed pages')
+                elif shard is None:
+                    index_audit_insert(email_id, s3_source, s3_key, utc_now, s3_sequencer=s3_sequencer)
                 
                 error_messages = []
                 index_success=True
                 index_counter = 0
                 num_of_pages = 1
+                continued = False
+                bulk_indexer = BulkIndexer(ops_client, INDEX_NAME)
+                # Chunks of an earlier attempt on the same key are superseded by this run
+                manifest = load_chunk_manifest(s3_source, s3_key, shard)
+                previous_manifest, reuse = load_previous_version(email_id, s3_key, manifest, page_range)
                 
                 try:
                     response = {}
                     if file_extension.lower() in ['pdf']:
-                            reader = PdfReader(BytesIO(content))
-                            LOG.info(f'method=process_file_upload, num_of_pages={len(reader.pages)}')
-                            text_value = None
+                        # Spooled to /tmp, pypdf seeks into the file instead of holding it in memory
+                        # Extraction worker processes re-open the file, it then needs a name in /tmp
+                        pdf_file, _ = open_s3_file(s3_bucket_name, s3_key, named=PDF_EXTRACT_PROCESSES > 1)
+                        with pdf_file:
+                            reader = PdfReader(pdf_file)
                             num_of_pages = len(reader.pages)
-                            for page in reader.pages:
-                                text_value = None
-                                # Read Text on Page
-                                text_value = page.extract_text()
-                                # Read Image on Page
-                                pdf_img_txt_val = None
-                                img_counter = 0
-                                base64_encoded_images = []
-                                index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'PDF Page number {page.page_number}, total images found {len(page.images)}.')
-                                # Extract from Images on PDF
-                                for image_file_object in page.images:
-                                    # Extract through low cost LLM (Claude3-Haiku)
-                                    img_counter = img_counter + 1
-                                    base64_encoded_images.append(image_file_object.data)
-                                    # Claude supports upto 20 images per prompt
-                                    if img_counter >= 19:
-                                        ocr_prompt = generate_claude_3_ocr_prompt(base64_encoded_images)
-                                        index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'PDF Page number {page.page_number} contains {len(page.images)} images, processing {img_counter} images')    
-                                        try:
-                                        # Some images cant be read
-                                            if pdf_img_txt_val:
-                                                pdf_img_txt_val += query_bedrock(ocr_prompt, ocr_model_id)
-                                            else:
-                                                pdf_img_txt_val = query_bedrock(ocr_prompt, ocr_model_id)
-                                        except Exception as e:
-                                            LOG.error(f'Error reading image from PDF {s3_source}, error={e}')
-                                            index_success = False
-                                            error_messages.append(f"Page {page.page_number}. Error textracting image from PDF {str(e)}")
-                                            index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, ', '.join(error_messages))
-                                        finally:
-                                            base64_encoded_images = []
-                                            img_counter = 0
-                                # Extract the last batch of images if they werent textracted
-                                if len(base64_encoded_images) > 0:
-                                    LOG.info(f'method=process_file_upload, message=extract_last_batch_of_images, images={len(base64_encoded_images)}')
-                                    ocr_prompt = generate_claude_3_ocr_prompt(base64_encoded_images)
-                                    index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'PDF Page number {page.page_number} contains {len(page.images)} images, processing {img_counter} images')
-                                    try:
-                                        # Some images cant be read
-                                        if pdf_img_txt_val:
-                                            pdf_img_txt_val += query_bedrock(ocr_prompt, ocr_model_id)
-                                        else:
-                                            pdf_img_txt_val = query_bedrock(ocr_prompt, ocr_model_id)
-                                    except Exception as e:
-                                        LOG.error(f'Error reading image from PDF {s3_source}, error={e}')
-                                        index_success = False
-                                        error_messages.append(f"Page {page.page_number}. Error textracting image from PDF {str(e)}")
-                                        index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, ', '.join(error_messages))
-
-                                if text_value is None:
-                                    text_value = ''
-                                if pdf_img_txt_val is None:
-                                    pdf_img_txt_val = ''
-                                text_value = f'{text_value} {pdf_img_txt_val}'.strip()
-                                if (len(text_value.split()) <= 0):
-                                    LOG.info(f'Nothing to read on this Page {page.page_number}')
-                                    continue
-                                
-                                LOG.debug(f'method=process_file_upload, page_number={page.page_number}, page={page.page_number}, content={text_value}')
-                                event['body'] = json.dumps({"text": text_value, 's3_source': s3_source, 'email_id': email_id, 'doc_title': doc_title})
-                                response = index_documents(event)
-                                index_counter = index_counter + 1
-                                print(f'Indexing response image txt = {response}')
-                                index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'Page {page.page_number} complete', f'Total Pages {num_of_pages}, Indexed {index_counter}')
-                                if 'statusCode' in response and response['statusCode'] != '200':
-                                    LOG.error(f'Failed to index image on pdf {s3_key} on page {page.page_number}, error={response}')
-                                    index_success=False
-                                    error_messages.append(response['errorMessage'])
-                                    index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, ','.join(error_messages), f'Page {page.page_number} complete', f'Total Pages {num_of_pages}, Indexed {index_counter}')
+                            LOG.info(f'method=process_file_upload, num_of_pages={num_of_pages}')
+                            pdf_path = pdf_file.name if PDF_EXTRACT_PROCESSES > 1 else None
+                            index_counter, pdf_error_messages, continued = _process_pdf_pages(reader, s3_source, s3_key, email_id, utc_now, doc_title, bulk_indexer, completed_pages, context, manifest, reuse, page_range, pdf_path)
+                            if len(pdf_error_messages) > 0:
+                                index_success = False
+                                error_messages.extend(pdf_error_messages)
                                     
                     elif file_extension.lower() in ['png', 'jpg']:
                         # Extract through low cost LLM (Claude3-Haiku)
                         LOG.debug(f'method=process_file_upload, message=File is an image, record={record}')
-                        ocr_prompt = generate_claude_3_ocr_prompt([content])
-                        text_value = query_bedrock(ocr_prompt, ocr_model_id)
+                        content, _ = get_file_from_s3(s3_key)
+                        ocr_texts, ocr_stats, ocr_errors = ocr_cache.ocr_images([content], ocr_image_batch, ocr_model_id)
+                        LOG.info(f'method=process_file_upload, s3_key={s3_key}, ocr_stats={ocr_stats}')
+                        if len(ocr_errors) > 0:
+                            raise Exception(','.join(ocr_errors))
+                        text_value = ' '.join(ocr_texts)
                         LOG.debug(f'method=process_file_upload, file_type=image-text, content={text_value}')
-                        event['body'] = json.dumps({"text": text_value, 's3_source': s3_source, 'email_id': email_id, 'doc_title': doc_title})
-                        response = index_documents(event)
+                        response = index_text([text_value], s3_source, email_id, doc_title, bulk_indexer, manifest, reuse=reuse)
                         index_counter = index_counter + 1
                         if 'statusCode' in response and response['statusCode'] != '200':
                             LOG.error(f'Failed to index image {s3_key}, error={response}')
@@ -522,10 +562,8 @@ def process_file_upload(event):
                             error_messages.append(response['errorMessage'])
                         
                     else:
-                        decoded_txt = content.decode()
-                        LOG.debug(f'method=process_file_upload, decoded_txt={decoded_txt}')
-                        event['body'] = json.dumps({"text": decoded_txt, 's3_source': s3_source, 'email_id': email_id, 'doc_title': doc_title})
-                        response = index_documents(event)
+                        # Decoded and chunked incrementally, embedding starts with the first chunks
+                        response = index_text(iter_s3_text(s3_bucket_name, s3_key), s3_source, email_id, doc_title, bulk_indexer, manifest, reuse=reuse)
                         index_counter = index_counter + 1
                         if 'statusCode' in response and response['statusCode'] != '200':
                             LOG.error(f'Failed to index file {s3_key}, error={response}')
@@ -537,14 +575,38 @@ def process_file_upload(event):
                     index_success = False
                     error_messages.append(f"{str(e)}")
                 finally:
-                    if index_success:
+                    try:
+                        bulk_indexer.close()
+                        save_chunk_manifest(manifest, bulk_indexer)
+                    except Exception as e:
+                        LOG.error(f'Final bulk flush failed for file {s3_source}, error={e}')
+                        bulk_indexer.errors.append(str(e))
+                    LOG.info(f'method=process_file_upload, s3_source={s3_source}, bulk_stats={bulk_indexer.stats()}, peak_memory_mb={peak_memory_mb()}')
+                    if len(bulk_indexer.errors) > 0:
+                        index_success = False
+                        error_messages.extend(bulk_indexer.errors)
+                    if continued:
+                        index_audit_progress(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, ','.join(error_messages) if len(error_messages) > 0 else 'Continuing in a new invocation', f'Total Pages {num_of_pages}, Indexed Documents {index_counter}')
+                    elif shard is not None:
+                        # The shard that completes the document sets its final status for all shards
+                        complete_document_shard(email_id, s3_source, s3_key, utc_now, page_range, index_success, error_messages, num_of_pages)
+                    elif index_success:
+                        # The previous version stays searchable until this one is fully indexed
+                        swap_document_version(email_id, s3_source, s3_key, utc_now, previous_manifest, reuse)
                         LOG.debug('Index successful')
-                        index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._SUCCESS, utc_now, '' , f'Total Pages {num_of_pages}, Indexed Documents {index_counter}')
+                        index_audit_progress(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._SUCCESS, utc_now, '' , f'Total Pages {num_of_pages}, Indexed Documents {index_counter}')
                     else:
-                        index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._FAILURE, utc_now, ','.join(error_messages), f'Total Pages {num_of_pages}, Indexed Documents {index_counter}')
+                        index_audit_progress(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._FAILURE, utc_now, ','.join(error_messages), f'Total Pages {num_of_pages}, Indexed Documents {index_counter}')
+                    # The final status is written before the invocation can end
+                    audit_writer.flush()
+                    LOG.info(f'method=process_file_upload, s3_source={s3_source}, audit_stats={audit_writer.stats()}')
+                if continued:
+                    # The remaining pages and records are picked up by a fresh invocation
+                    (continuation or invoke_index_continuation)({'Records': event['Records'][record_index:]}, context)
+                    break
             
             
-            elif record['eventName'] == 'ObjectRemoved:Delete' and "index/" in record["s3"]["object"]["key"]:
+            elif record['eventName'] == 'ObjectRemoved:Delete' and record["s3"]["object"]["key"].startswith('index/'):
                 s3_source=''
                 s3_key=''
                 if 's3' in record:
@@ -552,10 +614,121 @@ def process_file_upload(event):
                     s3_bucket = record['s3']['bucket']['name']
                     s3_source = f'https://{s3_bucket}/{s3_key}'
                     LOG.info(f'Delete document from Index triggered for s3_key {s3_key}')
-                    delete_documents_by_s3_uri(s3_source)
+                    manifest = None
+                    try:
+                        manifest = ChunkManifest.load(s3_bucket_name, s3_key, namespace=MANIFEST_NAMESPACE)
+                    except Exception as e:
+                        LOG.error(f'method=process_file_upload, s3_key={s3_key}, message=manifest_unreadable, error={e}')
+                    if manifest is not None and manifest.superseded_by is not None:
+                        # A newer version owns the chunks that did not change, the others are already gone
+                        LOG.info(f'method=process_file_upload, s3_key={s3_key}, superseded_by={manifest.superseded_by}, message=index_delete_skipped')
+                        ChunkManifest.delete(s3_bucket_name, s3_key, namespace=MANIFEST_NAMESPACE)
+                        continue
+                    response = delete_documents_by_s3_uri(s3_source, manifest.doc_ids() if manifest is not None else None)
+                    if manifest is not None and response['statusCode'] == '200':
+                        ChunkManifest.delete(s3_bucket_name, s3_key, namespace=MANIFEST_NAMESPACE)
                        
     return success_response(f'File process complete for event {event}')
 
+# Pages flow through text extraction, image OCR and embedding/indexing as overlapping stages
+# so one slow OCR call no longer holds back the pages behind it
+# page_range [start, end) limits the run to the pages of one ingestion work item.
+# With pdf_path set, text and images are extracted by worker processes reading the file at that path
+def _process_pdf_pages(reader, s3_source, s3_key, email_id, utc_now, doc_title, bulk_indexer, completed_pages=None, context=None, manifest=None, reuse=None, page_range=None, pdf_path=None):
+    num_of_pages = len(reader.pages)
+    page_start, page_end = page_range if page_range is not None else (0, num_of_pages)
+    completed_pages = completed_pages or set()
+    error_messages = []
+    errors_lock = threading.Lock()
+    # Pages are only checkpointed once their chunks have been flushed to Opensearch
+    pending_checkpoints = []
+    done_pages = set(completed_pages)
+    out_of_time = []
+    ocr_counts = {}
+
+    # pypdf readers are not thread safe, pages are only read from the pipeline's caller thread
+    def extract_pages():
+        page_numbers = [page_number for page_number in range(max(0, page_start), min(page_end, num_of_pages)) if page_number not in completed_pages]
+        if pdf_path is not None and len(page_numbers) > 1:
+            # pypdf is pure Python, worker processes use the vCPUs the GIL keeps this process from using
+            items = iter_pdf_pages(pdf_path, page_numbers)
+        else:
+            items = (extract_page(reader, page_number) for page_number in page_numbers)
+        try:
+            for page_number in page_numbers:
+                if remaining_time_millis(context) < CONTINUATION_BUFFER_MILLIS:
+                    LOG.info(f'method=process_file_upload, s3_key={s3_key}, message=out_of_time, next_page={page_number}')
+                    out_of_time.append(page_number)
+                    return
+                yield next(items)
+        finally:
+            items.close()
+
+    # Repeated images (logos, letterheads, footers) are OCR'd once per document, or not at all when cached
+    def ocr_page(item):
+        images = item['images']
+        if len(images) > 0:
+            index_audit_progress(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'PDF Page number {item["page_number"]}, total images found {len(images)}.')
+            # Extract through low cost LLM (Claude3-Haiku)
+            ocr_texts, ocr_stats, ocr_errors = ocr_cache.ocr_images(images, ocr_image_batch, ocr_model_id)
+            for ocr_error in ocr_errors:
+                item['errors'].append(f"Page {item['page_number']}. {ocr_error} from PDF")
+            item['ocr_text'] = ' '.join([ocr_text for ocr_text in ocr_texts if ocr_text])
+            with errors_lock:
+                for name, count in ocr_stats.items():
+                    ocr_counts[name] = ocr_counts.get(name, 0) + count
+        item['images'] = []
+
+    def index_page(item):
+        text_value = f"{item['text']} {item.get('ocr_text', '')}".strip()
+        if (len(text_value.split()) <= 0):
+            LOG.info(f'Nothing to read on this Page {item["page_number"]}')
+            return None
+        LOG.debug(f'method=process_file_upload, page_number={item["page_number"]}, content={text_value}')
+        response = index_text([text_value], s3_source, email_id, doc_title, bulk_indexer, manifest, item['page_number'], reuse)
+        if 'statusCode' in response and response['statusCode'] != '200':
+            LOG.error(f'Failed to index pdf {s3_key} on page {item["page_number"]}, error={response}')
+            item['errors'].append(response['errorMessage'])
+        return response
+
+    def checkpoint_pages():
+        with errors_lock:
+            pages = list(pending_checkpoints)
+            pending_checkpoints.clear()
+        errors_before = len(bulk_indexer.errors)
+        bulk_indexer.flush()
+        # Pages whose chunks may have been dropped by the bulk indexer are redone on resume
+        if len(pages) > 0 and len(bulk_indexer.errors) == errors_before:
+            # The manifest is saved first so a resumed run knows the _ids of every checkpointed page
+            try:
+                if manifest is not None:
+                    save_chunk_manifest(manifest, bulk_indexer)
+            except Exception as e:
+                LOG.error(f'method=checkpoint_pages, s3_key={s3_key}, message=manifest_not_saved, error={e}')
+                return
+            index_checkpoint_pages(email_id, s3_key, pages)
+            with errors_lock:
+                done_pages.update(pages)
+
+    def on_page_complete(item, response, pipeline_pages):
+        with errors_lock:
+            error_messages.extend(item['errors'])
+            if len(item['errors']) == 0:
+                pending_checkpoints.append(item['page_number'])
+            should_checkpoint = len(pending_checkpoints) >= CHECKPOINT_EVERY_PAGES
+            audit_message = ','.join(error_messages) if len(error_messages) > 0 else f'Page {item["page_number"]} complete'
+            completed = done_pages.union(pipeline_pages)
+        if should_checkpoint:
+            checkpoint_pages()
+        stats = f'Total Pages {num_of_pages}, Indexed {len(completed)}, Pages complete in order {contiguous_pages_complete(completed)}'
+        index_audit_progress(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, audit_message, stats)
+
+    page_results, stage_seconds = run_page_pipeline(extract_pages(), ocr_page, index_page, on_page_complete)
+    checkpoint_pages()
+    index_counter = len(completed_pages) + len([page_result for page_result in page_results if page_result['result'] is not None])
+    LOG.info(f'method=process_file_upload, s3_source={s3_source}, pages={num_of_pages}, indexed_pages={index_counter}, stage_seconds={stage_seconds}, ocr_stats={ocr_counts}')
+    return index_counter, error_messages, len(out_of_time) > 0
+
 # def generate_title_and_index_doc(event, page_number, text_value, s3_source, email_id):
 #     LOG.info(f"generate_title_index_doc, text_value={text_value}, page_no={page_number}")
 #     try:        
@@ -603,6 +776,187 @@ def query_bedrock(prompt, model_id):
     return final_text
 
 
+# OCRs up to 19 labelled images in one call. Returns one text per image, or the raw
+# answer when the model did not keep to the per image format
+def ocr_image_batch(images, media_types, model_id):
+    ocr_prompt = generate_claude_3_ocr_batch_prompt(images, media_types)
+    response = bedrock_client.invoke_model(
+        body=json.dumps(ocr_prompt),
+        modelId=model_id,
+        accept='application/json',
+        contentType='application/json'
+    )
+    response_body = json.loads(response.get('body').read())
+    answer = ' \n '.join([content['text'] for content in response_body.get('content', []) if 'text' in content])
+    texts = parse_ocr_batch_response(answer, len(images))
+    return answer if texts is None else texts
+
+
+def load_chunk_manifest(s3_source, s3_key, shard=None):
+    try:
+        manifest = ChunkManifest.load(s3_bucket_name, s3_key, shard=shard, namespace=MANIFEST_NAMESPACE)
+        if manifest is not None:
+            return manifest
+    except Exception as e:
+        LOG.error(f'method=load_chunk_manifest, s3_key={s3_key}, shard={shard}, error={e}')
+    return ChunkManifest(s3_source, s3_key, shard, MANIFEST_NAMESPACE)
+
+
+# _ids replaced by a re-indexed chunk are deleted before the manifest is written
+def save_chunk_manifest(manifest, bulk_indexer):
+    superseded = manifest.take_superseded()
+    for doc_id in superseded:
+        bulk_indexer.delete(doc_id)
+    if len(superseded) > 0:
+        bulk_indexer.flush()
+    manifest.save(s3_bucket_name)
+
+
+# Manifest of the version this upload replaces, with its chunks indexed by content hash
+def load_previous_version(email_id, s3_key, manifest, page_range=None):
+    if INCREMENTAL_REINDEX != 'yes':
+        return None, None
+    try:
+        latest = get_latest_doc_version(email_id, logical_doc_key(s3_key))
+        if latest is None or latest['s3_key'] == s3_key:
+            return None, None
+        previous_manifest = ChunkManifest.load(s3_bucket_name, latest['s3_key'], namespace=MANIFEST_NAMESPACE)
+        if previous_manifest is None or previous_manifest.superseded_by is not None:
+            return None, None
+        LOG.info(f'method=load_previous_version, s3_key={s3_key}, previous_s3_key={latest["s3_key"]}, chunks={len(previous_manifest.chunks)}')
+        return previous_manifest, ChunkReuse(previous_manifest, manifest.doc_ids(), page_range)
+    except Exception as e:
+        LOG.error(f'method=load_previous_version, s3_key={s3_key}, error={e}')
+    return None, None
+
+
+# New and changed chunks are already indexed at this point, the chunks that vanished from the
+# document go in a single _bulk request so readers move from one version to the next at once
+def swap_document_version(email_id, s3_source, s3_key, utc_now, previous_manifest, reuse):
+    try:
+        if previous_manifest is not None:
+            vanished = reuse.unclaimed()
+            if len(vanished) > 0:
+                with BulkIndexer(ops_client, INDEX_NAME, max_docs=len(vanished), max_buffer_age_seconds=float('inf')) as delete_indexer:
+                    for doc_id in vanished:
+                        delete_indexer.delete(doc_id)
+                if len(delete_indexer.errors) > 0:
+                    LOG.error(f'method=swap_document_version, s3_key={s3_key}, errors={delete_indexer.errors[:10]}')
+            previous_manifest.superseded_by = s3_key
+            previous_manifest.clear()
+            previous_manifest.save(s3_bucket_name)
+            index_audit_update(email_id, previous_manifest.s3_source, previous_manifest.s3_key, FILE_UPLOAD_STATUS._SUPERSEDED, utc_now, f'Superseded by {s3_key}', f'Reused {reuse.reused} chunks, deleted {len(vanished)} chunks')
+            LOG.info(f'method=swap_document_version, s3_key={s3_key}, previous_s3_key={previous_manifest.s3_key}, reused={reuse.reused}, vanished={len(vanished)}')
+        set_latest_doc_version(email_id, logical_doc_key(s3_key), s3_key, s3_source)
+    except Exception as e:
+        LOG.error(f'method=swap_document_version, s3_key={s3_key}, error={e}')
+
+
+# Large PDFs coming from the ingestion queue are split into page range shards worked on in parallel.
+# Returns True when the document was handed to its shards
+def shard_document(item):
+    s3_key = item['s3_key']
+    if item.get('page_start') is not None or item['event_name'] != 'ObjectCreated:Post' or not s3_key.startswith('index/') or not s3_key.lower().endswith('.pdf'):
+        return False
+    record = s3_record(item)
+    email_id, utc_now, doc_title = get_upload_attributes(record, s3_key)
+    audit_key = {INDEX_KEYS._PRIMARY_KEY: 'INDEX', INDEX_KEYS._SORT_KEY: generate_sort_key(email_id, s3_key)}
+    if shard_coordinator.dispatched(audit_key, item['sequencer']):
+        LOG.info(f'method=shard_document, s3_key={s3_key}, message=already_dispatched')
+        return True
+    pdf_file, _ = open_s3_file(s3_bucket_name, s3_key)
+    with pdf_file:
+        num_of_pages = len(PdfReader(pdf_file).pages)
+    if not shard_coordinator.should_shard(num_of_pages):
+        return False
+    s3_source = f'https://{item["s3_bucket"]}/{s3_key}'
+    index_audit_insert(email_id, s3_source, s3_key, utc_now, s3_sequencer=item['sequencer'])
+    # Every shard writes to the index the document started on
+    shards = shard_coordinator.start(audit_key, dict(item, index_name=INDEX_NAME), num_of_pages)
+    index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._INPROGRESS, utc_now, f'Split into {shards} shards', f'Total Pages {num_of_pages}, Shards {shards}')
+    return True
+
+
+# Records the outcome of a shard on the audit record, the shard completing the document merges the
+# shard manifests, swaps the document version and sets the final status
+def complete_document_shard(email_id, s3_source, s3_key, utc_now, page_range, index_success, error_messages, num_of_pages):
+    # Progress of this shard must not land after the final status set by the last shard
+    audit_writer.flush()
+    audit_key = {INDEX_KEYS._PRIMARY_KEY: 'INDEX', INDEX_KEYS._SORT_KEY: generate_sort_key(email_id, s3_key)}
+    try:
+        progress, finalize = shard_coordinator.complete(audit_key, page_range, index_success, ','.join(error_messages))
+    except Exception as e:
+        LOG.error(f'method=complete_document_shard, s3_key={s3_key}, page_range={page_range}, error={e}')
+        index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._FAILURE, utc_now, f'Pages {page_range}. Shard not recorded {str(e)}')
+        return
+    if not finalize:
+        return
+    stats = f'Total Pages {num_of_pages}, Shards {progress["total"]}, Failed shards {progress["failed"]}'
+    manifest = ChunkManifest(s3_source, s3_key, namespace=MANIFEST_NAMESPACE)
+    try:
+        shards = progress['shard_ids']
+        with BulkIndexer(ops_client, INDEX_NAME) as bulk_indexer:
+            for shard in shards:
+                shard_manifest = ChunkManifest.load(s3_bucket_name, s3_key, shard=shard, namespace=MANIFEST_NAMESPACE)
+                if shard_manifest is not None:
+                    manifest.merge(shard_manifest)
+            save_chunk_manifest(manifest, bulk_indexer)
+        for shard in shards:
+            ChunkManifest.delete(s3_bucket_name, s3_key, shard=shard, namespace=MANIFEST_NAMESPACE)
+    except Exception as e:
+        LOG.error(f'method=complete_document_shard, s3_key={s3_key}, message=manifest_merge_failed, error={e}')
+        progress['errors'].append(f'Chunk manifest not merged {str(e)}')
+    if progress['failed'] > 0 or len(progress['errors']) > 0:
+        index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._FAILURE, utc_now, ','.join(progress['errors']), stats)
+        return
+    previous_manifest, reuse = load_previous_version(email_id, s3_key, manifest)
+    swap_document_version(email_id, s3_source, s3_key, utc_now, previous_manifest, reuse)
+    index_audit_update(email_id, s3_source, s3_key, FILE_UPLOAD_STATUS._SUCCESS, utc_now, '', stats)
+
+
+def remaining_time_millis(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis()
+
+
+# Re-invokes this Lambda asynchronously with the records that are left to process
+def invoke_index_continuation(event, context):
+    LOG.info(f'method=invoke_index_continuation, records={len(event["Records"])}')
+    lambda_client = boto3.client('lambda')
+    lambda_client.invoke(FunctionName=context.invoked_function_arn,
+                         InvocationType='Event',
+                         Payload=json.dumps(event))
+
+
+# Consumes a batch of the ingestion queue, messages that raise are reported back to SQS for a retry
+def process_ingestion_batch(event, context=None):
+    def process(item):
+        # A rebuild continuation that was waiting for its settle time
+        if 'rebuild_index' in item:
+            rebuild_index(item, context)
+            return
+        use_active_index(item.get('index_name'))
+        if shard_document(item):
+            return
+        record = s3_record(item)
+        # Out of time on a large PDF, the same item goes back to the queue and resumes from its checkpoints
+        requeue = lambda remaining, context: ingestion_queue.enqueue([dict(item, index_name=record.get('index_name'))])
+        LOG.info(f'method=process_ingestion_batch, tenant={item["tenant"]}, s3_key={item["s3_key"]}, page_start={item.get("page_start")}, page_end={item.get("page_end")}')
+        process_file_upload({'Records': [record]}, context, requeue)
+
+    failed = ingestion_queue.consume(event['Records'], process,
+                                     lambda: remaining_time_millis(context) < CONTINUATION_BUFFER_MILLIS)
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+
+# Uploads are scheduled per user, the user is only known from the object metadata
+def ingestion_tenant(item):
+    if not item['event_name'].startswith('ObjectCreated'):
+        return 'no-id-set'
+    return get_file_attributes(item['s3_key']).get('email_id', 'no-id-set')
+
+
 def get_file_from_s3(s3_key):
     s3_client = boto3.client('s3')
     
@@ -611,6 +965,25 @@ def get_file_from_s3(s3_key):
     LOG.debug(f'method=get_file_from_s3,  bucket_key={s3_bucket_name}/{s3_key}, response={response}')
     return file_bytes, response['Metadata']
 
+# (email_id, utc_now, doc_title) of an upload, from the metadata set by the presigned POST
+def get_upload_attributes(record, s3_key):
+    metadata = get_file_attributes(s3_key)
+    email_id = 'no-id-set'
+    utc_now = ''
+    doc_title = '1'
+    if 'email_id' in metadata:
+        email_id = metadata['email_id']
+    elif 'userIdentity' in record:
+        principal_id = record['userIdentity']['principalId']
+        email_id = principal_id.replace('AWS:', '').replace(':', '-')
+    if 'upload_utc' in metadata:
+        utc_now = metadata['upload_utc']
+    else:
+        utc_now = now_utc_iso8601()
+    if 'doc_title' in metadata:
+        doc_title = metadata['doc_title']
+    return email_id, utc_now, doc_title
+
 def get_file_attributes(s3_key):
     s3_client = boto3.client('s3')
     metadata = {}
@@ -631,6 +1004,19 @@ def handler(event, context):
     LOG.info("---  Amazon Opensearch Serverless vector db example with Amazon Bedrock Models ---")
     LOG.info(f"--- Event {event} --")
     
+    # This comes from a truncation of the table that ran out of time
+    if 'truncate_state' in event:
+        return continue_truncate_table(event, context)
+
+    use_active_index()
+    # Started with a direct invocation, {'rebuild_index': {'embed_model_id': ..., 'dimension': ...}}, then continued by itself
+    if 'rebuild_index' in event:
+        return rebuild_index(event, context)
+
+    # This comes from the ingestion queue, SQS reads batchItemFailures from the raw response
+    if 'Records' in event and len(event['Records']) > 0 and event['Records'][0].get('eventSource') == 'aws:sqs':
+        return process_ingestion_batch(event, context)
+
     # This comes from S3 event notification
     if 'Records' in event:
             event['httpMethod']= 'POST'
@@ -644,7 +1030,7 @@ def handler(event, context):
             'GET/rag/get-presigned-url': lambda x: create_presigned_post(x),
             'POST/rag/del-file': lambda x: delete_file(x),
             'GET/rag/get-indexed-files-by-user': lambda x: get_indexed_files_by_user(x),
-            'POSTs3-upload-file': lambda x: process_file_upload(x),
+            'POSTs3-upload-file': lambda x: process_file_upload(x, context),
         }
         
         http_method = event['httpMethod'] if 'httpMethod' in event else ''
@@ -667,35 +1053,114 @@ def failure_response(error_message):
 def success_response(result):
     return {"success": True, "result": result, "statusCode": "200"}
 
-def truncateTable():
-    global table
-    #get the table keys
-    tableKeyNames = [key.get("AttributeName") for key in table.key_schema]
+# Parallel scan delete of the whole table. Whatever is left after time_budget_seconds is handed
+# to an async invocation of this Lambda with the LastEvaluatedKey of every segment
+def truncateTable(state=None, time_budget_seconds=TRUNCATE_SYNC_SECONDS):
+    stats, state = TableTruncator(table).truncate(state, time.time() + time_budget_seconds)
+    if state is not None:
+        invoke_truncate_continuation(state)
+    LOG.info(f"Deleted {stats['deleted']}, complete={stats['complete']}")
+    return stats
 
-    #Only retrieve the keys for each item in the table (minimize data transfer)
-    projectionExpression = ", ".join('#' + key for key in tableKeyNames)
-    expressionAttrNames = {'#'+key: key for key in tableKeyNames}
-    
-    counter = 0
-    page = table.scan(ProjectionExpression=projectionExpression, ExpressionAttributeNames=expressionAttrNames)
-    with table.batch_writer() as batch:
-        while page["Count"] > 0:
-            counter += page["Count"]
-            # Delete items in batches
-            for itemKeys in page["Items"]:
-                batch.delete_item(Key=itemKeys)
-            # Fetch the next page
-            if 'LastEvaluatedKey' in page:
-                page = table.scan(
-                    ProjectionExpression=projectionExpression, ExpressionAttributeNames=expressionAttrNames,
-                    ExclusiveStartKey=page['LastEvaluatedKey'])
-            else:
-                break
-    LOG.info(f"Deleted {counter}")
+
+def continue_truncate_table(event, context=None):
+    time_budget_seconds = (remaining_time_millis(context) - CONTINUATION_BUFFER_MILLIS) / 1000
+    stats = truncateTable(event['truncate_state'], max(TRUNCATE_SYNC_SECONDS, time_budget_seconds))
+    return success_response(f"Deleted {stats['deleted']} items, complete={stats['complete']}")
+
+
+def invoke_truncate_continuation(state):
+    LOG.info(f'method=invoke_truncate_continuation, state={state}')
+    lambda_client = boto3.client('lambda')
+    lambda_client.invoke(FunctionName=getenv('AWS_LAMBDA_FUNCTION_NAME'),
+                         InvocationType='Event',
+                         Payload=json.dumps({'truncate_state': state}))
+
+
+# Points INDEX_NAME, the chunk manifest namespace and the embed model at the index the alias resolves to,
+# or at index_name when an upload is pinned to the index it started on
+def use_active_index(index_name=None):
+    global INDEX_NAME, MANIFEST_NAMESPACE, embed_model_id, embedding_cache
+    if index_name is None:
+        index_name, model_id = index_alias.resolve()
+    elif index_name == INDEX_NAME:
+        return
+    else:
+        model_id = index_alias.model_for(index_name)
+    if index_name != INDEX_NAME:
+        LOG.info(f'method=use_active_index, index_name={index_name}, embed_model_id={model_id}')
+    INDEX_NAME = index_name
+    MANIFEST_NAMESPACE = index_alias.manifest_namespace(index_name)
+    if model_id != embed_model_id:
+        embed_model_id = model_id
+        embedding_cache = EmbeddingCache(table, model_id)
+
+
+# Builds the next physical index of the alias next to the active one and switches to it once filled,
+# see IndexRebuilder. Changing the embed model or the HNSW parameters no longer empties the index
+def rebuild_index(event, context=None):
+    request = event['rebuild_index']
+    if 'phase' in request:
+        state = request
+    else:
+        model_id = request.get('embed_model_id', embed_model_id)
+        try:
+            target_index = index_alias.begin_rebuild(model_id)
+        except dynamodb_client.meta.client.exceptions.ConditionalCheckFailedException:
+            return failure_response(f'A rebuild of {INDEX_ALIAS_NAME} is already in progress')
+        create_index(target_index, int(request.get('dimension', EMBED_DIMENSION)), int(request.get('ef_construction', HNSW_EF_CONSTRUCTION)),
+                     int(request.get('m', HNSW_M)), int(request.get('ef_search', HNSW_EF_SEARCH)))
+        state = IndexRebuilder.new_state(INDEX_NAME, target_index, MANIFEST_NAMESPACE, index_alias.manifest_namespace(target_index),
+                                         float(request.get('max_count_drift', REBUILD_MAX_COUNT_DRIFT)))
+        # Vectors are copied as they are unless the rebuild moves to another embed model
+        state['embed_model_id'] = model_id if model_id != embed_model_id else None
+    embed_fn = rebuild_embed_fn(state['embed_model_id']) if state['embed_model_id'] is not None else None
+    deadline = time.time() + (remaining_time_millis(context) - CONTINUATION_BUFFER_MILLIS) / 1000
+    state = IndexRebuilder(ops_client, index_alias, s3_bucket_name, embed_fn=embed_fn).step(state, deadline)
+    if state['phase'] == 'failed':
+        return failure_response(state['error'])
+    if state['phase'] != 'done':
+        invoke_rebuild_continuation(state, state.get('resume_epoch', 0) - time.time())
+    return success_response(f"Rebuild of {state['target_index']} in phase {state['phase']}, stats={state['stats']}")
+
+
+# A continuation that has to wait (the settle phase) is a delayed message of the ingestion queue,
+# the Lambda does not sit idle through it. SQS delays a message by 15 minutes at most, a longer
+# wait is handed on again when the message arrives
+def invoke_rebuild_continuation(state, delay_seconds=0):
+    LOG.info(f'method=invoke_rebuild_continuation, target_index={state["target_index"]}, phase={state["phase"]}, delay_seconds={max(0, delay_seconds)}')
+    if delay_seconds > 0:
+        if ingestion_queue.enabled():
+            ingestion_queue.enqueue([{'tenant': REBUILD_TENANT, 'rebuild_index': state, 'deferrals': 0}], min(int(delay_seconds) + 1, SQS_MAX_DELAY_SECONDS))
+            return
+        # Without the queue the wait can only be spent in invocations, a short one each
+        time.sleep(min(delay_seconds, REBUILD_SETTLE_POLL_SECONDS))
+    lambda_client = boto3.client('lambda')
+    lambda_client.invoke(FunctionName=getenv('AWS_LAMBDA_FUNCTION_NAME'),
+                         InvocationType='Event',
+                         Payload=json.dumps({'rebuild_index': state}))
+
+
+# Embeds the documents copied into an index of another embed model, through the embedding cache of that model
+def rebuild_embed_fn(model_id):
+    batcher = EmbeddingBatcher(bedrock_client, model_id)
+    cache = EmbeddingCache(table, model_id)
+
+    def embed(texts):
+        embeddings, _ = cache.get_many(texts)
+        missing_positions = [position for position in range(len(texts)) if position not in embeddings]
+        if len(missing_positions) > 0:
+            missing_texts = [texts[position] for position in missing_positions]
+            new_embeddings = batcher.embed(missing_texts)
+            cache.put_many(missing_texts, new_embeddings)
+            for position, embedding in zip(missing_positions, new_embeddings):
+                embeddings[position] = embedding
+        return [embeddings[position] for position in range(len(texts))]
+    return embed
 
 # Store the indexing metadata information in a dynamodb table
 # Triggered when a file is uploaded to S3
-def index_audit_insert(email_id, s3_uri, file_id, utc_now, error_message='None'):
+def index_audit_insert(email_id, s3_uri, file_id, utc_now, error_message='None', s3_sequencer=''):
     LOG.info(f'method=index_audit_insert, email_id={email_id}, s3_uri={s3_uri}')
     record = {
         INDEX_KEYS._EMAIL_ID: email_id,
@@ -705,8 +1170,10 @@ def index_audit_insert(email_id, s3_uri, file_id, utc_now, error_message='None')
         INDEX_KEYS._INDEX_TIMESTAMP: utc_now,
         INDEX_KEYS._UPLOAD_STATUS: FILE_UPLOAD_STATUS._INPROGRESS,
         INDEX_KEYS._ERROR_MESSAGE: error_message,
+        INDEX_KEYS._ERROR_SUMMARY: error_message[:ERROR_SUMMARY_CHARS],
         INDEX_KEYS._stats: '',
-        INDEX_KEYS._UPDATE_EPOCH: int(time.time())
+        INDEX_KEYS._UPDATE_EPOCH: int(time.time()),
+        INDEX_KEYS._S3_SEQUENCER: s3_sequencer
     }
 
     if all(key in record for key in ([INDEX_KEYS._EMAIL_ID, INDEX_KEYS._S3_SOURCE, INDEX_KEYS._FILE_ID, INDEX_KEYS._UPLOAD_TIMESTAMP, INDEX_KEYS._UPLOAD_STATUS])):
@@ -732,10 +1199,11 @@ def index_audit_update(email_id, s3_uri, file_id, file_index_status, utc_now, er
                         INDEX_KEYS._PRIMARY_KEY: 'INDEX',
                         INDEX_KEYS._SORT_KEY: generate_sort_key(email_id, file_id)
                     },
-                    UpdateExpression=f"set {INDEX_KEYS._UPLOAD_STATUS}=:s, {INDEX_KEYS._ERROR_MESSAGE}=:errm, {INDEX_KEYS._UPDATE_EPOCH}=:u_epoch, {INDEX_KEYS._stats}=:istats ",
+                    UpdateExpression=f"set {INDEX_KEYS._UPLOAD_STATUS}=:s, {INDEX_KEYS._ERROR_MESSAGE}=:errm, {INDEX_KEYS._ERROR_SUMMARY}=:errs, {INDEX_KEYS._UPDATE_EPOCH}=:u_epoch, {INDEX_KEYS._stats}=:istats ",
                     ExpressionAttributeValues={
                         ':s': file_index_status,
                         ':errm': error_message,
+                        ':errs': error_message[:ERROR_SUMMARY_CHARS],
                         ':u_epoch': int(time.time()),
                         ':istats': stats
                     }
@@ -746,27 +1214,98 @@ def index_audit_update(email_id, s3_uri, file_id, file_index_status, utc_now, er
     return success_response(f"Updated index audit for email_id={email_id}, utc_now={utc_now}, file_id={file_id}")
 
 
+# Coalesced through the audit writer, a change of status is written straight away and progress
+# within a status at most every AUDIT_FLUSH_SECONDS
+def index_audit_progress(email_id, s3_uri, file_id, file_index_status, utc_now, error_message="None", stats="None"):
+    audit_writer.update((email_id, file_id), file_index_status, (email_id, s3_uri, file_id, file_index_status, utc_now, error_message, stats))
+
+
+# Records pages whose chunks are safely in Opensearch, ADD keeps concurrent writers from overwriting each other
+def index_checkpoint_pages(email_id, file_id, page_numbers):
+    try:
+        table.update_item(
+                    Key={
+                        INDEX_KEYS._PRIMARY_KEY: 'INDEX',
+                        INDEX_KEYS._SORT_KEY: generate_sort_key(email_id, file_id)
+                    },
+                    UpdateExpression=f"ADD {INDEX_KEYS._PAGES_DONE} :pages SET {INDEX_KEYS._UPDATE_EPOCH}=:u_epoch",
+                    ExpressionAttributeValues={
+                        ':pages': set(page_numbers),
+                        ':u_epoch': int(time.time())
+                    }
+        )
+    except Exception as e:
+        LOG.error(f'error=failed_to_checkpoint_pages, email_id={email_id}, file_id={file_id}, pages={page_numbers}, error={e}')
+
+
+# Pages already indexed for this exact upload, empty when the upload has to start from page 1
+def get_index_checkpoint(email_id, file_id, s3_sequencer):
+    if not s3_sequencer:
+        return set()
+    try:
+        response = table.get_item(
+                    Key={
+                        INDEX_KEYS._PRIMARY_KEY: 'INDEX',
+                        INDEX_KEYS._SORT_KEY: generate_sort_key(email_id, file_id)
+                    },
+                    ProjectionExpression=f"{INDEX_KEYS._S3_SEQUENCER}, {INDEX_KEYS._UPLOAD_STATUS}, {INDEX_KEYS._PAGES_DONE}"
+        )
+        item = response.get('Item')
+        if item is None or item.get(INDEX_KEYS._S3_SEQUENCER) != s3_sequencer or item.get(INDEX_KEYS._UPLOAD_STATUS) != FILE_UPLOAD_STATUS._INPROGRESS:
+            return set()
+        return set(int(page_number) for page_number in item.get(INDEX_KEYS._PAGES_DONE, set()))
+    except Exception as e:
+        LOG.error(f'error=failed_to_get_index_checkpoint, email_id={email_id}, file_id={file_id}, error={e}')
+    return set()
+
+
+def get_latest_doc_version(email_id, doc_key):
+    response = table.get_item(
+                Key={
+                    INDEX_KEYS._PRIMARY_KEY: 'DOC_VERSION',
+                    INDEX_KEYS._SORT_KEY: generate_doc_version_sort_key(email_id, doc_key)
+                }
+    )
+    return response.get('Item')
+
+
+# Points a logical document (file name without upload timestamp) at its latest indexed upload
+def set_latest_doc_version(email_id, doc_key, s3_key, s3_source):
+    table.put_item(Item={
+        INDEX_KEYS._PRIMARY_KEY: 'DOC_VERSION',
+        INDEX_KEYS._SORT_KEY: generate_doc_version_sort_key(email_id, doc_key),
+        's3_key': s3_key,
+        INDEX_KEYS._S3_SOURCE: s3_source,
+        INDEX_KEYS._UPDATE_EPOCH: int(time.time())
+    })
+
+
+# One page of the files of a user, newest upload first. Pass the next_cursor of the
+# response back as the cursor query parameter to get the following page
 def get_indexed_files_by_user(event):
-    query_params = {}
-    if 'queryStringParameters' in event:
-        query_params = event['queryStringParameters']
+    query_params = event.get('queryStringParameters') or {}
     if 'requestContext' in event and 'authorizer' in event['requestContext']:
             if 'claims' in event['requestContext']['authorizer']:
                 email_id = event['requestContext']['authorizer']['claims']['email']
                 LOG.info(f'method=get_indexed_files_by_user, user_id={email_id}')
                 try:
-                    response = table.query(
-                        KeyConditionExpression=Key(INDEX_KEYS._PRIMARY_KEY).eq('INDEX') 
-                                    & Key(INDEX_KEYS._SORT_KEY)\
-                                    .begins_with(get_sort_key_beginswith_user_id(email_id)),
-                        ScanIndexForward=False
-                    )
-                
-                    items = response['Items']
-                    while 'LastEvaluatedKey' in response:
-                        response = table.query(ExclusiveStartKey=response['LastEvaluatedKey'])
-                        items.extend(response['Items'])
-                    return success_response(items)
+                    limit = max(1, min(int(query_params.get('limit', LIST_FILES_PAGE_SIZE)), LIST_FILES_MAX_PAGE_SIZE))
+                    query = {
+                        'IndexName': LIST_FILES_INDEX_NAME,
+                        'KeyConditionExpression': Key(INDEX_KEYS._EMAIL_ID).eq(email_id),
+                        'ScanIndexForward': False,
+                        'Limit': limit
+                    }
+                    if query_params.get('cursor'):
+                        query['ExclusiveStartKey'] = decode_list_cursor(query_params['cursor'], email_id)
+                except Exception as e:
+                    LOG.error(f'error=invalid_list_request, error={e}, user_id={email_id}, query_params={query_params}')
+                    return failure_response('Invalid limit or cursor')
+                try:
+                    response = table.query(**query)
+                    result = success_response(response['Items'])
+                    result['next_cursor'] = encode_list_cursor(response['LastEvaluatedKey']) if 'LastEvaluatedKey' in response else None
+                    return result
                 except Exception as e:
                     LOG.error(f'error=failed_to_get_indexed_files_by_user, error={e}, user_id={email_id}')
                     return failure_response(f'Failed to get indexed files for user {email_id}')
@@ -774,12 +1313,27 @@ def get_indexed_files_by_user(event):
         return failure_response(f'Unauthorized request. Email_id not found')
     
     
+def encode_list_cursor(last_evaluated_key):
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key, cls=CustomJsonEncoder).encode('utf-8')).decode('utf-8')
+
+
+# A cursor only ever continues the listing of the user it was handed to
+def decode_list_cursor(cursor, email_id):
+    last_evaluated_key = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    if last_evaluated_key.get(INDEX_KEYS._EMAIL_ID) != email_id:
+        raise ValueError('cursor belongs to another user')
+    return last_evaluated_key
+
+
 def get_sort_key_beginswith_user_id(email_id):
     return f'user-{email_id}-'
 
 def generate_sort_key(user_id, file_id):
     return f'user-{user_id}-fileid-{file_id}'
 
+def generate_doc_version_sort_key(user_id, doc_key):
+    return f'user-{user_id}-doc-{doc_key}'
+
 def sanitize_s3_key(s3_key):
     s3_key
     return s3_key.replace('/', '')
@@ -797,7 +1351,10 @@ class INDEX_KEYS():
     _UPDATE_EPOCH: str = 'update_epoch'
     _UPLOAD_STATUS: str = 'file_index_status'
     _ERROR_MESSAGE: str = 'idx_err_msg'
+    _ERROR_SUMMARY: str = 'idx_err_summary'
     _stats: str = 'index_stats'
+    _S3_SEQUENCER: str = 's3_sequencer'
+    _PAGES_DONE: str = 'pages_done'
 
 class FILE_UPLOAD_STATUS():
     _SUCCESS: str = 'completed'
@@ -806,6 +1363,7 @@ class FILE_UPLOAD_STATUS():
     _FAILURE: str = 'failure'
     _DELETED: str = 'file_deleted'
     _INDEX_DELETE: str = 'index_deleted'
+    _SUPERSEDED: str = 'superseded'
 
 # Hack
 class CustomJsonEncoder(json.JSONEncoder):
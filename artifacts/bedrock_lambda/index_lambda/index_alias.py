@@ -0,0 +1,116 @@
+from os import getenv
+import logging
+import threading
+import time
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# How long a Lambda keeps using the physical index it resolved before reading the pointer again
+INDEX_ALIAS_CACHE_SECONDS = float(getenv("INDEX_ALIAS_CACHE_SECONDS", "30"))
+
+
+# Opensearch Serverless has no index aliases. The alias is a pointer record in the DynamoDB index
+# table naming the physical index (and the embed model its vectors come from) that reads and writes
+# go to. A rebuild fills {alias}-v{N+1} next to the active index and switch() moves the pointer.
+# Without a pointer record the alias resolves to the index of the same name, as before versioning
+class IndexAlias():
+
+    def __init__(self, table, alias_name, default_model_id, cache_seconds=INDEX_ALIAS_CACHE_SECONDS):
+        self.table = table
+        self.alias_name = alias_name
+        self.default_model_id = default_model_id
+        self.cache_seconds = cache_seconds
+        self._cached = None
+        self._cached_at = 0
+        self._lock = threading.Lock()
+
+    def key(self):
+        return {'prim_key': 'INDEX_ALIAS', 'sort_key': self.alias_name}
+
+    # (physical index name, embed model id)
+    def resolve(self):
+        with self._lock:
+            if self._cached is not None and time.time() - self._cached_at < self.cache_seconds:
+                return self._cached
+        resolved = (self.alias_name, self.default_model_id)
+        try:
+            item = self.get()
+            if item is not None and 'active_index' in item:
+                resolved = (item['active_index'], item.get('embed_model_id', self.default_model_id))
+        except Exception as e:
+            # Reads keep working on the last known index when the pointer can not be read
+            LOG.error(f'method=index_alias_resolve, alias={self.alias_name}, error={e}')
+            with self._lock:
+                if self._cached is not None:
+                    return self._cached
+        with self._lock:
+            self._cached = resolved
+            self._cached_at = time.time()
+        return resolved
+
+    def get(self):
+        return self.table.get_item(Key=self.key(), ConsistentRead=True).get('Item')
+
+    # Embed model of a physical index the pointer knows about, an upload stays on the index it started on
+    def model_for(self, index_name):
+        item = self.get() or {}
+        for index_attribute, model_attribute in [('active_index', 'embed_model_id'), ('building_index', 'building_model_id'), ('previous_index', 'previous_model_id')]:
+            if item.get(index_attribute) == index_name:
+                return item.get(model_attribute, self.default_model_id)
+        return self.default_model_id
+
+    # Every physical index of the alias, the active one first
+    def index_names(self):
+        item = self.get() or {}
+        names = [item.get('active_index', self.alias_name)]
+        for name in [self.alias_name, item.get('building_index'), item.get('previous_index')]:
+            if name is not None and name not in names:
+                names.append(name)
+        return names
+
+    # Chunk manifests of the unversioned index keep their original location
+    def manifest_namespace(self, index_name):
+        return None if index_name == self.alias_name else index_name
+
+    # Reserves the next physical index for a rebuild, fails when one is already in progress
+    def begin_rebuild(self, embed_model_id=None):
+        item = self.get() or {}
+        version = int(item.get('version', 0)) + 1
+        target_index = f'{self.alias_name}-v{version}'
+        active_index, active_model_id = self.resolve()
+        self.table.update_item(
+            Key=self.key(),
+            UpdateExpression='SET building_index=:target, building_model_id=:model, version=:version, '
+                             'active_index=if_not_exists(active_index, :active), embed_model_id=if_not_exists(embed_model_id, :active_model), '
+                             'rebuild_started_epoch=:now, update_epoch=:now',
+            ConditionExpression='attribute_not_exists(building_index)',
+            ExpressionAttributeValues={':target': target_index, ':model': embed_model_id or active_model_id, ':version': version,
+                                       ':active': active_index, ':active_model': active_model_id, ':now': int(time.time())}
+        )
+        LOG.info(f'method=index_alias_begin_rebuild, alias={self.alias_name}, active_index={active_index}, target_index={target_index}')
+        return target_index
+
+    # Points reads and writes at the rebuilt index in a single conditional write
+    def switch(self, target_index):
+        response = self.table.update_item(
+            Key=self.key(),
+            UpdateExpression='SET active_index=building_index, embed_model_id=building_model_id, previous_index=active_index, '
+                             'previous_model_id=embed_model_id, switched_epoch=:now, update_epoch=:now REMOVE building_index, building_model_id',
+            ConditionExpression='building_index=:target',
+            ExpressionAttributeValues={':target': target_index, ':now': int(time.time())},
+            ReturnValues='ALL_NEW'
+        )
+        with self._lock:
+            self._cached = None
+        LOG.info(f'method=index_alias_switch, alias={self.alias_name}, active_index={target_index}, previous_index={response["Attributes"].get("previous_index")}')
+        return response['Attributes']
+
+    def abort(self, target_index):
+        self.table.update_item(
+            Key=self.key(),
+            UpdateExpression='SET update_epoch=:now REMOVE building_index, building_model_id',
+            ConditionExpression='building_index=:target',
+            ExpressionAttributeValues={':target': target_index, ':now': int(time.time())}
+        )
+        LOG.info(f'method=index_alias_abort, alias={self.alias_name}, target_index={target_index}')
@@ -0,0 +1,241 @@
+from os import getenv
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+import boto3
+from bulk_indexer import BulkIndexer
+from chunk_manifest import ChunkManifest, manifest_key, manifest_prefix
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Manifests listed and copied per step, the state is saved after each of them
+REBUILD_FILES_PER_BATCH = int(getenv("REBUILD_FILES_PER_BATCH", "50"))
+REBUILD_FETCH_SIZE = int(getenv("REBUILD_FETCH_SIZE", "100"))
+REBUILD_WORKERS = int(getenv("REBUILD_WORKERS", "4"))
+# Catch-up passes over the manifests changed while the previous pass ran, before the switch
+REBUILD_CATCH_UP_PASSES = int(getenv("REBUILD_CATCH_UP_PASSES", "3"))
+# Share of documents the rebuilt index may miss compared to the active one and still be switched to
+REBUILD_MAX_COUNT_DRIFT = float(getenv("REBUILD_MAX_COUNT_DRIFT", "0.01"))
+# Uploads that resolved the previous index before the switch finish on it, they are copied once this has passed
+REBUILD_SETTLE_SECONDS = int(getenv("REBUILD_SETTLE_SECONDS", "900"))
+
+
+def manifest_is_shard(key):
+    return '.shard-' in key
+
+
+# Fills the physical index reserved by IndexAlias.begin_rebuild from the chunk store: the chunk
+# manifests of the active index name every indexed _id, the documents are read from the active index
+# by _id and bulk indexed in the new one, re-embedded when the rebuild moves to another embed model.
+# The new index gets its own manifests, written in its namespace once their documents are acknowledged.
+# Uploads keep going to the active index while the rebuild runs, catch-up passes copy what changed.
+# Phases: copy -> catch_up -> sweep -> verify -> switch -> settle -> catch_up -> sweep -> done
+# step(state, deadline) returns the state to resume from, with phase 'done' once the alias is switched
+# and 'failed' when the rebuilt index did not pass the count check. While settling it returns straight
+# away with 'resume_epoch' set, the caller resumes the state then instead of waiting in the invocation
+class IndexRebuilder():
+
+    def __init__(self, ops_client, index_alias, bucket, s3_client=None, embed_fn=None, files_per_batch=REBUILD_FILES_PER_BATCH,
+                 fetch_size=REBUILD_FETCH_SIZE, workers=REBUILD_WORKERS):
+        self.ops_client = ops_client
+        self.index_alias = index_alias
+        self.bucket = bucket
+        self.s3_client = s3_client or boto3.client('s3')
+        # embed_fn(texts) -> embeddings of the target embed model, None keeps the stored vectors
+        self.embed_fn = embed_fn
+        self.files_per_batch = files_per_batch
+        self.fetch_size = fetch_size
+        self.workers = max(1, workers)
+
+    @staticmethod
+    def new_state(source_index, target_index, source_namespace, target_namespace, max_count_drift=REBUILD_MAX_COUNT_DRIFT):
+        return {'source_index': source_index, 'target_index': target_index,
+                'source_namespace': source_namespace, 'target_namespace': target_namespace,
+                'phase': 'copy', 'token': None, 'pass_started_epoch': int(time.time()), 'since_epoch': None,
+                'catch_up_passes': 0, 'pass_copied': 0, 'switched_epoch': None, 'max_count_drift': max_count_drift,
+                'stats': {'files_copied': 0, 'files_skipped': 0, 'docs_copied': 0, 'docs_missing': 0,
+                          'docs_reembedded': 0, 'files_swept': 0, 'docs_failed': 0}}
+
+    def step(self, state, deadline=None):
+        state = dict(state)
+        while state['phase'] not in ['done', 'failed'] and (deadline is None or time.time() < deadline):
+            phase = state['phase']
+            if phase in ['copy', 'catch_up']:
+                self._copy_page(state)
+            elif phase == 'sweep':
+                self._sweep_page(state)
+            elif phase == 'verify':
+                if not self._verify(state):
+                    return state
+            elif phase == 'switch':
+                self.index_alias.switch(state['target_index'])
+                state['switched_epoch'] = int(time.time())
+                state['phase'] = 'settle'
+            elif phase == 'settle':
+                settle_until = state['switched_epoch'] + self.index_alias.cache_seconds + REBUILD_SETTLE_SECONDS
+                if time.time() < settle_until:
+                    state['resume_epoch'] = settle_until
+                    break
+                # The last catch-up and sweep run after the switch, once the stragglers are done
+                state['phase'] = 'catch_up'
+                state['catch_up_passes'] = REBUILD_CATCH_UP_PASSES
+                state['pass_copied'] = 0
+        LOG.info(f'method=index_rebuild_step, target_index={state["target_index"]}, phase={state["phase"]}, stats={state["stats"]}')
+        return state
+
+    # One page of the source manifests. copy takes every manifest, catch_up the ones modified since the previous pass
+    def _copy_page(self, state):
+        list_args = {'Bucket': self.bucket, 'Prefix': manifest_prefix(state['source_namespace']), 'MaxKeys': self.files_per_batch}
+        if state['token'] is not None:
+            list_args['ContinuationToken'] = state['token']
+        page = self.s3_client.list_objects_v2(**list_args)
+        objects = [s3_object for s3_object in page.get('Contents', []) if not manifest_is_shard(s3_object['Key'])]
+        if state['phase'] == 'catch_up':
+            objects = [s3_object for s3_object in objects if s3_object['LastModified'].timestamp() >= state['since_epoch']]
+        if len(objects) > 0:
+            copied = self._copy_manifests(objects, state)
+            state['pass_copied'] += copied
+        state['token'] = page.get('NextContinuationToken')
+        if state['token'] is not None:
+            return
+        # End of a pass, catch up on what changed since it started until a pass finds nothing
+        LOG.info(f'method=index_rebuild_pass, phase={state["phase"]}, pass_copied={state["pass_copied"]}, catch_up_passes={state["catch_up_passes"]}')
+        done_catching_up = state['phase'] == 'catch_up' and (state['pass_copied'] == 0 or state['catch_up_passes'] >= REBUILD_CATCH_UP_PASSES)
+        state['since_epoch'] = state['pass_started_epoch']
+        state['pass_started_epoch'] = int(time.time())
+        state['pass_copied'] = 0
+        if done_catching_up:
+            state['phase'] = 'sweep'
+        else:
+            state['phase'] = 'catch_up'
+            state['catch_up_passes'] += 1
+
+    def _copy_manifests(self, objects, state):
+        target_index = state['target_index']
+        stats = state['stats']
+        copies = []
+        with BulkIndexer(self.ops_client, target_index) as bulk_indexer:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for copy in executor.map(lambda s3_object: self._copy_manifest(s3_object, state, bulk_indexer), objects):
+                    if copy is not None:
+                        copies.append(copy)
+        stats['files_skipped'] += len(objects) - len(copies)
+        # Documents are acknowledged, the new manifests can point at them
+        with BulkIndexer(self.ops_client, target_index) as delete_indexer:
+            for target_manifest, previous_target, copy_stats in copies:
+                target_manifest.save(self.bucket, self.s3_client)
+                # A manifest copied again replaces the documents of its earlier copy
+                if previous_target is not None:
+                    for doc_id in previous_target.doc_ids():
+                        delete_indexer.delete(doc_id)
+                stats['files_copied'] += 1
+                for name, count in copy_stats.items():
+                    stats[name] += count
+        stats['docs_failed'] += len(bulk_indexer.errors) + len(delete_indexer.errors)
+        if len(bulk_indexer.errors) > 0:
+            LOG.error(f'method=index_rebuild_copy, target_index={target_index}, errors={bulk_indexer.errors[:10]}')
+        return len(copies)
+
+    # (target manifest, previous target manifest, stats), None when the target copy is already newer
+    def _copy_manifest(self, s3_object, state, bulk_indexer):
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=s3_object['Key'])
+        source = ChunkManifest.from_bytes(response['Body'].read(), namespace=state['source_namespace'])
+        previous_target = self._load_target(source.s3_key, state, s3_object['LastModified'])
+        if previous_target is False:
+            return None
+        target = ChunkManifest(source.s3_source, source.s3_key, namespace=state['target_namespace'])
+        target.superseded_by = source.superseded_by
+        copy_stats = {'docs_copied': 0, 'docs_missing': 0, 'docs_reembedded': 0}
+        entries = [entry for entry in source.chunks.values() if entry['doc_id'] is not None]
+        for batch_start in range(0, len(entries), self.fetch_size):
+            batch = entries[batch_start:batch_start + self.fetch_size]
+            docs = self._fetch(state['source_index'], [entry['doc_id'] for entry in batch])
+            if self.embed_fn is not None and len(docs) > 0:
+                texts = [doc['text'] for doc in docs.values()]
+                for doc, embedding in zip(docs.values(), self.embed_fn(texts)):
+                    doc['embedding'] = embedding
+                copy_stats['docs_reembedded'] += len(docs)
+            for entry in batch:
+                doc = docs.get(entry['doc_id'])
+                if doc is None:
+                    copy_stats['docs_missing'] += 1
+                    continue
+                chunk_id = entry['chunk_id']
+                target.chunks[chunk_id] = dict(entry, doc_id=None)
+                bulk_indexer.index(doc, on_result=lambda op_result, chunk_id=chunk_id: target.set_doc_id(chunk_id, op_result['_id']))
+                copy_stats['docs_copied'] += 1
+        return target, previous_target, copy_stats
+
+    # The existing copy of a manifest in the target namespace, None without one and False when
+    # it was written after the source manifest (an upload that already went to the target index)
+    def _load_target(self, s3_key, state, source_modified):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=manifest_key(s3_key, namespace=state['target_namespace']))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        if response['LastModified'] >= source_modified:
+            return False
+        return ChunkManifest.from_bytes(response['Body'].read(), namespace=state['target_namespace'])
+
+    # {_id: _source} of the documents still in the index
+    def _fetch(self, index_name, doc_ids):
+        search_query = {"size": len(doc_ids), "query": {"ids": {"values": doc_ids}}}
+        if self.embed_fn is not None:
+            search_query["_source"] = {"excludes": ["embedding"]}
+        response = self.ops_client.search(body=search_query, index=index_name)
+        return {hit['_id']: hit['_source'] for hit in response['hits']['hits']}
+
+    # Copies whose source manifest is gone were deleted from the active index during the rebuild.
+    # After the switch, manifests written by uploads to the new index have no source and stay
+    def _sweep_page(self, state):
+        list_args = {'Bucket': self.bucket, 'Prefix': manifest_prefix(state['target_namespace']), 'MaxKeys': self.files_per_batch}
+        if state['token'] is not None:
+            list_args['ContinuationToken'] = state['token']
+        page = self.s3_client.list_objects_v2(**list_args)
+        with BulkIndexer(self.ops_client, state['target_index']) as delete_indexer:
+            for s3_object in page.get('Contents', []):
+                if manifest_is_shard(s3_object['Key']):
+                    continue
+                if state['switched_epoch'] is not None and s3_object['LastModified'].timestamp() >= state['switched_epoch']:
+                    continue
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=s3_object['Key'])
+                target = ChunkManifest.from_bytes(response['Body'].read(), namespace=state['target_namespace'])
+                if self._source_exists(target.s3_key, state):
+                    continue
+                for doc_id in target.doc_ids():
+                    delete_indexer.delete(doc_id)
+                delete_indexer.flush()
+                if len(delete_indexer.errors) == 0:
+                    self.s3_client.delete_object(Bucket=self.bucket, Key=s3_object['Key'])
+                    state['stats']['files_swept'] += 1
+        state['stats']['docs_failed'] += len(delete_indexer.errors)
+        state['token'] = page.get('NextContinuationToken')
+        if state['token'] is None:
+            state['phase'] = 'verify' if state['switched_epoch'] is None else 'done'
+
+    def _source_exists(self, s3_key, state):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=manifest_key(s3_key, namespace=state['source_namespace']))
+            return True
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+                return False
+            raise
+
+    # The rebuilt index only goes live when it holds about as many documents as the active one.
+    # Documents indexed before chunk manifests existed are not in the chunk store and show up here
+    def _verify(self, state):
+        source_count = self.ops_client.count(index=state['source_index'])['count']
+        target_count = self.ops_client.count(index=state['target_index'])['count']
+        drift = (source_count - target_count) / source_count if source_count > 0 else 0
+        state['stats'].update({'source_count': source_count, 'target_count': target_count})
+        LOG.info(f'method=index_rebuild_verify, source_index={state["source_index"]}, target_index={state["target_index"]}, source_count={source_count}, target_count={target_count}')
+        if drift > state['max_count_drift'] or state['stats']['docs_failed'] > 0:
+            state['phase'] = 'failed'
+            state['error'] = f'Rebuilt index has {target_count} documents, active index {source_count}, {state["stats"]["docs_failed"]} failed'
+            self.index_alias.abort(state['target_index'])
+            LOG.error(f'method=index_rebuild_verify, target_index={state["target_index"]}, error={state["error"]}')
+            return False
+        state['phase'] = 'switch'
+        return True
@@ -0,0 +1,256 @@
+from os import getenv
+from collections import OrderedDict
+from urllib.parse import unquote_plus
+import json
+import logging
+import threading
+import time
+import uuid
+import boto3
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+INGEST_QUEUE_URL = getenv("INGEST_QUEUE_URL", "")
+INGEST_DLQ_URL = getenv("INGEST_DLQ_URL", "")
+# A message failing on its last receive goes to the dead-letter queue together with its error.
+# The queue redrive policy is set a little higher and only catches timeouts and crashes
+INGEST_MAX_RECEIVES = int(getenv("INGEST_MAX_RECEIVES", "3"))
+# Messages one tenant may take from a batch, the rest go back to the queue with a delay
+# so uploads of other tenants are not stuck behind a burst from a single user
+INGEST_TENANT_BATCH_SHARE = int(getenv("INGEST_TENANT_BATCH_SHARE", "1"))
+INGEST_DEFER_SECONDS = int(getenv("INGEST_DEFER_SECONDS", "30"))
+# A message deferred this many times is processed whatever the tenant share
+INGEST_MAX_DEFERRALS = int(getenv("INGEST_MAX_DEFERRALS", "5"))
+# Pages per work item when a PDF is split across several workers
+INGEST_PAGES_PER_ITEM = int(getenv("INGEST_PAGES_PER_ITEM", "50"))
+SQS_BATCH_MAX = 10
+SQS_MAX_DELAY_SECONDS = 900
+
+
+# page_start is inclusive and page_end exclusive, both None for the whole file
+def work_item(s3_bucket, s3_key, event_name, sequencer='', tenant=None, page_start=None, page_end=None):
+    return {'tenant': tenant, 's3_bucket': s3_bucket, 's3_key': s3_key, 'event_name': event_name,
+            'sequencer': sequencer, 'page_start': page_start, 'page_end': page_end, 'deferrals': 0}
+
+
+# Work items of an SQS message body, either an S3 event notification or items sent by enqueue
+def parse_message(body):
+    payload = json.loads(body)
+    if 'work_items' in payload:
+        return payload['work_items']
+    items = []
+    # s3:TestEvent and other bodies without records carry no work
+    for record in payload.get('Records', []):
+        if 's3' not in record:
+            continue
+        items.append(work_item(record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']),
+                               record['eventName'], record['s3']['object'].get('sequencer', '')))
+    return items
+
+
+# S3 notification record for a work item, in the shape process_file_upload reads
+def s3_record(item):
+    record = {
+        'eventSource': 'aws:s3',
+        'eventName': item['event_name'],
+        's3': {
+            'bucket': {'name': item['s3_bucket']},
+            'object': {'key': item['s3_key'], 'sequencer': item.get('sequencer', '')}
+        }
+    }
+    if item.get('page_start') is not None:
+        record['page_range'] = [item['page_start'], item['page_end']]
+    # Physical index an upload started on, its shards and continuations stay on it
+    if item.get('index_name') is not None:
+        record['index_name'] = item['index_name']
+    return record
+
+
+# [(page_start, page_end)] covering num_pages
+def split_page_ranges(num_pages, pages_per_item=INGEST_PAGES_PER_ITEM):
+    pages_per_item = max(1, pages_per_item)
+    return [(page_start, min(page_start + pages_per_item, num_pages)) for page_start in range(0, num_pages, pages_per_item)]
+
+
+def split_work_item(item, num_pages, pages_per_item=INGEST_PAGES_PER_ITEM):
+    return [dict(item, page_start=page_start, page_end=page_end, deferrals=0) for page_start, page_end in split_page_ranges(num_pages, pages_per_item)]
+
+
+# Round robin over tenants. Returns (messages to process now, messages to defer),
+# a tenant keeps at most tenant_share messages of the batch unless it was deferred too often.
+# Nothing is deferred when the batch holds a single tenant, there is nobody to make room for
+def fair_order(entries, tenant_share=INGEST_TENANT_BATCH_SHARE, max_deferrals=INGEST_MAX_DEFERRALS):
+    by_tenant = OrderedDict()
+    for entry in entries:
+        by_tenant.setdefault(entry['tenant'], []).append(entry)
+    ordered = []
+    deferred = []
+    contended = len(by_tenant) > 1
+    for tenant_entries in by_tenant.values():
+        kept = 0
+        for entry in tenant_entries:
+            if not contended or kept < tenant_share or entry['deferrals'] >= max_deferrals:
+                entry['turn'] = kept
+                kept += 1
+            else:
+                deferred.append(entry)
+    for tenant_entries in by_tenant.values():
+        ordered.extend(entry for entry in tenant_entries if 'turn' in entry)
+    ordered.sort(key=lambda entry: entry['turn'])
+    return ordered, deferred
+
+
+# Consumer side of the ingestion queue. Works against SQS or LocalQueue, both are used through the
+# boto3 SQS client calls send_message_batch, receive_message and delete_message
+class IngestionQueue():
+
+    def __init__(self, queue_url=INGEST_QUEUE_URL, dead_letter_url=INGEST_DLQ_URL, sqs_client=None, tenant_fn=None,
+                 max_receives=INGEST_MAX_RECEIVES, tenant_share=INGEST_TENANT_BATCH_SHARE):
+        self.queue_url = queue_url
+        self.dead_letter_url = dead_letter_url
+        self.sqs_client = sqs_client or boto3.client('sqs')
+        # Fills the tenant of items built from S3 notifications, they only carry the key
+        self.tenant_fn = tenant_fn
+        self.max_receives = max_receives
+        self.tenant_share = tenant_share
+
+    def enabled(self):
+        return len(self.queue_url) > 0
+
+    # One item per message so every work item is retried, deferred and dead-lettered on its own
+    def enqueue(self, items, delay_seconds=0):
+        for batch_start in range(0, len(items), SQS_BATCH_MAX):
+            entries = [{'Id': str(position), 'MessageBody': json.dumps({'work_items': [item]}), 'DelaySeconds': delay_seconds}
+                       for position, item in enumerate(items[batch_start:batch_start + SQS_BATCH_MAX])]
+            response = self.sqs_client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if len(response.get('Failed', [])) > 0:
+                raise Exception(f'Failed to enqueue {len(response["Failed"])} work items, {response["Failed"][:3]}')
+        LOG.info(f'method=ingestion_enqueue, items={len(items)}, delay_seconds={delay_seconds}')
+
+    def dead_letter(self, message, error):
+        LOG.error(f'method=ingestion_dead_letter, message_id={message["messageId"]}, error={error}')
+        if not self.dead_letter_url:
+            return
+        self.sqs_client.send_message(QueueUrl=self.dead_letter_url, MessageBody=json.dumps({
+            'body': message['body'],
+            'error': str(error),
+            'receive_count': receive_count(message)
+        }))
+
+    # Processes a batch of SQS records (Lambda event shape) in fair tenant order.
+    # process_fn(item) raises to have the message retried, should_stop() returning True sends
+    # the messages not started yet back to the queue. Returns the messageIds that failed
+    def consume(self, messages, process_fn, should_stop=None):
+        entries = []
+        for message in messages:
+            try:
+                items = parse_message(message['body'])
+            except Exception as e:
+                self.dead_letter(message, f'Unreadable message, {e}')
+                continue
+            if len(items) == 0:
+                continue
+            for item in items:
+                if item.get('tenant') is None and self.tenant_fn is not None:
+                    item['tenant'] = self.tenant_fn(item)
+            entries.append({'message': message, 'items': items, 'tenant': items[0].get('tenant'),
+                            'deferrals': max(item.get('deferrals', 0) for item in items)})
+
+        ordered, deferred = fair_order(entries, self.tenant_share)
+        if len(deferred) > 0:
+            self.enqueue([dict(item, deferrals=item.get('deferrals', 0) + 1) for entry in deferred for item in entry['items']], INGEST_DEFER_SECONDS)
+        failed = []
+        stats = {'messages': len(messages), 'processed': 0, 'deferred': len(deferred), 'requeued': 0, 'failed': 0, 'dead_lettered': 0}
+        for position, entry in enumerate(ordered):
+            if should_stop is not None and should_stop():
+                # Sent back as new messages, a batchItemFailure would count as a failed receive
+                remaining = ordered[position:]
+                self.enqueue([item for remaining_entry in remaining for item in remaining_entry['items']])
+                stats['requeued'] = len(remaining)
+                break
+            message = entry['message']
+            try:
+                for item in entry['items']:
+                    process_fn(item)
+                stats['processed'] += 1
+            except Exception as e:
+                LOG.error(f'method=ingestion_consume, message_id={message["messageId"]}, tenant={entry["tenant"]}, receive_count={receive_count(message)}, error={e}')
+                if receive_count(message) >= self.max_receives:
+                    self.dead_letter(message, e)
+                    stats['dead_lettered'] += 1
+                else:
+                    failed.append(message['messageId'])
+                    stats['failed'] += 1
+        LOG.info(f'method=ingestion_consume, stats={stats}')
+        return failed
+
+    # Polls the queue like the Lambda event source mapping does, used to drain a LocalQueue
+    def drain(self, process_fn, max_batches=None):
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            response = self.sqs_client.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=SQS_BATCH_MAX,
+                                                       AttributeNames=['ApproximateReceiveCount'])
+            messages = [{'messageId': message['MessageId'], 'receiptHandle': message['ReceiptHandle'], 'body': message['Body'],
+                         'attributes': message.get('Attributes', {})} for message in response.get('Messages', [])]
+            if len(messages) == 0:
+                return batches
+            failed = set(self.consume(messages, process_fn))
+            for message in messages:
+                if message['messageId'] not in failed:
+                    self.sqs_client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['receiptHandle'])
+            batches += 1
+        return batches
+
+
+def receive_count(message):
+    return int(message.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+
+
+# In memory stand-in for the SQS client calls IngestionQueue makes, with delays, visibility
+# timeouts and receive counts. Lets the queue logic run without AWS
+class LocalQueue():
+
+    def __init__(self, visibility_timeout=30):
+        self.visibility_timeout = visibility_timeout
+        self.queues = {}
+        self._lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0):
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self.queues.setdefault(QueueUrl, OrderedDict())[message_id] = {
+                'MessageId': message_id, 'Body': MessageBody, 'receive_count': 0,
+                'visible_at': time.monotonic() + DelaySeconds
+            }
+        return {'MessageId': message_id}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        successful = []
+        for entry in Entries:
+            response = self.send_message(QueueUrl, entry['MessageBody'], entry.get('DelaySeconds', 0))
+            successful.append({'Id': entry['Id'], 'MessageId': response['MessageId']})
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, AttributeNames=None, VisibilityTimeout=None):
+        now = time.monotonic()
+        messages = []
+        with self._lock:
+            for message in self.queues.get(QueueUrl, {}).values():
+                if len(messages) >= MaxNumberOfMessages:
+                    break
+                if message['visible_at'] > now:
+                    continue
+                message['receive_count'] += 1
+                message['visible_at'] = now + (self.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout)
+                messages.append({'MessageId': message['MessageId'], 'ReceiptHandle': message['MessageId'], 'Body': message['Body'],
+                                 'Attributes': {'ApproximateReceiveCount': str(message['receive_count'])}})
+        return {'Messages': messages} if len(messages) > 0 else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        with self._lock:
+            self.queues.get(QueueUrl, {}).pop(ReceiptHandle, None)
+
+    def messages(self, QueueUrl):
+        with self._lock:
+            return [json.loads(message['Body']) for message in self.queues.get(QueueUrl, {}).values()]
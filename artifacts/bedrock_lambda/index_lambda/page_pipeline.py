@@ -0,0 +1,102 @@
+from os import getenv
+from queue import Queue
+import logging
+import threading
+import time
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Pages waiting between two stages, keeps extracted images from piling up in memory
+PAGE_QUEUE_SIZE = int(getenv("PAGE_QUEUE_SIZE", "4"))
+OCR_WORKERS = int(getenv("OCR_WORKERS", "4"))
+INDEX_WORKERS = int(getenv("INDEX_WORKERS", "2"))
+
+_STOP = object()
+
+
+# Runs PDF pages through three overlapping stages
+#   extract (caller thread) -> OCR (ocr_workers) -> embed/index (index_workers)
+# Each page item is a dict holding at least 'page_number' and 'errors'.
+# Returns the index results ordered by page number, whatever order they finished in.
+def run_page_pipeline(pages, ocr_page, index_page, on_page_complete=None,
+                      ocr_workers=OCR_WORKERS, index_workers=INDEX_WORKERS, queue_size=PAGE_QUEUE_SIZE):
+    ocr_queue = Queue(maxsize=queue_size)
+    index_queue = Queue(maxsize=queue_size)
+    results = {}
+    results_lock = threading.Lock()
+    stage_seconds = {'extract': 0.0, 'ocr': 0.0, 'index': 0.0}
+
+    def timed(stage, fn, item):
+        start = time.time()
+        try:
+            return fn(item)
+        except Exception as e:
+            LOG.error(f'method=run_page_pipeline, stage={stage}, page_number={item["page_number"]}, error={e}')
+            item['errors'].append(f"Page {item['page_number']}. {stage} failed {str(e)}")
+            return None
+        finally:
+            with results_lock:
+                stage_seconds[stage] += time.time() - start
+
+    def ocr_worker():
+        while True:
+            item = ocr_queue.get()
+            if item is _STOP:
+                break
+            timed('ocr', ocr_page, item)
+            index_queue.put(item)
+
+    def index_worker():
+        while True:
+            item = index_queue.get()
+            if item is _STOP:
+                break
+            result = timed('index', index_page, item)
+            with results_lock:
+                results[item['page_number']] = {'page_number': item['page_number'], 'result': result, 'errors': item['errors']}
+                completed = sorted(results.keys())
+            if on_page_complete is not None:
+                # A dead worker would leave the bounded queues full and the caller blocked on put
+                try:
+                    on_page_complete(item, result, completed)
+                except Exception as e:
+                    LOG.error(f'method=run_page_pipeline, stage=page_complete, page_number={item["page_number"]}, error={e}')
+                    item['errors'].append(f"Page {item['page_number']}. page_complete failed {str(e)}")
+
+    ocr_threads = [threading.Thread(target=ocr_worker, daemon=True) for _ in range(max(1, ocr_workers))]
+    index_threads = [threading.Thread(target=index_worker, daemon=True) for _ in range(max(1, index_workers))]
+    for thread in ocr_threads + index_threads:
+        thread.start()
+
+    try:
+        page_iter = iter(pages)
+        while True:
+            start = time.time()
+            item = next(page_iter, _STOP)
+            stage_seconds['extract'] += time.time() - start
+            if item is _STOP:
+                break
+            ocr_queue.put(item)
+    finally:
+        # Drain the stages in order so every extracted page still gets indexed
+        for _ in ocr_threads:
+            ocr_queue.put(_STOP)
+        for thread in ocr_threads:
+            thread.join()
+        for _ in index_threads:
+            index_queue.put(_STOP)
+        for thread in index_threads:
+            thread.join()
+
+    LOG.info(f'method=run_page_pipeline, pages={len(results)}, stage_seconds={stage_seconds}')
+    return [results[page_number] for page_number in sorted(results.keys())], stage_seconds
+
+
+# Number of leading pages that are all complete, used to report in-order progress
+def contiguous_pages_complete(completed_page_numbers, first_page=0):
+    page_number = first_page
+    completed = set(completed_page_numbers)
+    while page_number in completed:
+        page_number += 1
+    return page_number - first_page
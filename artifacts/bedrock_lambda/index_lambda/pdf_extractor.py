@@ -0,0 +1,71 @@
+from os import getenv
+import logging
+import os
+from multiprocessing import Pipe, Process
+from pypdf import PdfReader
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Worker processes parsing PDF pages, Lambda gives about one vCPU per 1769 MB of memory
+PDF_EXTRACT_PROCESSES = int(getenv("PDF_EXTRACT_PROCESSES", str(os.cpu_count() or 1)))
+
+
+# Text and image bytes of one page, errors are reported on the page instead of failing the document
+def extract_page(reader, page_number):
+    item = {'page_number': page_number, 'text': '', 'images': [], 'errors': []}
+    try:
+        page = reader.pages[page_number]
+        # Read Text on Page
+        item['text'] = page.extract_text() or ''
+        # Read Image on Page
+        item['images'] = [image_file_object.data for image_file_object in page.images]
+    except Exception as e:
+        LOG.error(f'Error extracting page {page_number} from PDF, error={e}')
+        item['errors'].append(f"Page {page_number}. Error extracting page from PDF {str(e)}")
+    return item
+
+
+# Runs in a child process, re-opens the PDF from its path and sends every page through the pipe.
+# A send blocks while the parent has not read the previous page, so a worker is never far ahead
+def _extract_worker(pdf_path, page_numbers, connection):
+    try:
+        reader = PdfReader(pdf_path)
+        for page_number in page_numbers:
+            connection.send(extract_page(reader, page_number))
+    except Exception as e:
+        for page_number in page_numbers:
+            connection.send({'page_number': page_number, 'text': '', 'images': [], 'errors': [f"Page {page_number}. Error opening PDF {str(e)}"]})
+    finally:
+        connection.close()
+
+
+# Yields the pages of a PDF stored at pdf_path in page_numbers order, parsed by worker processes.
+# multiprocessing.Pool and Queue need /dev/shm which Lambda does not have, workers only use Pipes.
+# Pages are dealt round robin so the next page in order is always the next one of a worker
+def iter_pdf_pages(pdf_path, page_numbers, processes=PDF_EXTRACT_PROCESSES):
+    page_numbers = list(page_numbers)
+    processes = max(1, min(processes, len(page_numbers)))
+    workers = []
+    try:
+        for worker_index in range(processes):
+            receive_end, send_end = Pipe(duplex=False)
+            worker = Process(target=_extract_worker, args=(pdf_path, page_numbers[worker_index::processes], send_end), daemon=True)
+            worker.start()
+            send_end.close()
+            workers.append((worker, receive_end))
+        LOG.info(f'method=iter_pdf_pages, pages={len(page_numbers)}, processes={processes}')
+        for position, page_number in enumerate(page_numbers):
+            worker, receive_end = workers[position % processes]
+            try:
+                item = receive_end.recv()
+            except EOFError:
+                item = {'page_number': page_number, 'text': '', 'images': [], 'errors': [f"Page {page_number}. PDF worker exited with code {worker.exitcode}"]}
+            yield item
+    finally:
+        # Also reached when the caller stops early, workers blocked on a send are stopped
+        for worker, receive_end in workers:
+            receive_end.close()
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
@@ -8,6 +8,19 @@ Wrap the response as a json with key text and value the extracted text.
 Do not include any other words or characters in the output other than the json.
 """
 
+# Prompt template for Claude 3 to extract the text of several labelled images in one call
+claude3_textract_batch_prompt="""Your purpose is to extract the text from each of the given images (traditional OCR).
+Every image is preceded by its label, for example Image 1:
+If the text is in another language, you should first translate it to english and then extract it.
+Remember not to summarize or analyze the images. You should return the extracted text of every image.
+Wrap the response as a json with key texts and value a list holding the extracted text of each image, in the same order as the images.
+Use an empty string for an image without text.
+{
+"texts": ["<text of image 1>", "<text of image 2>"]
+}
+Do not include any other words or characters in the output other than the json.
+"""
+
 claude3_title_prompt="""Your purpose is to suggest a suitable title for the provided text.
 The text is provided within the <text></text> tags.
 You should suggest a title that is short, concise, and descriptive.
@@ -20,15 +33,16 @@ Wrap the response as a json with key text and value the title.
 Do not include any other words or characters in the output other than the json.
 """
 
-def generate_claude_3_ocr_prompt(image_bytes_list):
+def generate_claude_3_ocr_prompt(image_bytes_list, media_types=None):
+    media_types = media_types or ['image/jpeg'] * len(image_bytes_list)
     image_content_list = []
     if len(image_bytes_list) > 0:
-        for image_bytes in image_bytes_list:
+        for image_bytes, media_type in zip(image_bytes_list, media_types):
             image_content_list.append({
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/jpeg",
+                    "media_type": media_type,
                     "data": base64.b64encode(image_bytes).decode("utf-8")
                 }
             })
@@ -49,6 +63,38 @@ def generate_claude_3_ocr_prompt(image_bytes_list):
     return prompt_template 
 
 
+# Every image gets its own label so the answer can be split and cached per image
+def generate_claude_3_ocr_batch_prompt(image_bytes_list, media_types=None):
+    media_types = media_types or ['image/jpeg'] * len(image_bytes_list)
+    image_content_list = []
+    for image_number, (image_bytes, media_type) in enumerate(zip(image_bytes_list, media_types), start=1):
+        image_content_list.append({
+            "type": "text",
+            "text": f"Image {image_number}:"
+        })
+        image_content_list.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": base64.b64encode(image_bytes).decode("utf-8")
+            }
+        })
+    image_content_list.append({
+            "type": "text",
+            "text": claude3_textract_batch_prompt
+        })
+    ocr_prompt = [
+        {
+        "role": "user",
+        "content": image_content_list
+    }]
+    prompt_template= {"anthropic_version": "bedrock-2023-05-31",
+                        "max_tokens": 600000,
+                        "messages": ocr_prompt
+                    }
+    return prompt_template
+
 
 def generate_claude_3_title_prompt(text_value):
     title_prompt = [
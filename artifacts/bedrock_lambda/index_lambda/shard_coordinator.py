@@ -0,0 +1,89 @@
+from os import getenv
+import logging
+import math
+import time
+from ingestion_queue import split_work_item, INGEST_PAGES_PER_ITEM
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# PDFs with fewer pages are indexed by a single worker
+SHARD_MIN_PAGES = int(getenv("SHARD_MIN_PAGES", "100"))
+SHARD_PAGES = int(getenv("SHARD_PAGES", str(INGEST_PAGES_PER_ITEM)))
+# Shards grow beyond SHARD_PAGES pages instead of exceeding this count
+SHARD_MAX_SHARDS = int(getenv("SHARD_MAX_SHARDS", "20"))
+
+
+def shard_id(page_start, page_end):
+    return f'{page_start}-{page_end}'
+
+
+# Splits large PDFs into page range work items and tracks their completion on the audit record of
+# the document. Shards mark themselves done by adding their id to a string set, so a shard that is
+# retried after it finished is not counted twice, and only one shard gets to finalize the document
+class ShardCoordinator():
+
+    SHARD_IDS = 'shard_ids'
+    SHARDS_DONE = 'shards_done'
+    SHARDS_FAILED = 'shards_failed'
+    SHARD_ERRORS = 'shard_errors'
+    SHARDS_FINALIZED = 'shards_finalized'
+
+    def __init__(self, table, ingestion_queue, min_pages=SHARD_MIN_PAGES, pages_per_shard=SHARD_PAGES, max_shards=SHARD_MAX_SHARDS):
+        self.table = table
+        self.ingestion_queue = ingestion_queue
+        self.min_pages = min_pages
+        self.pages_per_shard = pages_per_shard
+        self.max_shards = max(1, max_shards)
+
+    def should_shard(self, num_pages):
+        return self.ingestion_queue.enabled() and self.min_pages > 0 and num_pages >= self.min_pages
+
+    def pages_per_item(self, num_pages):
+        return max(self.pages_per_shard, math.ceil(num_pages / self.max_shards))
+
+    # True when the shards of this upload were already dispatched by an earlier delivery of the message
+    def dispatched(self, key, sequencer):
+        item = self.table.get_item(Key=key, ProjectionExpression=f'{self.SHARD_IDS}, s3_sequencer').get('Item')
+        return item is not None and self.SHARD_IDS in item and item.get('s3_sequencer') == sequencer
+
+    # The audit record must exist, the shards are recorded on it before they are enqueued
+    def start(self, key, item, num_pages):
+        shard_items = split_work_item(item, num_pages, self.pages_per_item(num_pages))
+        shard_ids = set(shard_id(shard_item['page_start'], shard_item['page_end']) for shard_item in shard_items)
+        self.table.update_item(
+            Key=key,
+            UpdateExpression=f'SET {self.SHARD_IDS}=:ids, update_epoch=:u_epoch REMOVE {self.SHARDS_DONE}, {self.SHARDS_FAILED}, {self.SHARD_ERRORS}, {self.SHARDS_FINALIZED}',
+            ExpressionAttributeValues={':ids': shard_ids, ':u_epoch': int(time.time())}
+        )
+        self.ingestion_queue.enqueue(shard_items)
+        LOG.info(f'method=shard_start, s3_key={item["s3_key"]}, num_pages={num_pages}, shards={len(shard_items)}')
+        return len(shard_items)
+
+    # Records the outcome of a shard. Returns (progress, finalize), finalize is True for exactly one
+    # caller, the one that completed the last shard
+    def complete(self, key, page_range, success, error_message=''):
+        this_shard = shard_id(*page_range)
+        update_expression = f'ADD {self.SHARDS_DONE if success else self.SHARDS_FAILED} :shard SET update_epoch=:u_epoch'
+        values = {':shard': set([this_shard]), ':u_epoch': int(time.time())}
+        if not success:
+            update_expression += f', {self.SHARD_ERRORS}=list_append(if_not_exists({self.SHARD_ERRORS}, :empty), :errors)'
+            values.update({':empty': [], ':errors': [f'Pages {this_shard}. {error_message}']})
+        attributes = self.table.update_item(Key=key, UpdateExpression=update_expression, ExpressionAttributeValues=values,
+                                            ReturnValues='ALL_NEW')['Attributes']
+        shard_ids = set(attributes.get(self.SHARD_IDS, set()))
+        done = set(attributes.get(self.SHARDS_DONE, set()))
+        # A shard that failed and then went through on a retry counts as done
+        failed = set(attributes.get(self.SHARDS_FAILED, set())) - done
+        progress = {'total': len(shard_ids), 'done': len(done), 'failed': len(failed), 'shard_ids': sorted(shard_ids),
+                    'errors': list(attributes.get(self.SHARD_ERRORS, [])) if len(failed) > 0 else []}
+        LOG.info(f'method=shard_complete, shard={this_shard}, success={success}, progress={progress}')
+        if len(shard_ids - done - failed) > 0:
+            return progress, False
+        try:
+            self.table.update_item(Key=key, UpdateExpression=f'SET {self.SHARDS_FINALIZED}=:finalized',
+                                   ConditionExpression=f'attribute_not_exists({self.SHARDS_FINALIZED})',
+                                   ExpressionAttributeValues={':finalized': int(time.time())})
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return progress, False
+        return progress, True
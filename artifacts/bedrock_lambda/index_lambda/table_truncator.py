@@ -0,0 +1,75 @@
+from os import getenv
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+TRUNCATE_SEGMENTS = int(getenv("TRUNCATE_SEGMENTS", "8"))
+TRUNCATE_PAGE_SIZE = int(getenv("TRUNCATE_PAGE_SIZE", "1000"))
+# Segment finished, as opposed to a segment that never ran (no entry in the state)
+SEGMENT_DONE = 'done'
+
+
+# Deletes every item of a DynamoDB table with a parallel scan, one segment per worker thread.
+# The state maps each segment to the LastEvaluatedKey up to which it is deleted, it is handed back
+# when the deadline passes and truncate(state) picks up from there
+class TableTruncator():
+
+    def __init__(self, table, segments=TRUNCATE_SEGMENTS, page_size=TRUNCATE_PAGE_SIZE):
+        self.table = table
+        self.segments = max(1, segments)
+        self.page_size = page_size
+        self._lock = threading.Lock()
+
+    # Returns (stats, state), state is None once the table is empty
+    def truncate(self, state=None, deadline=None):
+        start = time.time()
+        # A resumed run keeps the segment count of the run that saved the state
+        state = dict(state or {})
+        segments = int(state.pop('segments', self.segments))
+        key_names = [key['AttributeName'] for key in self.table.key_schema]
+        stats = {'segments': segments, 'deleted': 0, 'pages': 0}
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(self._truncate_segment, segment, segments, key_names, state, deadline, stats)
+                       for segment in range(segments) if state.get(str(segment)) != SEGMENT_DONE]
+            for future in futures:
+                future.result()
+        stats['elapsed_seconds'] = round(time.time() - start, 3)
+        complete = all(state.get(str(segment)) == SEGMENT_DONE for segment in range(segments))
+        stats['complete'] = complete
+        LOG.info(f'method=truncate_table, table={self.table.name}, stats={stats}')
+        if complete:
+            return stats, None
+        state['segments'] = segments
+        return stats, state
+
+    def _truncate_segment(self, segment, segments, key_names, state, deadline, stats):
+        # Only the keys are read, the deletes need nothing else
+        scan_args = {
+            'Segment': segment,
+            'TotalSegments': segments,
+            'Limit': self.page_size,
+            'ProjectionExpression': ", ".join('#' + key for key in key_names),
+            'ExpressionAttributeNames': {'#' + key: key for key in key_names}
+        }
+        while deadline is None or time.time() < deadline:
+            with self._lock:
+                start_key = state.get(str(segment))
+            if start_key is not None:
+                scan_args['ExclusiveStartKey'] = start_key
+            page = self.table.scan(**scan_args)
+            # The page is deleted before its key is recorded, a resumed run never skips items
+            with self.table.batch_writer() as batch:
+                for item_keys in page['Items']:
+                    batch.delete_item(Key=item_keys)
+            with self._lock:
+                state[str(segment)] = page.get('LastEvaluatedKey', SEGMENT_DONE)
+                stats['deleted'] += len(page['Items'])
+                stats['pages'] += 1
+                deleted = stats['deleted']
+            LOG.info(f'method=truncate_segment, segment={segment}/{segments}, page_items={len(page["Items"])}, deleted_total={deleted}')
+            if 'LastEvaluatedKey' not in page:
+                return
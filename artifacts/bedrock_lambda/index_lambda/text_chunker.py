@@ -0,0 +1,64 @@
+from os import getenv
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = int(getenv("CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(getenv("CHUNK_OVERLAP", "10"))
+# Text handed to the splitter at once when chunking a string that is already in memory
+SPLIT_WINDOW_CHARS = int(getenv("SPLIT_WINDOW_CHARS", "65536"))
+
+
+# Yields chunks lazily from an iterable of text windows with the same chunk_size/chunk_overlap
+# semantics as RecursiveCharacterTextSplitter. The last chunk of every window may have been cut
+# by the window edge, so it is carried over and split again together with the next window.
+def iter_chunks(text_windows, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    for start, chunk in iter_chunks_with_offsets(text_windows, chunk_size, chunk_overlap):
+        yield chunk
+
+
+# Same as iter_chunks, yields (character offset of the chunk in the whole text, chunk)
+def iter_chunks_with_offsets(text_windows, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    carry = ''
+    # Offset of carry in the whole text
+    base = 0
+    for window in text_windows:
+        if not window:
+            continue
+        text = carry + window
+        chunks = text_splitter.split_text(text)
+        if len(chunks) == 0:
+            base += len(text)
+            carry = ''
+            continue
+        cursor = 0
+        for chunk in chunks[:-1]:
+            position = text.find(chunk, cursor)
+            position = cursor if position < 0 else position
+            yield base + position, chunk
+            cursor = position + 1
+        # The raw tail keeps the whitespace the splitter strips from the chunk
+        carry_start = text.find(chunks[-1], cursor)
+        carry_start = cursor if carry_start < 0 else carry_start
+        base += carry_start
+        carry = text[carry_start:]
+    cursor = 0
+    for chunk in text_splitter.split_text(carry):
+        position = carry.find(chunk, cursor)
+        position = cursor if position < 0 else position
+        yield base + position, chunk
+        cursor = position + 1
+
+
+# Cuts a string into windows ending on a line break (or a space) when there is one
+def iter_text_windows(text, window_chars=SPLIT_WINDOW_CHARS):
+    start = 0
+    while len(text) - start > window_chars:
+        cut = text.rfind('\n', start, start + window_chars) + 1
+        if cut <= start:
+            cut = text.rfind(' ', start, start + window_chars) + 1
+        if cut <= start:
+            cut = start + window_chars
+        yield text[start:cut]
+        start = cut
+    if start < len(text):
+        yield text[start:]
@@ -5,9 +5,10 @@ import boto3
 import logging
 import json
 from datetime import datetime
+from bedrock_limiter import create_bedrock_client
 
 region = getenv("REGION", "us-east-1")
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 s3_client = boto3.client("s3")
 model_id = getenv("WEBSEARCH_MODEL", "anthropic.claude-3-haiku-20240307-v1:0")
 LOG = logging.getLogger()
@@ -5,6 +5,7 @@ import logging
 import datetime
 import json
 from datetime import datetime, timedelta
+from bedrock_limiter import create_bedrock_client
 
 date = datetime.now()
 next_date = datetime.now() + timedelta(days=30)
@@ -52,7 +53,7 @@ casual_agent_specs = f"""\
 <tool_set>
 """
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 credentials = boto3.Session().get_credentials()
 service = 'aoss'
 region = getenv("REGION", "us-east-1")
@@ -2,6 +2,7 @@ import boto3
 from os import getenv
 import json
 from agent_executor_utils import upload_object_to_s3
+from bedrock_limiter import create_bedrock_client
 
 code_gen_agent_name = "Code Generator Agent"
 # When to use this agent
@@ -50,7 +51,7 @@ code_gen_specs = f"""\
 	</tool_set>
 """
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 model_id = getenv("CODE_GENERATOR_MODEL", "anthropic.claude-3-sonnet-20240229-v1:0")
 
 
@@ -16,6 +16,7 @@ from PIL import Image
 import io
 import os
 from agent_executor_utils import upload_file_to_s3
+from bedrock_limiter import create_bedrock_client
 
 #Begin: Needed by Master orchestrator
 ppt_agent_name = "PPT Generator Agent"
@@ -88,7 +89,7 @@ next_month_label = next_date.strftime("%B")
 day = date.day
 
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 model_id = getenv("PPT_MODEL", "anthropic.claude-3-sonnet-20240229-v1:0")
 s3_bucket_name = getenv("S3_BUCKET_NAME", "S3_BUCKET_NAME_MISSING")
 cwd = os.getcwd() 
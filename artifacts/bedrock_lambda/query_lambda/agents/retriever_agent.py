@@ -16,8 +16,16 @@ import requests
 import subprocess
 import sys
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 
 from datetime import datetime, timedelta
+from bedrock_limiter import create_bedrock_client
+from index_alias import IndexAlias
+from query_embedding_cache import QueryEmbeddingCache
+from result_fusion import fuse_results, FUSION_METHOD, FUSION_KEYWORD_WEIGHT, RETRIEVAL_TOP_K
+from context_builder import build_context, CONTEXT_TOKEN_BUDGET
+from reranker import Reranker, RERANK_CANDIDATES, RERANK_TOP_N
 
 date = datetime.now()
 next_date = datetime.now() + timedelta(days=30)
@@ -91,7 +99,7 @@ retriever_specs = f"""\
 endpoint = getenv("OPENSEARCH_VECTOR_ENDPOINT",
                   "https://admin:P@@search-opsearch-public-24k5tlpsu5whuqmengkfpeypqu.us-east-1.es.amazonaws.com:443")
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 credentials = boto3.Session().get_credentials()
 service = 'aoss'
 region = getenv("REGION", "us-east-1")
@@ -99,12 +107,26 @@ awsauth = AWS4Auth(credentials.access_key, credentials.secret_key,
                    region, service, session_token=credentials.token)
 embed_model_id = getenv("EMBED_MODEL_ID", "amazon.titan-embed-image-v1")
 INDEX_NAME = getenv("VECTOR_INDEX_NAME", "sample-embeddings-store-dev")
+index_dynamodb_table_name = getenv("INDEX_DYNAMO_TABLE_NAME", "rag-llm-index-table-dev")
 model_id = getenv("RETRIEVER_MODEL", "anthropic.claude-3-haiku-20240307-v1:0")
 is_bedrock_kb = getenv("IS_BEDROCK_KB", "no")
 bedrock_embedding_key_name = getenv("BEDROCK_KB_EMBEDDING_KEY", "bedrock-knowledge-base-default-vector")
+# fetch_data_v2 gives up on a retrieval leg after these, and answers with what the other legs found
+RETRIEVAL_EMBED_TIMEOUT_SECONDS = float(getenv("RETRIEVAL_EMBED_TIMEOUT_SECONDS", "10"))
+RETRIEVAL_SEARCH_TIMEOUT_SECONDS = float(getenv("RETRIEVAL_SEARCH_TIMEOUT_SECONDS", "10"))
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
 
+# INDEX_NAME is an alias, the index lambda records the physical index it points at in the index table
+index_table = boto3.resource('dynamodb').Table(index_dynamodb_table_name)
+index_alias = IndexAlias(index_table, INDEX_NAME, embed_model_id)
+# Module level so the in-memory tier survives warm invocations
+query_embedding_cache = QueryEmbeddingCache(index_table)
+# Runs the embedding, keyword and vector legs of a retrieval, shared by warm invocations
+retrieval_executor = ThreadPoolExecutor(max_workers=int(getenv("RETRIEVAL_WORKERS", "4")))
+# Optional second stage, RERANK_ENABLED=yes
+reranker = Reranker()
+
 ops_client = client = OpenSearch(
         hosts=[{'host': endpoint, 'port': 443}],
         http_auth=awsauth,
@@ -287,17 +309,21 @@ def classify_and_translation_request(user_query):
         
 
 
-def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
-    global INDEX_NAME
-    nearest_neighbours = 10
-    result_set_size = 20
-    print(f'In Fetch Data = {user_query}')
-    context = ''
+# Popular questions are embedded once, then served from the query embedding cache
+def embed_query(user_query, query_embed_model_id):
+    start = time.time()
+    embedded_search, cache_source = query_embedding_cache.get_or_embed(query_embed_model_id, user_query,
+                                                                       lambda query: bedrock_embed_query(query, query_embed_model_id))
+    LOG.info(f'method=embed_query, cache={cache_source}, latency={time.time() - start:.3f}, cache_stats={query_embedding_cache.stats()}')
+    return embedded_search
+
+
+def bedrock_embed_query(user_query, query_embed_model_id):
     embeddings_key="embedding"
-    if 'cohere' in   embed_model_id:
+    if 'cohere' in   query_embed_model_id:
                 response = bedrock_client.invoke_model(
                 body=json.dumps({"texts": [user_query], "input_type": 'search_query'}),
-                modelId=embed_model_id,
+                modelId=query_embed_model_id,
                 accept='application/json',
                 contentType='application/json'
                 )
@@ -305,7 +331,7 @@ def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
     else:
                 response = bedrock_client.invoke_model(
                     body=json.dumps({"inputText": user_query}),
-                    modelId=embed_model_id,
+                    modelId=query_embed_model_id,
                     accept='application/json',
                     contentType='application/json'
                 )
@@ -313,10 +339,21 @@ def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
     finish_reason = result.get("message")
     if finish_reason is not None:
         print(f'Embed Error {finish_reason}')
-    if 'cohere' in   embed_model_id:
+    if 'cohere' in   query_embed_model_id:
          embedded_search = result.get(embeddings_key)[0]
     else:
         embedded_search = result.get(embeddings_key)
+    return embedded_search
+
+
+def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
+    # Physical index and embed model behind the index alias, they change together on a rebuild
+    index_name, query_embed_model_id = index_alias.resolve()
+    nearest_neighbours = 10
+    result_set_size = 20
+    print(f'In Fetch Data = {user_query}')
+    context = ''
+    embedded_search = embed_query(user_query, query_embed_model_id)
 
     TEXT_CHUNK_FIELD = 'text'
     if is_bedrock_kb == 'yes':
@@ -357,8 +394,8 @@ def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
     if is_bedrock_kb == 'yes':
         LOG.info('Connecting to Bedrock KB')
         TEXT_CHUNK_FIELD="AMAZON_BEDROCK_TEXT_CHUNK"
-        if not INDEX_NAME.startswith('bedrock'):
-            INDEX_NAME = 'bedrock-knowledge-base*'
+        if not index_name.startswith('bedrock'):
+            index_name = 'bedrock-knowledge-base*'
             vector_query = {
                 "size": result_set_size,
                 "query":{
@@ -383,7 +420,7 @@ def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
         
 
     try:
-        response = ops_client.search(body=vector_query, index=INDEX_NAME)
+        response = ops_client.search(body=vector_query, index=index_name)
         LOG.info(f'Opensearch response {response}')
         for data in response["hits"]["hits"]:
             if context == '':
@@ -396,79 +433,32 @@ def fetch_data(user_query, proper_nouns: list, is_hybrid=False):
 
 
 # Here we combine the results of Keyword and Semantic search to produce better results
-def fetch_data_v2(user_query, proper_nouns: list, is_hybrid=False):
-    global INDEX_NAME
+# The keyword search does not need the query embedding, it runs while the query is embedded and
+# the vector search follows the embedding. timings, when given, receives the seconds spent in each leg.
+# Both result lists are fused, see result_fusion.py, optionally reranked, see reranker.py, and the top_k
+# chunks are packed into a context of at most token_budget tokens, see context_builder.py
+def fetch_data_v2(user_query, proper_nouns: list, is_hybrid=False, timings=None, top_k=None, token_budget=None):
+    start = time.time()
+    timings = timings if timings is not None else {}
+    # Physical index and embed model behind the index alias, they change together on a rebuild
+    index_name, query_embed_model_id = index_alias.resolve()
     nearest_neighbours = 10
     result_set_size = 20
+    if reranker.enabled:
+        # Each leg has to return at least the candidates the reranker scores
+        nearest_neighbours = max(nearest_neighbours, RERANK_CANDIDATES)
+        result_set_size = max(result_set_size, RERANK_CANDIDATES)
     print(f'In Fetch Data = {user_query}')
-    context = ''
-    embeddings_key="embedding"
-    if 'cohere' in   embed_model_id:
-                response = bedrock_client.invoke_model(
-                body=json.dumps({"texts": [user_query], "input_type": 'search_query'}),
-                modelId=embed_model_id,
-                accept='application/json',
-                contentType='application/json'
-                )
-                embeddings_key="embeddings"
-    else:
-                response = bedrock_client.invoke_model(
-                    body=json.dumps({"inputText": user_query}),
-                    modelId=embed_model_id,
-                    accept='application/json',
-                    contentType='application/json'
-                )
-    result = json.loads(response['body'].read())
-    finish_reason = result.get("message")
-    if finish_reason is not None:
-        print(f'Embed Error {finish_reason}')
-    if 'cohere' in   embed_model_id:
-         embedded_search = result.get(embeddings_key)[0]
-    else:
-        embedded_search = result.get(embeddings_key)
+    embedding_future = retrieval_executor.submit(timed_leg, lambda: embed_query(user_query, query_embed_model_id))
     
     TEXT_CHUNK_FIELD = 'text'
     if is_bedrock_kb == 'yes':
         TEXT_CHUNK_FIELD="AMAZON_BEDROCK_TEXT_CHUNK"
-    
-    DOC_TYPE_FIELD = 'doc_type'
-    vector_query = {
-                "size": result_set_size,
-                "query": {
-                            "bool": {
-                                "must": [
-                                    {
-                                        "knn": {"embedding": {"vector": embedded_search, "k": nearest_neighbours}}              
-                                    }     
-                                ]
-                            }
-                        },
-                "track_scores": True, 
-                "_source": False,
-                "fields": [TEXT_CHUNK_FIELD, DOC_TYPE_FIELD]
-    }
-    
-    if is_bedrock_kb == 'yes':
         LOG.info('Connecting to Bedrock KB')
-        if not INDEX_NAME.startswith('bedrock'):
-            INDEX_NAME = 'bedrock-knowledge-base*'
-            vector_query = {
-                "size": result_set_size,
-                "query":{
-                            "bool": {
-                                "must": [
-                                    {
-                                        "knn": {bedrock_embedding_key_name: {"vector": embedded_search, "k": nearest_neighbours}}
-                                    }
-                                ]
-                            }
-                        },
-                "track_scores": True,    
-                "_source": False,
-                "fields": [TEXT_CHUNK_FIELD]
-            }
+        if not index_name.startswith('bedrock'):
+            index_name = 'bedrock-knowledge-base*'
 
-    keyword_results = []
+    keyword_future = None
     
     # Common for both Bedrock and non-Bedrock collections
     if is_hybrid and len(proper_nouns) > 0:
@@ -496,36 +486,96 @@ def fetch_data_v2(user_query, proper_nouns: list, is_hybrid=False):
                 "fields": [TEXT_CHUNK_FIELD]
         }
         LOG.info(f'AOSS Keyword search Query {keyword_search_query}')
-
-        
-        try:
-            response = ops_client.search(body=keyword_search_query, index=INDEX_NAME)
-            LOG.info(f'Opensearch response {response}')
-            keyword_results.extend(response["hits"]["hits"])
-        except Exception as e:
-            LOG.error(f'Keyword search query error {e}')
+        keyword_future = retrieval_executor.submit(timed_leg, lambda: search_hits(keyword_search_query, index_name))
     else:
         # When its just semantic search increase the result set size
-        result_set_size=50
-        vector_query['size']=result_set_size
-        
-    LOG.info(f'AOSS Vector search Query {vector_query}')
+        result_set_size = max(result_set_size, 50)
+
     semantic_results = []
+    embedded_search = join_leg(embedding_future, RETRIEVAL_EMBED_TIMEOUT_SECONDS, 'embed', timings)
+    if embedded_search is not None:
+        DOC_TYPE_FIELD = 'doc_type'
+        vector_query = {
+                    "size": result_set_size,
+                    "query": {
+                                "bool": {
+                                    "must": [
+                                        {
+                                            "knn": {"embedding": {"vector": embedded_search, "k": nearest_neighbours}}              
+                                        }     
+                                    ]
+                                }
+                            },
+                    "track_scores": True, 
+                    "_source": False,
+                    "fields": [TEXT_CHUNK_FIELD, DOC_TYPE_FIELD]
+        }
         
-    try:
-        response = ops_client.search(body=vector_query, index=INDEX_NAME)
-        LOG.info(f'Opensearch response {response}')
-        semantic_results.extend(response["hits"]["hits"])
-    except Exception as e:
-                LOG.error(f'Vector Index query error {e}')
+        if is_bedrock_kb == 'yes' and index_name == 'bedrock-knowledge-base*':
+            vector_query = {
+                "size": result_set_size,
+                "query":{
+                            "bool": {
+                                "must": [
+                                    {
+                                        "knn": {bedrock_embedding_key_name: {"vector": embedded_search, "k": nearest_neighbours}}
+                                    }
+                                ]
+                            }
+                        },
+                "track_scores": True,    
+                "_source": False,
+                "fields": [TEXT_CHUNK_FIELD]
+            }
+        LOG.info(f'AOSS Vector search Query {vector_query}')
+        vector_future = retrieval_executor.submit(timed_leg, lambda: search_hits(vector_query, index_name))
+        semantic_results = join_leg(vector_future, RETRIEVAL_SEARCH_TIMEOUT_SECONDS, 'vector', timings) or []
+
+    keyword_results = []
+    if keyword_future is not None:
+        # Already done in most cases, the vector leg took longer
+        keyword_results = join_leg(keyword_future, max(0, start + RETRIEVAL_SEARCH_TIMEOUT_SECONDS - time.time()), 'keyword', timings) or []
+    timings['total_seconds'] = round(time.time() - start, 3)
+    LOG.info(f'method=fetch_data_v2, keyword_hits={len(keyword_results)}, semantic_hits={len(semantic_results)}, timings={timings}')
     
-    all_results = keyword_results + semantic_results
-    all_results = sorted(all_results, key=lambda x: x['_score'], reverse=True)
-    for data in all_results:
-        if context == '':
-            context = data['fields'][TEXT_CHUNK_FIELD][0]
-        else:
-            context += data['fields'][TEXT_CHUNK_FIELD][0] + ' '
+    # Semantic hits lead when blending, keyword matches on proper nouns are a narrower signal
+    # With reranking more candidates are fused, the reranker decides which few reach the context
+    fused_results = fuse_results([semantic_results, keyword_results], [1.0 - FUSION_KEYWORD_WEIGHT, FUSION_KEYWORD_WEIGHT] if FUSION_METHOD == 'blend' else None,
+                                 top_k=RERANK_CANDIDATES if reranker.enabled else top_k or RETRIEVAL_TOP_K, text_field=TEXT_CHUNK_FIELD)
+    if reranker.enabled and len(fused_results) > 0:
+        fused_results, rerank_stats = reranker.rerank(user_query, fused_results, TEXT_CHUNK_FIELD, top_k or RERANK_TOP_N)
+        timings['rerank_seconds'] = round(rerank_stats['latency_ms'] / 1000, 3)
+    context, context_report = build_context([data['fields'][TEXT_CHUNK_FIELD][0] for data in fused_results], token_budget or CONTEXT_TOKEN_BUDGET)
+    timings['context_tokens'] = context_report['used_tokens']
+    timings['dropped_tokens'] = context_report['dropped_tokens']
 
     return context.strip()
 
+
+def search_hits(query, index_name):
+    response = ops_client.search(body=query, index=index_name, request_timeout=RETRIEVAL_SEARCH_TIMEOUT_SECONDS)
+    LOG.info(f'Opensearch response {response}')
+    return response["hits"]["hits"]
+
+
+# (result, seconds) of a retrieval leg run on the executor
+def timed_leg(leg_fn):
+    leg_start = time.time()
+    result = leg_fn()
+    return result, time.time() - leg_start
+
+
+# Result of a leg, None when it failed or did not finish in time. A leg that timed out keeps
+# running on the executor, its result is dropped
+def join_leg(future, timeout_seconds, leg_name, timings):
+    try:
+        result, seconds = future.result(timeout=timeout_seconds)
+        timings[f'{leg_name}_seconds'] = round(seconds, 3)
+        return result
+    except FuturesTimeoutError:
+        LOG.error(f'method=join_leg, leg={leg_name}, message=timed_out, timeout_seconds={timeout_seconds:.3f}')
+        timings[f'{leg_name}_seconds'] = 'timeout'
+    except Exception as e:
+        LOG.error(f'method=join_leg, leg={leg_name}, error={e}')
+        timings[f'{leg_name}_seconds'] = 'error'
+    return None
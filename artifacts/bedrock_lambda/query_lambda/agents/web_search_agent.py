@@ -10,6 +10,7 @@ import boto3
 import logging
 from datetime import datetime, timedelta
 from agent_executor_utils import agent_executor
+from bedrock_limiter import create_bedrock_client
 
 
 #Begin: Needed by Master orchestrator
@@ -69,7 +70,7 @@ next_month_label = next_date.strftime('%B')
 day = date.day
 
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 credentials = boto3.Session().get_credentials()
 service = 'aoss'
 region = getenv("REGION", "us-east-1")
@@ -81,7 +82,7 @@ LOG.setLevel(logging.INFO)
 duckDuckUrl = 'https://html.duckduckgo.com/html/'
 payload = {'q': '{}','b': ''}
 headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:84.0) Gecko/20100101 Firefox/84.0'}
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 model_id = getenv("WEBSEARCH_MODEL", "anthropic.claude-3-haiku-20240307-v1:0")
 
 def rewrite_user_query(chat_history):
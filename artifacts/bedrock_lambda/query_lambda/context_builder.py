@@ -0,0 +1,78 @@
+from os import getenv
+import logging
+import math
+import re
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Tokens of retrieved text sent in the <context> of a RAG prompt
+CONTEXT_TOKEN_BUDGET = int(getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# No tokenizer in the Lambda, Claude averages about 4 characters of English text per token
+CONTEXT_CHARS_PER_TOKEN = float(getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+# A chunk adding less than this share of new sentences is a repeat of chunks already packed
+CONTEXT_MIN_NEW_SHARE = float(getenv("CONTEXT_MIN_NEW_SHARE", "0.3"))
+CONTEXT_SEPARATOR = '\n'
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+def sentence_key(sentence):
+    return re.sub(r'\s+', ' ', sentence).casefold()
+
+
+# Packs chunks, best ranked first, into a context of at most budget_tokens. Sentences already packed
+# are left out, so the overlap between neighbouring chunks is sent once and a chunk that only repeats
+# others is dropped. The chunk that no longer fits is cut at a sentence boundary and packing stops.
+# Returns (context, report) with the tokens used and dropped
+def build_context(chunks, budget_tokens=CONTEXT_TOKEN_BUDGET):
+    packed = []
+    seen = set()
+    used_tokens = 0
+    report = {'budget_tokens': budget_tokens, 'used_tokens': 0, 'dropped_tokens': 0, 'repeated_tokens': 0,
+              'chunks_in': len(chunks), 'chunks_used': 0, 'chunks_trimmed': 0, 'chunks_repeated': 0, 'chunks_dropped': 0}
+    separator_tokens = estimate_tokens(CONTEXT_SEPARATOR)
+    for position, chunk in enumerate(chunks):
+        sentences = split_sentences(chunk)
+        new_sentences = [sentence for sentence in sentences if sentence_key(sentence) not in seen]
+        repeated = [sentence for sentence in sentences if sentence_key(sentence) in seen]
+        report['repeated_tokens'] += sum(estimate_tokens(sentence) for sentence in repeated)
+        if len(sentences) == 0 or len(new_sentences) / len(sentences) < CONTEXT_MIN_NEW_SHARE:
+            report['chunks_repeated'] += 1
+            report['repeated_tokens'] += sum(estimate_tokens(sentence) for sentence in new_sentences)
+            continue
+        kept = []
+        chunk_tokens = separator_tokens if len(packed) > 0 else 0
+        for sentence in new_sentences:
+            sentence_tokens = estimate_tokens(sentence) + 1
+            if used_tokens + chunk_tokens + sentence_tokens > budget_tokens:
+                break
+            kept.append(sentence)
+            chunk_tokens += sentence_tokens
+        dropped = new_sentences[len(kept):]
+        report['dropped_tokens'] += sum(estimate_tokens(sentence) for sentence in dropped)
+        if len(kept) > 0:
+            packed.append(' '.join(kept))
+            used_tokens += chunk_tokens
+            seen.update(sentence_key(sentence) for sentence in kept)
+            report['chunks_used'] += 1
+            if len(dropped) > 0:
+                report['chunks_trimmed'] += 1
+        if len(dropped) > 0:
+            # Budget spent, the chunks ranked below are dropped whole
+            rest = chunks[position + 1:]
+            report['chunks_dropped'] += len(rest) + (1 if len(kept) == 0 else 0)
+            report['dropped_tokens'] += sum(estimate_tokens(text) for text in rest)
+            break
+    context = CONTEXT_SEPARATOR.join(packed)
+    report['used_tokens'] = estimate_tokens(context)
+    LOG.info(f'method=build_context, report={report}')
+    return context, report
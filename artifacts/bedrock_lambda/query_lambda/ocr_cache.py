@@ -0,0 +1,240 @@
+from os import getenv
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from image_preprocessor import prepare_image
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+OCR_CACHE_LRU_SIZE = int(getenv("OCR_CACHE_LRU_SIZE", "2000"))
+OCR_CACHE_TTL_DAYS = int(getenv("OCR_CACHE_TTL_DAYS", "90"))
+OCR_CACHE_ENABLED = getenv("OCR_CACHE_ENABLED", "yes")
+# Claude supports upto 20 images per prompt
+OCR_IMAGES_PER_PROMPT = 19
+# Raw image bytes per prompt, base64 adds a third on top of it
+OCR_PROMPT_MAX_BYTES = int(getenv("OCR_PROMPT_MAX_BYTES", str(15 * 1024 * 1024)))
+# batch_get_item accepts at most 100 keys per request
+DYNAMO_BATCH_GET_SIZE = 100
+# Unprocessed keys are retried with jittered backoff, keys still unprocessed after that count as misses
+DYNAMO_BATCH_GET_RETRIES = int(getenv("DYNAMO_BATCH_GET_RETRIES", "5"))
+DYNAMO_BACKOFF_BASE_SECONDS = 0.05
+DYNAMO_BACKOFF_MAX_SECONDS = 2
+
+
+# OCR text cache keyed by the sha256 of the raw image bytes.
+# The key does not include the OCR model so the index and OCR flows share entries.
+# Images are de-duplicated before they are batched into prompts, and an image already
+# being OCR'd by another thread (another page of the same PDF) is waited on, not re-sent.
+class OcrCache():
+
+    def __init__(self, table, max_entries=OCR_CACHE_LRU_SIZE, ttl_days=OCR_CACHE_TTL_DAYS):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.enabled = OCR_CACHE_ENABLED == 'yes'
+        self._lru = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def cache_key(self, image_digest):
+        return f'OCR_CACHE#{image_digest}'
+
+    def digest(self, image_bytes):
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    # Returns (texts, stats, errors), one text per distinct image in first seen order.
+    # ocr_batch_fn(list of image bytes, list of media types, model_id) returns one text per image, or a single
+    # string when the model answer could not be split per image (that answer is not cached)
+    def ocr_images(self, images, ocr_batch_fn, model_id):
+        unique = OrderedDict()
+        for image_bytes in images:
+            unique.setdefault(self.digest(image_bytes), image_bytes)
+        stats = {'images': len(images), 'duplicates': len(images) - len(unique), 'memory_hits': 0, 'store_hits': 0, 'shared': 0,
+                 'ocr': 0, 'dropped': 0, 'bytes_in': 0, 'bytes_out': 0}
+        texts = {}
+        errors = []
+        if not self.enabled:
+            self._ocr_batches(unique, ocr_batch_fn, model_id, texts, errors, stats)
+            return [texts.get(image_digest, '') for image_digest in unique], stats, errors
+
+        texts.update(self.lookup(list(unique), stats))
+
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for image_digest in unique:
+                if image_digest in texts:
+                    continue
+                if image_digest in self._in_flight:
+                    waiting[image_digest] = self._in_flight[image_digest]
+                else:
+                    owned[image_digest] = self._in_flight[image_digest] = Future()
+        try:
+            self._ocr_batches(OrderedDict((image_digest, unique[image_digest]) for image_digest in owned),
+                              ocr_batch_fn, model_id, texts, errors, stats, owned)
+        finally:
+            with self._lock:
+                for image_digest, future in owned.items():
+                    self._in_flight.pop(image_digest, None)
+                    if not future.done():
+                        future.set_result(None)
+
+        retry = OrderedDict()
+        for image_digest, future in waiting.items():
+            try:
+                text = future.result()
+            except Exception as e:
+                errors.append(f'Error textracting image {str(e)}')
+                continue
+            if text is None:
+                retry[image_digest] = unique[image_digest]
+            else:
+                texts[image_digest] = text
+                stats['shared'] += 1
+        if len(retry) > 0:
+            self._ocr_batches(retry, ocr_batch_fn, model_id, texts, errors, stats)
+        return [texts.get(image_digest, '') for image_digest in unique], stats, errors
+
+    # Cached texts by image digest, the in-memory LRU is checked before the index table
+    def lookup(self, image_digests, stats=None):
+        stats = stats if stats is not None else {'memory_hits': 0, 'store_hits': 0}
+        texts = {}
+        if not self.enabled:
+            return texts
+        with self._lock:
+            for image_digest in image_digests:
+                key = self.cache_key(image_digest)
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    texts[image_digest] = self._lru[key]
+        stats['memory_hits'] += len(texts)
+        missing = [image_digest for image_digest in image_digests if image_digest not in texts]
+        try:
+            for image_digest, text in self._batch_get(missing).items():
+                self._remember(image_digest, text)
+                texts[image_digest] = text
+                stats['store_hits'] += 1
+        except Exception as e:
+            LOG.error(f'method=ocr_cache_get, keys={len(missing)}, error={e}')
+        return texts
+
+    def _ocr_batches(self, pending, ocr_batch_fn, model_id, texts, errors, stats, futures=None):
+        futures = futures or {}
+        for batch, prepared in self._prepared_batches(pending, texts, stats, futures):
+            try:
+                batch_texts = ocr_batch_fn([image_bytes for image_bytes, media_type in prepared],
+                                           [media_type for image_bytes, media_type in prepared], model_id)
+            except Exception as e:
+                # Some images cant be read
+                LOG.error(f'method=ocr_images, images={len(batch)}, model_id={model_id}, error={e}')
+                errors.append(f'Error textracting image {str(e)}')
+                for image_digest in batch:
+                    if image_digest in futures:
+                        futures[image_digest].set_exception(e)
+                continue
+            stats['ocr'] += len(batch)
+            if isinstance(batch_texts, str):
+                # The whole answer stays with the first image of the batch and nothing is cached
+                texts[batch[0]] = batch_texts
+                continue
+            for image_digest, text in zip(batch, batch_texts):
+                texts[image_digest] = text
+                if image_digest in futures:
+                    futures[image_digest].set_result(text)
+            self.put_many(batch, batch_texts, model_id)
+
+    # Downscales and re-encodes the images before they are batched, tiny decorative images
+    # are answered with an empty text without a model call
+    def _prepared_batches(self, pending, texts, stats, futures):
+        batch = []
+        prepared = []
+        batch_bytes = 0
+        for image_digest, image_bytes in pending.items():
+            image = prepare_image(image_bytes)
+            stats['bytes_in'] += len(image_bytes)
+            if image is None:
+                stats['dropped'] += 1
+                texts[image_digest] = ''
+                if image_digest in futures:
+                    futures[image_digest].set_result('')
+                continue
+            stats['bytes_out'] += len(image[0])
+            if len(batch) > 0 and (len(batch) >= OCR_IMAGES_PER_PROMPT or batch_bytes + len(image[0]) > OCR_PROMPT_MAX_BYTES):
+                yield batch, prepared
+                batch = []
+                prepared = []
+                batch_bytes = 0
+            batch.append(image_digest)
+            prepared.append(image)
+            batch_bytes += len(image[0])
+        if len(batch) > 0:
+            yield batch, prepared
+
+    def put_many(self, image_digests, texts, model_id):
+        if not self.enabled:
+            return
+        expire_epoch = int(time.time()) + self.ttl_seconds
+        try:
+            with self.table.batch_writer(overwrite_by_pkeys=['prim_key', 'sort_key']) as batch:
+                for image_digest, text in zip(image_digests, texts):
+                    self._remember(image_digest, text)
+                    batch.put_item(Item={
+                        'prim_key': self.cache_key(image_digest),
+                        'sort_key': 'OCR',
+                        'ocr_text': text,
+                        'model_id': model_id,
+                        'expire_epoch': expire_epoch
+                    })
+        except Exception as e:
+            LOG.error(f'method=ocr_cache_put, items={len(image_digests)}, error={e}')
+
+    def _remember(self, image_digest, text):
+        with self._lock:
+            key = self.cache_key(image_digest)
+            self._lru[key] = text
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _batch_get(self, image_digests):
+        results = {}
+        client = self.table.meta.client
+        for start in range(0, len(image_digests), DYNAMO_BATCH_GET_SIZE):
+            request = {self.table.name: {
+                'Keys': [{'prim_key': {'S': self.cache_key(image_digest)}, 'sort_key': {'S': 'OCR'}} for image_digest in image_digests[start:start + DYNAMO_BATCH_GET_SIZE]],
+                'ProjectionExpression': 'prim_key, ocr_text'
+            }}
+            attempt = 0
+            while request:
+                response = client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table.name, []):
+                    results[item['prim_key']['S'][len('OCR_CACHE#'):]] = item['ocr_text']['S']
+                request = response.get('UnprocessedKeys')
+                if request:
+                    if attempt >= DYNAMO_BATCH_GET_RETRIES:
+                        LOG.warning(f'method=ocr_cache_get, unprocessed_keys={len(request.get(self.table.name, {}).get("Keys", []))}, attempts={attempt + 1}')
+                        break
+                    # Unprocessed keys mean the table is throttling, back off before asking again
+                    attempt += 1
+                    time.sleep(min(DYNAMO_BACKOFF_BASE_SECONDS * 2 ** attempt, DYNAMO_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0))
+        return results
+
+
+# Splits the answer of a labelled multi image OCR prompt, {"texts": ["...", "..."]}.
+# Returns None when the answer does not hold exactly one text per image
+def parse_ocr_batch_response(response_text, image_count):
+    try:
+        texts = json.loads(response_text[response_text.index('{'):response_text.rindex('}') + 1])['texts']
+    except Exception as e:
+        LOG.warning(f'method=parse_ocr_batch_response, image_count={image_count}, error={e}')
+        return None
+    if not isinstance(texts, list) or len(texts) != image_count:
+        LOG.warning(f'method=parse_ocr_batch_response, image_count={image_count}, texts={len(texts) if isinstance(texts, list) else 0}')
+        return None
+    return [text if isinstance(text, str) else json.dumps(text) for text in texts]
@@ -339,14 +339,15 @@ Remember not to summarize or analyze the image. You should only return the extra
 """
 
 
-def generate_claude_3_ocr_prompt(image_bytes_list):
+def generate_claude_3_ocr_prompt(image_bytes_list, media_types=None):
+    media_types = media_types or ['image/jpeg'] * len(image_bytes_list)
     img_content_list = []
-    for image_bytes in image_bytes_list:
+    for image_bytes, media_type in zip(image_bytes_list, media_types):
         img_content_list.append({
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/jpeg",
+                    "media_type": media_type,
                     "data": base64.b64encode(image_bytes).decode("utf-8")
                 }
             })
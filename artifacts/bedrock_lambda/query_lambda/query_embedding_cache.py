@@ -0,0 +1,126 @@
+from os import getenv
+from collections import OrderedDict
+import hashlib
+import logging
+import re
+import struct
+import threading
+import time
+import unicodedata
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Entries hold packed float32 vectors, ~4KB each for 1024 dimensions
+QUERY_EMBED_CACHE_LRU_SIZE = int(getenv("QUERY_EMBED_CACHE_LRU_SIZE", "2000"))
+QUERY_EMBED_CACHE_MEMORY_TTL_SECONDS = int(getenv("QUERY_EMBED_CACHE_MEMORY_TTL_SECONDS", "3600"))
+QUERY_EMBED_CACHE_TTL_DAYS = int(getenv("QUERY_EMBED_CACHE_TTL_DAYS", "30"))
+QUERY_EMBED_CACHE_ENABLED = getenv("QUERY_EMBED_CACHE_ENABLED", "yes")
+
+
+# Questions differing only in case, spacing or trailing punctuation share an embedding
+def normalize_query(query):
+    query = unicodedata.normalize('NFKC', query).casefold()
+    query = re.sub(r'\s+', ' ', query).strip()
+    return query.rstrip('?!. ')
+
+
+# Query embeddings keyed by (embed model, normalized query). An in-process LRU with a TTL that survives
+# warm invocations sits in front of the DynamoDB index table, shared by every query Lambda.
+# Kept apart from the document embedding cache, models like Cohere embed queries differently
+class QueryEmbeddingCache():
+
+    def __init__(self, table, max_entries=QUERY_EMBED_CACHE_LRU_SIZE, memory_ttl_seconds=QUERY_EMBED_CACHE_MEMORY_TTL_SECONDS,
+                 ttl_days=QUERY_EMBED_CACHE_TTL_DAYS):
+        self.table = table
+        self.max_entries = max_entries
+        self.memory_ttl_seconds = memory_ttl_seconds
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.enabled = QUERY_EMBED_CACHE_ENABLED == 'yes'
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'store_errors': 0}
+
+    def cache_key(self, model_id, query):
+        return f'QUERY_EMBED_CACHE#{model_id}#{hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()}'
+
+    # (embedding, 'memory' | 'store' | 'miss'), embed_fn(query) is only called on a miss
+    def get_or_embed(self, model_id, query, embed_fn):
+        if not self.enabled:
+            return embed_fn(query), 'miss'
+        key = self.cache_key(model_id, query)
+        packed = self._recall(key)
+        if packed is not None:
+            self._count('memory_hits')
+            return unpack_embedding(packed), 'memory'
+        try:
+            item = self.table.get_item(Key={'prim_key': key, 'sort_key': 'EMBEDDING'}).get('Item')
+            if item is not None and int(item.get('expire_epoch', 0)) > time.time():
+                packed = bytes(item['embedding'])
+                self._remember(key, packed)
+                self._count('store_hits')
+                return unpack_embedding(packed), 'store'
+        except Exception as e:
+            LOG.error(f'method=query_embedding_cache_get, model_id={model_id}, error={e}')
+            self._count('store_errors')
+        self._count('misses')
+        embedding = embed_fn(query)
+        # Failed embed calls return no vector, nothing to remember
+        if isinstance(embedding, list) and len(embedding) > 0:
+            self._put(key, model_id, embedding)
+        return embedding, 'miss'
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._lru)
+        lookups = stats['memory_hits'] + stats['store_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['store_hits']) / lookups, 3) if lookups > 0 else 0
+        return stats
+
+    def _put(self, key, model_id, embedding):
+        packed = pack_embedding(embedding)
+        self._remember(key, packed)
+        try:
+            self.table.put_item(Item={
+                'prim_key': key,
+                'sort_key': 'EMBEDDING',
+                'embedding': packed,
+                'expire_epoch': int(time.time()) + self.ttl_seconds
+            })
+        except Exception as e:
+            LOG.error(f'method=query_embedding_cache_put, model_id={model_id}, error={e}')
+            self._count('store_errors')
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            packed, stored_at = entry
+            if time.time() - stored_at > self.memory_ttl_seconds:
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return packed
+
+    def _remember(self, key, packed):
+        with self._lock:
+            self._lru[key] = (packed, time.time())
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+
+# Same layout as the document embedding cache of the index Lambda, little endian float32
+def pack_embedding(embedding):
+    return struct.pack(f'<{len(embedding)}f', *embedding)
+
+
+def unpack_embedding(data):
+    data = bytes(data)
+    return list(struct.unpack(f'<{len(data) // 4}f', data))
@@ -9,6 +9,7 @@ from decimal import Decimal
 import logging
 import re
 import base64
+from collections import OrderedDict
 
 from agents.retriever_agent import fetch_data, fetch_data_v2, classify_and_translation_request
 from prompt_utils import AGENT_MAP, get_system_prompt, agent_execution_step, rag_chat_bot_prompt
@@ -17,9 +18,13 @@ from prompt_utils import get_can_the_orchestrator_answer_prompt
 from prompt_utils import sentiment_prompt, generate_claude_3_ocr_prompt
 from prompt_utils import pii_redact_prompt
 from agent_executor_utils import agent_executor
+from bedrock_limiter import create_bedrock_client
+from ocr_cache import OcrCache
+from image_preprocessor import prepare_image
+from s3_stream import open_s3_file, peak_memory_mb
 from pypdf import PdfReader
 
-bedrock_client = boto3.client('bedrock-runtime')
+bedrock_client = create_bedrock_client()
 embed_model_id = getenv("EMBED_MODEL_ID", "amazon.titan-embed-image-v1")
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
@@ -33,6 +38,9 @@ is_rag_enabled = getenv("IS_RAG_ENABLED", 'yes')
 s3_bucket_name = getenv("S3_BUCKET_NAME", "S3_BUCKET_NAME_MISSING")
 websocket_client = boto3.client('apigatewaymanagementapi', endpoint_url=wss_url)
 lambda_client = boto3.client('lambda')
+index_dynamodb_table_name = getenv("INDEX_DYNAMO_TABLE_NAME", "rag-llm-index-table-dev")
+# OCR results are shared with the index Lambda through the index table
+ocr_cache = OcrCache(boto3.resource('dynamodb').Table(index_dynamodb_table_name))
 
 credentials = boto3.Session().get_credentials()
 service = 'aoss'
@@ -76,41 +84,62 @@ def perform_ocr(user_input, model_id, connect_id):
                     file_name = message['file_name']
                     s3_key = f"ocr/data/{file_name}"
                     file_extension = s3_key[s3_key.rindex('.')+1:]
-                    content = get_file_from_s3(s3_bucket_name, s3_key)
                     if file_extension.lower() in ['pdf']:
-                        reader = PdfReader(BytesIO(content))
-                        LOG.debug(f'method=process_file_upload, num_of_pages={len(reader.pages)}')
-                        for page in reader.pages:
-                            websocket_send(connect_id, { "text": f"Page {page.page_number}" } )
-                            text_value = None
-                            # Read Text on Page
-                            text_value = page.extract_text()
-                            if text_value is not None:
-                                websocket_send(connect_id, {"text": text_value})
-                            LOG.debug(f'method=perform_ocr, file_type=pdf-text, content={text_value}')
-                            # Read Image on Page
-                            img_files = []
-                            img_counter = 0
-                            for image_file_object in page.images:
-                                img_files.append(image_file_object.data)
-                                img_counter = img_counter + 1
-                                if img_counter >= 19:
-                                    # Extract through low cost LLM (Claude3-Haiku)
-                                    ocr_prompt = generate_claude_3_ocr_prompt(img_files)
-                                    LOG.debug(f'method=perform_ocr, file_type=pdf-image, content={ocr_prompt}')
-                                    invoke_model(0, ocr_prompt, connect_id, True, model_id)
-                                    img_counter=0
-                                    img_files=[]
-                            if len(img_files) > 0:
-                                # Extract through low cost LLM (Claude3-Haiku)
-                                ocr_prompt = generate_claude_3_ocr_prompt(img_files)
-                                LOG.debug(f'method=perform_ocr, file_type=pdf-image, content={ocr_prompt}')
-                                invoke_model(0, ocr_prompt, connect_id, True, model_id)
+                        # Spooled to /tmp, pypdf seeks into the file instead of holding it in memory
+                        pdf_file, _ = open_s3_file(s3_bucket_name, s3_key)
+                        with pdf_file:
+                            reader = PdfReader(pdf_file)
+                            LOG.debug(f'method=process_file_upload, num_of_pages={len(reader.pages)}')
+                            for page in reader.pages:
+                                websocket_send(connect_id, { "text": f"Page {page.page_number}" } )
+                                text_value = None
+                                # Read Text on Page
+                                text_value = page.extract_text()
+                                if text_value is not None:
+                                    websocket_send(connect_id, {"text": text_value})
+                                LOG.debug(f'method=perform_ocr, file_type=pdf-text, content={text_value}')
+                                # Read Image on Page, repeated images are OCR'd once and cached by digest
+                                img_files = [image_file_object.data for image_file_object in page.images]
+                                if len(img_files) > 0:
+                                    send_ocr_text(img_files, model_id, connect_id)
+                        LOG.info(f'method=perform_ocr, s3_key={s3_key}, peak_memory_mb={peak_memory_mb()}')
                         websocket_send(connect_id, { "text": "ack-end-of-msg" } )
                     elif file_extension.lower() in ['png', 'jpg']:
-                        ocr_prompt = generate_claude_3_ocr_prompt([content])
-                        LOG.debug(f'method=perform_ocr, file_type=png_jpg_image, content={ocr_prompt}')
-                        invoke_model(0, ocr_prompt, connect_id, True, model_id)   
+                        content = get_file_from_s3(s3_bucket_name, s3_key)
+                        send_ocr_text([content], model_id, connect_id)
+                        websocket_send(connect_id, { "text": "ack-end-of-msg" } )
+
+
+# Images already in the OCR cache are sent as whole texts, the others are OCR'd one per call and
+# streamed to the socket as the model produces the text, then cached
+def send_ocr_text(img_files, model_id, connect_id):
+    unique = OrderedDict()
+    for image_bytes in img_files:
+        unique.setdefault(ocr_cache.digest(image_bytes), image_bytes)
+    ocr_stats = {'images': len(img_files), 'duplicates': len(img_files) - len(unique), 'memory_hits': 0, 'store_hits': 0, 'streamed': 0, 'dropped': 0}
+    cached_texts = ocr_cache.lookup(list(unique), ocr_stats)
+    for image_digest, image_bytes in unique.items():
+        if image_digest in cached_texts:
+            if len(cached_texts[image_digest].split()) > 0:
+                websocket_send(connect_id, {"text": cached_texts[image_digest]})
+            continue
+        image = prepare_image(image_bytes)
+        if image is None:
+            ocr_stats['dropped'] += 1
+            continue
+        try:
+            ocr_prompt = generate_claude_3_ocr_prompt([image[0]], [image[1]])
+            result = query_bedrock_claude3_model(0, model_id, ocr_prompt, connect_id, True)
+        except Exception as e:
+            LOG.error(f'method=send_ocr_text, model_id={model_id}, error={e}')
+            websocket_send(connect_id, {"text": f'Error textracting image {str(e)}'})
+            continue
+        ocr_stats['streamed'] += 1
+        # Error events of the stream come back as dicts, an answer cut short is not cached
+        if all(isinstance(part, str) for part in result):
+            ocr_cache.put_many([image_digest], [''.join(result)], model_id)
+    LOG.info(f'method=perform_ocr, model_id={model_id}, ocr_stats={ocr_stats}')
+
 
                     
 def query_rag_no_agent(user_input, query_vector_db, language, model_id, is_hybrid_search, connect_id):
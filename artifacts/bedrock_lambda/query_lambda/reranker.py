@@ -0,0 +1,155 @@
+from os import getenv
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+try:
+    # Shipped with the optional reranker layer, the overlap scorer is used without it
+    import numpy as np
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:
+    onnxruntime = None
+
+RERANK_ENABLED = getenv("RERANK_ENABLED", "no")
+# Cross-encoder exported to ONNX (model.onnx) with its tokenizer.json, e.g. ms-marco-MiniLM-L-6-v2
+RERANK_MODEL_DIR = getenv("RERANK_MODEL_DIR", "/opt/reranker")
+# Candidates fetched and fused before reranking, and chunks kept after it
+RERANK_CANDIDATES = int(getenv("RERANK_CANDIDATES", "30"))
+RERANK_TOP_N = int(getenv("RERANK_TOP_N", "5"))
+# Candidates not scored within the budget keep their fused order behind the scored ones
+RERANK_BUDGET_MS = int(getenv("RERANK_BUDGET_MS", "300"))
+RERANK_BATCH_SIZE = int(getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_MAX_TOKENS = int(getenv("RERANK_MAX_TOKENS", "256"))
+# Share of the overlap score in the final score of the overlap scorer, the fused rank gives the rest
+RERANK_OVERLAP_WEIGHT = float(getenv("RERANK_OVERLAP_WEIGHT", "0.5"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOP_WORDS = set('a an and are as at be by for from has have how i in is it its of on or that the their this to was what when where which who why will with you your'.split())
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [word for word in WORD.findall(text.casefold()) if word not in STOP_WORDS]
+
+
+# BM25 of every text for the query, with the candidates as the corpus
+def bm25_scores(query, texts):
+    query_terms = set(tokenize(query))
+    documents = [tokenize(text) for text in texts]
+    if len(query_terms) == 0 or len(documents) == 0:
+        return [0.0] * len(texts)
+    average_length = sum(len(document) for document in documents) / len(documents) or 1
+    document_frequency = {term: sum(1 for document in documents if term in document) for term in query_terms}
+    scores = []
+    for document in documents:
+        counts = {}
+        for word in document:
+            if word in query_terms:
+                counts[word] = counts.get(word, 0) + 1
+        score = 0.0
+        for term, count in counts.items():
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * count * (BM25_K1 + 1) / (count + BM25_K1 * (1 - BM25_B + BM25_B * len(document) / average_length))
+        scores.append(score)
+    return scores
+
+
+def normalize(scores):
+    if len(scores) == 0:
+        return []
+    low, high = min(scores), max(scores)
+    return [(score - low) / (high - low) if high > low else 1.0 for score in scores]
+
+
+# Second stage after fusion: rescores the candidates against the query on the CPU and keeps the best top_n.
+# Uses the ONNX cross-encoder when its layer is attached, otherwise BM25 over the candidates blended
+# with the fused score. Scoring stops at the latency budget
+class Reranker():
+
+    def __init__(self, model_dir=RERANK_MODEL_DIR, budget_ms=RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE):
+        self.model_dir = model_dir
+        self.budget_ms = budget_ms
+        self.batch_size = max(1, batch_size)
+        self.enabled = RERANK_ENABLED == 'yes'
+        self._session = None
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # Loaded on first use so cold starts without reranking do not pay for it
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return self._session is not None
+            self._loaded = True
+            model_path = os.path.join(self.model_dir, 'model.onnx')
+            if onnxruntime is None or not os.path.exists(model_path):
+                LOG.info(f'method=reranker_load, scorer=overlap, onnxruntime={onnxruntime is not None}, model_path={model_path}')
+                return False
+            try:
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = os.cpu_count() or 1
+                self._session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+                self._tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, 'tokenizer.json'))
+                self._tokenizer.enable_truncation(max_length=RERANK_MAX_TOKENS)
+                self._tokenizer.enable_padding()
+                LOG.info(f'method=reranker_load, scorer=onnx, model_path={model_path}')
+            except Exception as e:
+                LOG.error(f'method=reranker_load, model_path={model_path}, error={e}')
+                self._session = None
+            return self._session is not None
+
+    def _score_onnx(self, query, texts):
+        encodings = self._tokenizer.encode_batch([(query, text) for text in texts])
+        features = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            'attention_mask': np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        inputs = {model_input.name: features[model_input.name] for model_input in self._session.get_inputs() if model_input.name in features}
+        logits = np.asarray(self._session.run(None, inputs)[0], dtype=np.float32)
+        if logits.ndim == 1:
+            return logits.tolist()
+        if logits.shape[1] == 1:
+            return logits[:, 0].tolist()
+        # Classifier heads put "not relevant" first, the score is the softmax probability of the last class
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return (exp[:, -1] / exp.sum(axis=1)).tolist()
+
+    # Returns (top_n hits, stats), hits come in fused order and carry '_fused_score'
+    def rerank(self, query, hits, text_field='text', top_n=RERANK_TOP_N):
+        start = time.time()
+        texts = [hit['fields'][text_field][0] for hit in hits]
+        scores = []
+        if self._load():
+            scorer = 'onnx'
+            deadline = start + self.budget_ms / 1000
+            for batch_start in range(0, len(texts), self.batch_size):
+                if time.time() >= deadline:
+                    break
+                try:
+                    scores.extend(self._score_onnx(query, texts[batch_start:batch_start + self.batch_size]))
+                except Exception as e:
+                    LOG.error(f'method=rerank, scorer=onnx, error={e}')
+                    break
+        else:
+            # A single pass over a few dozen chunks, well within any budget
+            scorer = 'overlap'
+            fused = normalize([hit.get('_fused_score', 0.0) for hit in hits])
+            scores = [RERANK_OVERLAP_WEIGHT * overlap + (1 - RERANK_OVERLAP_WEIGHT) * fused_score
+                      for overlap, fused_score in zip(normalize(bm25_scores(query, texts)), fused)]
+        scored = sorted(range(len(scores)), key=lambda position: scores[position], reverse=True)
+        order = scored + list(range(len(scores), len(hits)))
+        results = [dict(hits[position], _rerank_score=scores[position] if position < len(scores) else None) for position in order[:top_n]]
+        stats = {'scorer': scorer, 'candidates': len(hits), 'scored': len(scores), 'kept': len(results),
+                 'latency_ms': round((time.time() - start) * 1000, 1), 'budget_exceeded': len(scores) < len(hits)}
+        LOG.info(f'method=rerank, stats={stats}')
+        return results, stats
@@ -0,0 +1,52 @@
+from os import getenv
+import logging
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# rrf ranks hits by reciprocal rank, blend by min-max normalized scores
+FUSION_METHOD = getenv("FUSION_METHOD", "rrf")
+# Rank constant of reciprocal rank fusion, larger values flatten the gap between top ranks
+FUSION_RRF_K = int(getenv("FUSION_RRF_K", "60"))
+# Weight of the keyword list when blending, the vector list gets the rest
+FUSION_KEYWORD_WEIGHT = float(getenv("FUSION_KEYWORD_WEIGHT", "0.3"))
+# Chunks kept after fusion
+RETRIEVAL_TOP_K = int(getenv("RETRIEVAL_TOP_K", "10"))
+
+
+# BM25 and cosine scores are not comparable, so ranked lists are fused on rank (RRF) or on scores
+# normalized per list. A chunk found by several lists is kept once, with the fused score of all of them.
+# Returns the top_k hits, best first, each with a '_fused_score'
+def fuse_results(result_lists, weights=None, method=FUSION_METHOD, top_k=RETRIEVAL_TOP_K, rrf_k=FUSION_RRF_K, text_field='text'):
+    weights = weights or [1.0] * len(result_lists)
+    fused = {}
+    hits_by_id = {}
+    for hits, weight in zip(result_lists, weights):
+        if len(hits) == 0:
+            continue
+        scores = [hit.get('_score') or 0.0 for hit in hits]
+        low, high = min(scores), max(scores)
+        for rank, (hit, score) in enumerate(zip(hits, scores)):
+            if method == 'blend':
+                contribution = weight * ((score - low) / (high - low) if high > low else 1.0)
+            else:
+                contribution = weight / (rrf_k + rank + 1)
+            fused[hit['_id']] = fused.get(hit['_id'], 0.0) + contribution
+            hits_by_id.setdefault(hit['_id'], hit)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    results = []
+    seen_texts = set()
+    duplicates = 0
+    for doc_id, score in ranked:
+        hit = hits_by_id[doc_id]
+        # Different _ids can hold the same chunk, e.g. a file uploaded twice under different names
+        text = hit.get('fields', {}).get(text_field, [None])[0]
+        if text is not None and text in seen_texts:
+            duplicates += 1
+            continue
+        seen_texts.add(text)
+        results.append(dict(hit, _fused_score=score))
+        if len(results) >= top_k:
+            break
+    LOG.info(f'method=fuse_results, fusion={method}, hits={sum(len(hits) for hits in result_lists)}, unique_ids={len(fused)}, duplicate_texts={duplicates}, kept={len(results)}')
+    return results
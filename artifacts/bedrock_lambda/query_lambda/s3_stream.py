@@ -0,0 +1,60 @@
+from os import getenv
+import codecs
+import logging
+import resource
+import shutil
+import tempfile
+import boto3
+
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+# Objects up to this size stay in memory, bigger ones are spooled to Lambda ephemeral storage
+S3_SPOOL_MAX_MEMORY_BYTES = int(getenv("S3_SPOOL_MAX_MEMORY_BYTES", str(8 * 1024 * 1024)))
+S3_READ_CHUNK_BYTES = int(getenv("S3_READ_CHUNK_BYTES", str(1024 * 1024)))
+# Characters handed to the splitter at a time for text files
+TEXT_WINDOW_CHARS = int(getenv("TEXT_WINDOW_CHARS", str(1024 * 1024)))
+SPOOL_DIR = getenv("SPOOL_DIR", "/tmp")
+
+
+# Copies an S3 object into a seekable file without holding it in memory.
+# Returns (file object, metadata), the caller closes the file which also removes it from /tmp
+def open_s3_file(bucket, key, s3_client=None):
+    s3_client = s3_client or boto3.client('s3')
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    spooled = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_MEMORY_BYTES, dir=SPOOL_DIR)
+    try:
+        shutil.copyfileobj(response['Body'], spooled, S3_READ_CHUNK_BYTES)
+        spooled.seek(0)
+    except Exception:
+        spooled.close()
+        raise
+    LOG.info(f'method=open_s3_file, bucket_key={bucket}/{key}, bytes={response.get("ContentLength")}, peak_memory_mb={peak_memory_mb()}')
+    return spooled, response.get('Metadata', {})
+
+
+# Decodes an S3 object incrementally and yields text windows of about window_chars.
+# Windows end on a line break (or a space) when there is one so words are never cut in two
+def iter_s3_text(bucket, key, s3_client=None, encoding='utf-8', window_chars=TEXT_WINDOW_CHARS):
+    s3_client = s3_client or boto3.client('s3')
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in response['Body'].iter_chunks(chunk_size=S3_READ_CHUNK_BYTES):
+        pending += decoder.decode(chunk)
+        while len(pending) >= window_chars:
+            cut = pending.rfind('\n', 0, window_chars) + 1
+            if cut <= 0:
+                cut = pending.rfind(' ', 0, window_chars) + 1
+            if cut <= 0:
+                cut = window_chars
+            yield pending[:cut]
+            pending = pending[cut:]
+    pending += decoder.decode(b'', final=True)
+    if len(pending) > 0:
+        yield pending
+
+
+# Peak resident memory of this Lambda container, ru_maxrss is in KB on Linux
+def peak_memory_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
@@ -16,13 +16,33 @@ export function UploadUI(props: UploadDocProps) {
   const [isLoading, setIsLoading] = useState(false);
   const [isModalVisible, setIsModalVisible] = useState(false);
   const [userFiles, setUserFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const appData = useContext(AppContext);
 
+  // Files are listed a page at a time, newest first
   const refreshUserFileList = () => {
     setIsLoading(true);
     axios.get(`${config.apiUrl}get-indexed-files-by-user`, { headers: { authorization: appData.userinfo.tokens.idToken.toString() } })
       .then((result) => {
         setUserFiles(result.data.result)
+        setNextCursor(result.data.next_cursor)
+        setIsLoading(false);
+      })
+  }
+
+  const loadMoreUserFiles = () => {
+    setIsLoading(true);
+    axios.get(`${config.apiUrl}get-indexed-files-by-user`, {
+      params: { "cursor": nextCursor },
+      headers: { authorization: appData.userinfo.tokens.idToken.toString() }
+    })
+      .then((result) => {
+        setUserFiles(userFiles.concat(result.data.result))
+        setNextCursor(result.data.next_cursor)
+        setIsLoading(false);
+      })
+      .catch((err) => {
+        console.log(err)
         setIsLoading(false);
       })
   }
@@ -189,7 +209,7 @@ export function UploadUI(props: UploadDocProps) {
           {
             id: "errors",
             header: "Message",
-            cell: item => item.idx_err_msg || "-",
+            cell: item => item.idx_err_summary || item.idx_err_msg || "-",
             sortingField: "update_epoch",
             isRowHeader: true
           },
@@ -218,6 +238,11 @@ export function UploadUI(props: UploadDocProps) {
         stickyHeader
         stripedRows
         sortingDisabled
+        footer={nextCursor &&
+          <Box textAlign="center">
+            <Button onClick={() => loadMoreUserFiles()} disabled={isLoading}>Load more</Button>
+          </Box>
+        }
         empty={
           <Box
             margin={{ vertical: "xs" }}
@@ -5,6 +5,8 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_ecr as _ecr, 
     aws_s3 as _s3,
+    aws_sqs as _sqs,
+    aws_lambda_event_sources as _event_sources,
     aws_cognito as _cognito
 )
 
@@ -189,7 +191,8 @@ class ApiGw_Stack(Stack):
                                             'S3_BUCKET_NAME': bucket_name,
                                             'EMBED_MODEL_ID': embed_model_id,
                                             'IS_BEDROCK_KB': 'no',
-                                            'CONVERSATIONS_DYNAMO_TABLE_NAME': env_params['conversations_dynamo_table_name']
+                                            'CONVERSATIONS_DYNAMO_TABLE_NAME': env_params['conversations_dynamo_table_name'],
+                                            'INDEX_DYNAMO_TABLE_NAME': env_params['index_dynamo_table_name']
                               },
                               memory_size=3000,
                               layers= [addtional_libs_layer, agentic_libs_layer_name, langchainpy_layer, pdfpy_layer]
@@ -232,6 +235,37 @@ class ApiGw_Stack(Stack):
         
         bedrock_indexing_lambda_function.grant_invoke(s3_principal)
         
+        # S3 notifications go through an ingestion queue, a burst of uploads is worked off by a bounded
+        # number of index Lambdas. Messages that keep failing end up in the dead-letter queue
+        ingest_dead_letter_queue = _sqs.Queue(self, f'rag-llm-ingest-dlq-{env_name}',
+                                              queue_name=f'{env_params["ingest_queue_name"]}-dlq',
+                                              retention_period=_cdk.Duration.days(14),
+                                              enforce_ssl=True)
+        ingest_queue = _sqs.Queue(self, f'rag-llm-ingest-queue-{env_name}',
+                                  queue_name=env_params['ingest_queue_name'],
+                                  # 6 times the index Lambda timeout as recommended for Lambda event sources
+                                  visibility_timeout=_cdk.Duration.seconds(3600),
+                                  retention_period=_cdk.Duration.days(4),
+                                  enforce_ssl=True,
+                                  # The Lambda dead-letters a failing message on its 3rd receive with the error,
+                                  # the redrive only catches messages whose invocation timed out or crashed
+                                  dead_letter_queue=_sqs.DeadLetterQueue(max_receive_count=5, queue=ingest_dead_letter_queue))
+        ingest_queue.add_to_resource_policy(_iam.PolicyStatement(effect=_iam.Effect.ALLOW,
+                            actions=["sqs:SendMessage", "sqs:GetQueueAttributes", "sqs:GetQueueUrl"],
+                            principals=[s3_principal],
+                            resources=[ingest_queue.queue_arn]))
+        ingest_queue.grant_send_messages(bedrock_indexing_lambda_function)
+        ingest_dead_letter_queue.grant_send_messages(bedrock_indexing_lambda_function)
+        bedrock_indexing_lambda_function.add_environment('INGEST_QUEUE_URL', ingest_queue.queue_url)
+        bedrock_indexing_lambda_function.add_environment('INGEST_DLQ_URL', ingest_dead_letter_queue.queue_url)
+        bedrock_indexing_lambda_function.add_event_source(_event_sources.SqsEventSource(ingest_queue,
+                            # Messages of a batch are indexed one after the other, small batches keep
+                            # the page range shards of a large PDF on different Lambdas
+                            batch_size=2,
+                            max_batching_window=_cdk.Duration.seconds(5),
+                            max_concurrency=env_params.get('ingest_max_concurrency', 5),
+                            report_batch_item_failures=True))
+        
         bedrock_querying_lambda_function.add_environment('WSS_URL', wss_url + '/' + env_name)
         
         bedrock_index_lambda_integration = _cdk.aws_apigateway.LambdaIntegration(
@@ -6,6 +6,7 @@ from aws_cdk import (
     aws_codebuild as _codebuild,
     aws_s3 as _s3,
     aws_s3_notifications as _s3_notifications,
+    aws_sqs as _sqs,
     aws_lambda as _lambda,
     aws_iam as _iam)
 
@@ -79,12 +80,15 @@ class AppRunnerHostingStack(Stack):
                                                             id="serverless-rag-demo-cors-rule")],
                                         versioned=False)
         
-        lambda_arn=f'arn:aws:lambda:{region}:{account_id}:function:{config_details["bedrock_indexing_function_name"]}'
-        function = _lambda.Function.from_function_arn(self, f's3-notify-lambda-{env_name}', lambda_arn)
-        # create s3 notification for lambda function
-        notification = _s3_notifications.LambdaDestination(function)
-        self.images_bucket.add_event_notification(_s3.EventType.OBJECT_CREATED, notification)
-        self.images_bucket.add_event_notification(_s3.EventType.OBJECT_REMOVED_DELETE, notification)
+        # create s3 notification for the ingestion queue in front of the index lambda function
+        # the queue policy letting the bucket send messages is set where the queue is created
+        queue_arn = f'arn:aws:sqs:{region}:{account_id}:{config_details["ingest_queue_name"]}'
+        ingest_queue = _sqs.Queue.from_queue_arn(self, f's3-notify-queue-{env_name}', queue_arn)
+        notification = _s3_notifications.SqsDestination(ingest_queue)
+        # only uploads under index/ are indexed, chunk manifests and checkpoints written by the lambda stay out of the queue
+        upload_filter = _s3.NotificationKeyFilter(prefix='index/')
+        self.images_bucket.add_event_notification(_s3.EventType.OBJECT_CREATED, notification, upload_filter)
+        self.images_bucket.add_event_notification(_s3.EventType.OBJECT_REMOVED_DELETE, notification, upload_filter)
         
         _cdk.CfnOutput(self, f"rag-llm-ecr-service-output-{env_name}", value=app_runner_ui.attr_service_url,
                        export_name="ServiceUrl"
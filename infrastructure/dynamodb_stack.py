@@ -22,7 +22,26 @@ class Storage_Stack(NestedStack):
                                                  partition_key=dynamodb.Attribute(name="prim_key",
                                                                                   type=dynamodb.AttributeType.STRING),
                                                  sort_key=dynamodb.Attribute(name="sort_key",
-                                                                             type=dynamodb.AttributeType.STRING))
+                                                                             type=dynamodb.AttributeType.STRING),
+                                                 # Expires embedding cache entries stored next to the index audit records
+                                                 time_to_live_attribute="expire_epoch")
+        # Files of a user, newest upload first. Sparse, only the index audit records carry email_id,
+        # and the full error message stays out of the projection, the listing shows its summary
+        self.indx_dynamodb.add_global_secondary_index(index_name='email_id-upload_timestamp-index',
+                                                      partition_key=dynamodb.Attribute(name="email_id",
+                                                                                       type=dynamodb.AttributeType.STRING),
+                                                      sort_key=dynamodb.Attribute(name="upload_timestamp",
+                                                                                  type=dynamodb.AttributeType.STRING),
+                                                      projection_type=dynamodb.ProjectionType.INCLUDE,
+                                                      non_key_attributes=["file_id", "s3_source", "file_index_status", "idx_err_summary",
+                                                                          "index_stats", "update_epoch", "index_timestamp"],
+                                                      read_capacity=5,
+                                                      write_capacity=5)
+        self.indx_dynamodb.auto_scale_global_secondary_index_read_capacity('email_id-upload_timestamp-index', min_capacity=5, max_capacity=50)\
+            .scale_on_utilization(target_utilization_percent=75)
+        self.indx_dynamodb.auto_scale_global_secondary_index_write_capacity('email_id-upload_timestamp-index', min_capacity=5, max_capacity=50)\
+            .scale_on_utilization(target_utilization_percent=75)
+
         # add auto scaling policy for dynamodb read and write
         read_scaling_indx = self.indx_dynamodb.auto_scale_read_capacity(min_capacity=5, max_capacity=50)
         read_scaling_indx.scale_on_utilization(
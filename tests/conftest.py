@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The Lambda sources are flat modules packaged from their own directories, not installable packages
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for lambda_dir in ['index_lambda', 'query_lambda']:
+    sys.path.insert(0, os.path.join(ROOT, 'artifacts', 'bedrock_lambda', lambda_dir))
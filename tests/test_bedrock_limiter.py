@@ -0,0 +1,96 @@
+import pytest
+
+import bedrock_limiter
+from bedrock_limiter import AdaptiveConcurrencyLimiter, ThrottledBedrockClient
+
+
+class ThrottlingException(Exception):
+
+    def __init__(self):
+        super().__init__('Rate exceeded')
+        self.response = {'Error': {'Code': 'ThrottlingException'}}
+
+
+class FakeClient():
+
+    def __init__(self, throttles=0, events=None):
+        self.throttles = throttles
+        self.events = events or []
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise ThrottlingException()
+        return {'body': 'ok'}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.calls += 1
+        return {'body': iter(self.events)}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bedrock_limiter.time, 'sleep', lambda seconds: None)
+
+
+def test_limit_grows_after_a_window_of_successes():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=4)
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.stats()['bedrock_limit'] == 3
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.stats()['bedrock_limit'] == 4
+
+
+def test_limit_halves_on_throttle_down_to_the_minimum():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, min_limit=1, max_limit=8)
+    for expected in [4, 2, 1, 1]:
+        limiter.acquire()
+        limiter.release(throttled=True)
+        assert limiter.stats()['bedrock_limit'] == expected
+    assert limiter.stats()['bedrock_throttles'] == 4
+
+
+def test_throttled_calls_are_retried_and_cut_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, min_limit=1, max_limit=4)
+    client = FakeClient(throttles=2)
+    response = ThrottledBedrockClient(client, limiter, max_retries=3).invoke_model(modelId='model')
+    assert response == {'body': 'ok'}
+    assert client.calls == 3
+    # Halved to the floor by the two throttles, then the success fills a window of one
+    assert limiter.stats() == {'bedrock_limit': 2, 'bedrock_successes': 1, 'bedrock_throttles': 2}
+    assert limiter.in_flight == 0
+
+
+def test_retries_give_up_after_max_retries():
+    limiter = AdaptiveConcurrencyLimiter()
+    client = FakeClient(throttles=10)
+    with pytest.raises(ThrottlingException):
+        ThrottledBedrockClient(client, limiter, max_retries=2).invoke_model(modelId='model')
+    assert client.calls == 3
+    assert limiter.in_flight == 0
+
+
+def test_stream_holds_its_slot_until_drained():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+    client = FakeClient(events=[{'chunk': 1}, {'chunk': 2}])
+    response = ThrottledBedrockClient(client, limiter).invoke_model_with_response_stream(modelId='model')
+    assert limiter.in_flight == 1
+    assert list(response['body']) == [{'chunk': 1}, {'chunk': 2}]
+    assert limiter.in_flight == 0
+    assert limiter.stats()['bedrock_throttles'] == 0
+
+
+def test_throttle_event_in_a_stream_cuts_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+    client = FakeClient(events=[{'chunk': 1}, {'throttlingException': {'message': 'slow down'}}])
+    response = ThrottledBedrockClient(client, limiter).invoke_model_with_response_stream(modelId='model')
+    for event in response['body']:
+        if 'chunk' not in event:
+            break
+    assert limiter.in_flight == 0
+    assert limiter.stats()['bedrock_limit'] == 2
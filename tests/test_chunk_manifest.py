@@ -0,0 +1,42 @@
+from chunk_manifest import ChunkManifest, ChunkReuse, chunk_content_hash, manifest_key
+
+
+def manifest_with(chunks):
+    manifest = ChunkManifest('https://bucket/index/data/doc.pdf', 'index/data/doc.pdf')
+    for page, ordinal, text, doc_id in chunks:
+        chunk_id = manifest.add(page, ordinal, 0, len(text), chunk_content_hash(text))
+        manifest.set_doc_id(chunk_id, doc_id)
+    return manifest
+
+
+def test_reuse_claims_unchanged_chunks_once_in_document_order():
+    previous = manifest_with([(0, 0, 'same', 'id-1'), (0, 1, 'other', 'id-2'), (1, 0, 'same', 'id-3')])
+    reuse = ChunkReuse(previous)
+    assert reuse.claim(chunk_content_hash('same')) == 'id-1'
+    assert reuse.claim(chunk_content_hash('same')) == 'id-3'
+    assert reuse.claim(chunk_content_hash('same')) is None
+    assert reuse.claim(chunk_content_hash('new')) is None
+    assert reuse.unclaimed() == ['id-2']
+    assert reuse.reused == 2
+
+
+def test_reuse_skips_ids_taken_by_an_earlier_invocation():
+    previous = manifest_with([(0, 0, 'same', 'id-1'), (1, 0, 'same', 'id-2')])
+    reuse = ChunkReuse(previous, exclude_doc_ids=['id-1'])
+    assert reuse.claim(chunk_content_hash('same')) == 'id-2'
+    assert reuse.unclaimed() == []
+    assert reuse.reused == 2
+
+
+def test_reuse_is_limited_to_the_page_range_of_a_shard():
+    previous = manifest_with([(0, 0, 'a', 'id-1'), (5, 0, 'b', 'id-2'), (10, 0, 'c', 'id-3')])
+    reuse = ChunkReuse(previous, page_range=(5, 10))
+    assert reuse.claim(chunk_content_hash('a')) is None
+    assert reuse.claim(chunk_content_hash('b')) == 'id-2'
+    assert sorted(reuse.unclaimed()) == []
+
+
+def test_manifest_keys_stay_out_of_the_upload_prefix():
+    for namespace in [None, 'sample-index-v2']:
+        for shard in [None, '0-50']:
+            assert not manifest_key('index/data/doc.pdf', shard, namespace).startswith('index/')
@@ -0,0 +1,31 @@
+from context_builder import build_context, estimate_tokens
+
+
+def test_context_stays_within_the_budget():
+    chunks = [' '.join(f'Sentence {chunk} {number} says something.' for number in range(20)) for chunk in range(10)]
+    context, report = build_context(chunks, budget_tokens=200)
+    assert estimate_tokens(context) <= 200
+    assert report['used_tokens'] <= 200
+    assert report['chunks_used'] >= 1
+    assert report['dropped_tokens'] > 0
+    # The best ranked chunk comes first
+    assert context.startswith('Sentence 0 0')
+
+
+def test_repeated_sentences_are_sent_once():
+    first = 'The cat sat on the mat. It was warm. The sun was out.'
+    overlapping = 'The sun was out. Birds were singing.'
+    repeat = 'The cat sat on the mat. It was warm.'
+    context, report = build_context([first, overlapping, repeat], budget_tokens=1000)
+    assert context.count('The sun was out.') == 1
+    assert 'Birds were singing.' in context
+    assert report['chunks_repeated'] == 1
+    assert report['chunks_used'] == 2
+
+
+def test_chunk_cut_at_a_sentence_boundary():
+    chunk = 'One two three four. Five six seven eight. Nine ten eleven twelve.'
+    context, report = build_context([chunk, 'Never reached.'], budget_tokens=12)
+    assert context == 'One two three four.'
+    assert report['chunks_trimmed'] == 1
+    assert report['chunks_dropped'] == 1
@@ -0,0 +1,33 @@
+from ingestion_queue import fair_order, split_page_ranges
+
+
+def entry(tenant, deferrals=0):
+    return {'tenant': tenant, 'deferrals': deferrals}
+
+
+def test_fair_order_round_robins_tenants():
+    entries = [entry('a'), entry('a'), entry('b'), entry('a'), entry('b'), entry('c')]
+    ordered, deferred = fair_order(entries, tenant_share=2)
+    assert [e['tenant'] for e in ordered] == ['a', 'b', 'c', 'a', 'b']
+    assert [e['tenant'] for e in deferred] == ['a']
+
+
+def test_fair_order_keeps_entries_deferred_too_often():
+    entries = [entry('a'), entry('a', deferrals=5), entry('b')]
+    ordered, deferred = fair_order(entries, tenant_share=1, max_deferrals=5)
+    assert len(ordered) == 3
+    assert deferred == []
+
+
+def test_fair_order_does_not_defer_a_single_tenant():
+    entries = [entry('a') for _ in range(10)]
+    ordered, deferred = fair_order(entries, tenant_share=1)
+    assert len(ordered) == 10
+    assert deferred == []
+
+
+def test_split_page_ranges_covers_every_page():
+    assert split_page_ranges(120, 50) == [(0, 50), (50, 100), (100, 120)]
+    assert split_page_ranges(50, 50) == [(0, 50)]
+    assert split_page_ranges(0, 50) == []
+    assert split_page_ranges(3, 0) == [(0, 1), (1, 2), (2, 3)]
@@ -0,0 +1,33 @@
+from result_fusion import fuse_results
+
+
+def hit(doc_id, score, text=None):
+    return {'_id': doc_id, '_score': score, 'fields': {'text': [text or f'text of {doc_id}']}}
+
+
+def test_rrf_ranks_hits_found_by_both_lists_first():
+    vector = [hit('a', 0.9), hit('b', 0.8), hit('c', 0.7)]
+    keyword = [hit('c', 12.0), hit('d', 9.0)]
+    results = fuse_results([vector, keyword], method='rrf', top_k=10)
+    assert [result['_id'] for result in results] == ['c', 'a', 'b', 'd']
+    assert results[0]['_fused_score'] > results[1]['_fused_score']
+
+
+def test_duplicate_texts_are_kept_once():
+    vector = [hit('a', 0.9, 'same chunk'), hit('b', 0.8, 'same chunk'), hit('c', 0.7)]
+    results = fuse_results([vector], top_k=10)
+    assert [result['_id'] for result in results] == ['a', 'c']
+
+
+def test_blend_normalizes_scores_per_list():
+    vector = [hit('a', 0.9), hit('b', 0.1)]
+    keyword = [hit('b', 30.0), hit('a', 10.0)]
+    results = fuse_results([vector, keyword], weights=[0.7, 0.3], method='blend', top_k=10)
+    assert [result['_id'] for result in results] == ['a', 'b']
+    assert results[0]['_fused_score'] == 0.7
+
+
+def test_top_k_and_empty_lists():
+    vector = [hit(str(number), 1.0 / (number + 1)) for number in range(20)]
+    assert len(fuse_results([vector, []], top_k=5)) == 5
+    assert fuse_results([[], []]) == []
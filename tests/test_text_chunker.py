@@ -0,0 +1,25 @@
+from text_chunker import iter_chunks_with_offsets, iter_text_windows
+
+TEXT = '\n'.join(f'Line {number} of the sample document, with a few more words to split on.' for number in range(200))
+
+
+def test_offsets_point_at_the_chunk_text():
+    for offset, chunk in iter_chunks_with_offsets([TEXT], chunk_size=120, chunk_overlap=10):
+        assert TEXT[offset:offset + len(chunk)] == chunk
+
+
+def test_offsets_survive_window_edges():
+    windows = list(iter_text_windows(TEXT, window_chars=700))
+    assert len(windows) > 1
+    assert ''.join(windows) == TEXT
+    chunks = list(iter_chunks_with_offsets(windows, chunk_size=120, chunk_overlap=10))
+    for offset, chunk in chunks:
+        assert TEXT[offset:offset + len(chunk)] == chunk
+    offsets = [offset for offset, chunk in chunks]
+    assert offsets == sorted(offsets)
+
+
+def test_windows_match_a_single_split():
+    whole = [chunk for offset, chunk in iter_chunks_with_offsets([TEXT], chunk_size=120, chunk_overlap=10)]
+    windowed = [chunk for offset, chunk in iter_chunks_with_offsets(iter_text_windows(TEXT, window_chars=700), chunk_size=120, chunk_overlap=10)]
+    assert windowed == whole